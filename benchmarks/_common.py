@@ -0,0 +1,25 @@
+"""
+Helpers shared by the benchmark scripts. Importing this puts the repository root on the path, so
+the scripts can import dropbot when run directly.
+"""
+import sys
+import os
+from timeit import default_timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def timed(func, *args, **kwargs):
+    """Run a function, returning the result and the time taken in seconds"""
+    start = default_timer()
+    res = func(*args, **kwargs)
+    return res, default_timer() - start
+
+
+def report(name, count, seconds, unit='calls', extra=None):
+    """Print the time taken for count calls, with optional extra columns"""
+    line = '{:<44} {:>7} {:<5} {:>10.3f}s {:>10.1f}us/call'.format(
+        name, count, unit, seconds, (seconds / count) * 1000000)
+    if extra:
+        line += ' ' + extra
+    print(line)
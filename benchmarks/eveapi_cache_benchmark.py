@@ -0,0 +1,113 @@
+"""
+Benchmarks storing and retrieving EVE API documents with EVEAPIRedisCache against a local fake
+Redis that adds a fixed latency to each round trip, comparing the original set + expire with
+zlib level 9 to the current settings.
+
+    $ python benchmarks/eveapi_cache_benchmark.py [latency in ms]
+"""
+import sys
+import time
+import zlib
+from hashlib import sha1
+from timeit import default_timer
+
+from _common import report
+
+import mock
+
+from dropbot.utils import EVEAPIRedisCache
+from tests.fake_redis import FakeRedis, FakePipeline
+
+
+class SlowRedis(FakeRedis):
+    """A FakeRedis that sleeps for latency seconds on every round trip"""
+
+    def __init__(self, latency):
+        super(SlowRedis, self).__init__()
+        self.latency = latency
+
+    def get(self, key):
+        time.sleep(self.latency)
+        return super(SlowRedis, self).get(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        time.sleep(self.latency)
+        return super(SlowRedis, self).set(key, value, ex, nx)
+
+    def expire(self, key, time_):
+        time.sleep(self.latency)
+        return super(SlowRedis, self).expire(key, time_)
+
+    def pipeline(self, transaction=True):
+        return SlowPipeline(self)
+
+
+class SlowPipeline(FakePipeline):
+
+    def execute(self):
+        # Run the queued commands on the plain FakeRedis methods, paying one round trip
+        time.sleep(self.redis.latency)
+        self.redis.pipelines += 1
+        queued, self.queued = self.queued, []
+        return [getattr(FakeRedis, func.__name__)(self.redis, *args, **kwargs) for func, args, kwargs in queued]
+
+
+class OriginalEVEAPIRedisCache(object):
+    """The original cache, unordered keys, zlib level 9 and separate set and expire"""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.local = None
+
+    @staticmethod
+    def gen_key(host, path, params):
+        params = ''.join(['{}={}'.format(x, y) for x, y in params.items()])
+        return 'eveapi_cache_{}'.format(sha1(''.join((host, path, params))).hexdigest())
+
+    def retrieve(self, host, path, params):
+        val = self.redis.get(self.gen_key(host, path, params))
+        if val:
+            return zlib.decompress(val)
+
+    def store(self, host, path, params, doc, obj):
+        key = self.gen_key(host, path, params)
+        self.redis.set(key, zlib.compress(doc, 9))
+        self.redis.expire(key, obj.cachedUntil - obj.currentTime)
+
+
+def asset_list(rows):
+    return '<?xml version="1.0"?><eveapi version="2"><result><rowset name="assets">{}</rowset></result></eveapi>'.format(
+        ''.join('<row itemID="{}" locationID="60003760" typeID="{}" quantity="{}" flag="4" singleton="0" />'.format(
+            x, 18 + x % 3000, x * 7 % 10000) for x in xrange(rows)))
+
+
+def main():
+    latency = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.0002
+    times = mock.Mock(currentTime=0, cachedUntil=3600)
+    params = {'keyID': 123456, 'vCode': 'abcdef', 'characterID': 90000001}
+    caches = [
+        ('original (zlib 9, set + expire)', lambda redis: OriginalEVEAPIRedisCache(redis)),
+        ('zlib 1, no local cache', lambda redis: EVEAPIRedisCache(redis, l1_size=0)),
+        ('bz2 1, no local cache', lambda redis: EVEAPIRedisCache(redis, compression='bz2', l1_size=0)),
+        ('zlib 1, local cache', lambda redis: EVEAPIRedisCache(redis)),
+    ]
+    for name, size in (('small', 5), ('large', 20000)):
+        doc = asset_list(size)
+        print('{} document, {} bytes'.format(name, len(doc)))
+        for label, factory in caches:
+            redis = SlowRedis(latency)
+            cache = factory(redis)
+            count = 200 if size < 100 else 20
+            start = default_timer()
+            for x in range(count):
+                cache.store('api.eveonline.com', '/corp/AssetList.xml.aspx', params, doc, times)
+            report('store, ' + label, count, default_timer() - start,
+                   extra='{:>9} bytes'.format(len(redis.data.values()[0])))
+            start = default_timer()
+            for x in range(count):
+                cache.retrieve('api.eveonline.com', '/corp/AssetList.xml.aspx', params)
+            report('retrieve, ' + label, count, default_timer() - start)
+
+
+if __name__ == '__main__':
+    main()
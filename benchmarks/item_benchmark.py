@@ -0,0 +1,36 @@
+"""
+Benchmarks the item name lookups used by DropBot._item_picker, using the packaged types data
+
+    $ python benchmarks/item_benchmark.py
+"""
+import pkgutil
+from json import loads
+
+from _common import timed, report
+
+from dropbot.utils import SubstringIndex
+
+
+def main():
+    types = loads(pkgutil.get_data('dropbot', 'data/types.json'))
+    items = ['rifter', 'Jackdaw', 'armor repairer', 'plex', 'tritanium', 'caldari navy', 'xx', 'asdasdasd'] * 10
+
+    def scan():
+        for item in items:
+            dict([(i, v) for i, v in types.iteritems() if item.lower() in v.lower()])
+
+    index, seconds = timed(SubstringIndex, types.iteritems())
+    report('SubstringIndex (build)', 1, seconds)
+
+    def indexed():
+        for item in items:
+            dict(index.search(item))
+
+    res, seconds = timed(scan)
+    report('item lookup (full scan)', len(items), seconds)
+    res, seconds = timed(indexed)
+    report('item lookup (trigram index)', len(items), seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Benchmarks the throughput of the kill feed processing, replaying a recorded killmail stream
+(one JSON killmail per line). Without a stream file a synthetic one is generated. The end to end
+replay runs at the given speed multiplier, or as fast as possible if it is 0.
+
+    $ python benchmarks/killfeed_benchmark.py [stream.jsonl] [speed]
+"""
+import sys
+import os
+import json
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+from _common import timed, report
+
+import mock
+
+from dropbot.metrics import Metrics
+from dropbot.stomp_listener import ZKillboardStompListener
+from dropbot.killfeed import ReplayKillSource
+
+
+def rate(count, seconds):
+    return '{:>10.0f} msg/s'.format(count / seconds)
+
+
+def synthetic_stream(count=20000, corps=2000):
+    """Generates killmails with a spread of values, ages and attacker counts"""
+    now = datetime.utcnow()
+    random.seed(1)
+    for kill_id in xrange(count):
+        yield json.dumps({
+            'killID': kill_id,
+            'killTime': (now - timedelta(seconds=random.randint(0, 7200))).strftime('%Y-%m-%d %H:%M:%S'),
+            'victim': {'corporationID': random.randint(1, corps), 'allianceID': 0},
+            'attackers': [{'corporationID': random.randint(1, corps), 'allianceID': 0}
+                          for x in range(random.choice([1, 2, 5, 10, 50, 200]))],
+            'zkb': {'totalValue': random.choice([10000.0, 500000.0, 5000000.0, 1000000000.0])},
+        })
+
+
+def fake_bot(kill_corps):
+    bot = mock.Mock()
+    bot.kill_corps = frozenset(kill_corps)
+    bot.kill_alliances = frozenset()
+    bot.kill_min_value = 1000000
+    bot.kill_max_age = 3600
+    bot.kills_muted = True
+    bot.redis = None
+    bot.kill_dedupe_window = 1000
+    bot.kill_dedupe_shared = False
+    bot.kill_dedupe_ttl = 3600
+    bot.stomp_queue_size = 1000
+    bot.kill_replay_speed = 0
+    bot.metrics = Metrics()
+    bot.call_command = lambda *args, **kwargs: ('', None)
+    return bot
+
+
+def old_on_message(ids, kill_corps, message):
+    """The original listener, a list for dedupe and kill_corps, filtering after the attacker scan"""
+    kill = json.loads(message)
+    kill_type = None
+    if kill['killID'] in ids:
+        return
+    ids.pop(0)
+    ids.append(kill['killID'])
+    for attacker in kill['attackers']:
+        if int(attacker['corporationID']) in kill_corps:
+            kill_type = 'KILL'
+            break
+    if int(kill['victim']['corporationID']) in kill_corps:
+        kill_type = 'LOSS'
+    if not kill_type:
+        return
+    age = (datetime.utcnow() - datetime.strptime(kill['killTime'], '%Y-%m-%d %H:%M:%S'))
+    if age.total_seconds() > 60 * 60:
+        return
+    if float(kill['zkb']['totalValue']) < 1000000:
+        return
+    return kill_type
+
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as f:
+            messages = [x for x in f if x.strip()]
+    else:
+        messages = list(synthetic_stream())
+    speed = float(sys.argv[2]) if len(sys.argv) > 2 else 0
+    kill_corps = range(1, 51)
+
+    def old():
+        ids = [None for x in range(50)]
+        corps = list(kill_corps)
+        for message in messages:
+            old_on_message(ids, corps, message)
+
+    def new():
+        listener = ZKillboardStompListener(fake_bot(kill_corps))
+        for message in messages:
+            listener.process({}, message)
+        return listener
+
+    res, seconds = timed(old)
+    report('on_message (list, filter last)', len(messages), seconds, extra=rate(len(messages), seconds))
+    listener, seconds = timed(new)
+    report('process (frozenset, prefilter)', len(messages), seconds, extra=rate(len(messages), seconds))
+    print('{} filtered, {} duplicates'.format(listener.filtered, listener.duplicates))
+
+    # End to end replay, in kill time order
+    fd, path = tempfile.mkstemp(suffix='.jsonl')
+    with os.fdopen(fd, 'w') as f:
+        for message in sorted(messages, key=lambda x: json.loads(x)['killTime']):
+            f.write(message.strip() + '\n')
+    try:
+        bot = fake_bot(kill_corps)
+        bot.kill_replay_speed = speed
+        source = ReplayKillSource(bot)
+        source.connect('file://' + path)
+        source.wait()
+        source.stop()
+    finally:
+        os.unlink(path)
+    stats = source.stats()
+    report('replay at {}x (end to end)'.format(speed), stats['processed'], stats['elapsed'],
+           extra=rate(stats['processed'], stats['elapsed']))
+    print('{processed} processed, {dropped} dropped, {filtered} filtered'.format(**stats))
+
+
+if __name__ == '__main__':
+    main()
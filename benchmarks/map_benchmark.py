@@ -0,0 +1,151 @@
+"""
+Benchmarks for the dropbot.map routing and lookup code, using the packaged map data
+
+    $ python benchmarks/map_benchmark.py
+"""
+import pkgutil
+
+from _common import timed, report
+
+import networkx
+
+from dropbot.map import Map, EVE_LY, calc_distance
+
+
+def scan_neighbors_jump(map, system_id, range):
+    """The original neighbors_jump implementation, a bounding box check over every node"""
+    source = map.node[system_id]
+    range_x = (source['coords'][0] + (range * EVE_LY), source['coords'][0] - (range * EVE_LY))
+    range_y = (source['coords'][1] + (range * EVE_LY), source['coords'][1] - (range * EVE_LY))
+    range_z = (source['coords'][2] + (range * EVE_LY), source['coords'][2] - (range * EVE_LY))
+
+    destinations = []
+    for destination_id, destination_data in map.nodes_iter(data=True):
+        if destination_data['coords'][0] > range_x[0] or destination_data['coords'][0] < range_x[1] or \
+           destination_data['coords'][1] > range_y[0] or destination_data['coords'][1] < range_y[1] or \
+           destination_data['coords'][2] > range_z[0] or destination_data['coords'][2] < range_z[1]:
+            continue
+        distance = calc_distance(source['coords'], destination_data['coords'])
+        if distance <= range and destination_id != system_id:
+            destinations.append((destination_data, distance))
+    return destinations
+
+
+def bench_system_lookup(map):
+    names = ['Jita', 'Amarr', 'U-HVIX', 'GE-', 'J', 'Ji', 'Llamatron'] * 10
+
+    def lookup():
+        for name in names:
+            map.get_system_id(name)
+            map.get_systems(name)
+
+    res, seconds = timed(lambda: map.name_index)
+    report('Map.name_index (build)', 1, seconds)
+    res, seconds = timed(lookup)
+    report('get_system_id + get_systems', len(names), seconds)
+
+
+def bench_neighbors_jump(map):
+    systems = [k for k, v in map.nodes_iter(data=True) if v['security'] < 0.45][:500]
+    map.reindex()
+
+    def scan():
+        for system_id in systems:
+            scan_neighbors_jump(map, system_id, 8)
+
+    def grid():
+        for system_id in systems:
+            map.spatial_index.query(map.node[system_id]['coords'], 8)
+
+    def vectorized():
+        for system_id in systems:
+            map.systems_in_range(map.node[system_id]['coords'], 8)
+
+    def indexed():
+        for system_id in systems:
+            map.neighbors_jump(system_id, 8)
+
+    res, seconds = timed(scan)
+    report('neighbors_jump (full scan)', len(systems), seconds)
+    res, seconds = timed(grid)
+    report('range query (spatial index)', len(systems), seconds)
+    if map.coordinate_matrix is not None:
+        res, seconds = timed(vectorized)
+        report('range query (NumPy)', len(systems), seconds)
+    res, seconds = timed(indexed)
+    report('neighbors_jump (cold)', len(systems), seconds)
+    res, seconds = timed(indexed)
+    report('neighbors_jump (warm)', len(systems), seconds)
+
+
+def bench_jump_cache(map):
+    data, seconds = timed(map.dump_jump_cache)
+    report('Map.dump_jump_cache ({} bytes)'.format(len(data)), 1, seconds)
+    res, seconds = timed(map.load_jump_cache, data)
+    report('Map.load_jump_cache', 1, seconds)
+
+
+def bench_route_jump(map):
+    routes = [
+        ('U-HVIX', 'Podion', 'carrier'),
+        ('1DQ1-A', 'VFK-IV', 'blackops'),
+        ('HED-GP', 'Amamake', 'carrier'),
+        ('B-R5RB', 'O-IOAI', 'carrier'),
+        ('D-PNP9', 'K-6K16', 'jumpfreighter'),
+        ('J5A-IX', 'MJXW-P', 'carrier'),
+    ]
+    routes = [(map.get_system_id(x), map.get_system_id(y), z) for x, y, z in routes]
+
+    def route():
+        for source, destination, ship_class in routes:
+            map.route_jump(source, destination, ship_class=ship_class)
+
+    res, seconds = timed(route)
+    report('route_jump (cold)', len(routes), seconds)
+    res, seconds = timed(route)
+    report('route_jump (warm)', len(routes), seconds)
+
+
+def bench_route_gate(map):
+    routes = [('Jita', 'Amarr'), ('Jita', 'Dodixie'), ('Rens', 'Amarr'), ('HED-GP', 'Amamake'), ('1DQ1-A', 'VFK-IV')]
+    routes = [(map.get_system_id(x), map.get_system_id(y)) for x, y in routes]
+
+    def astar():
+        for source, destination in routes:
+            networkx.astar_path(map, source, destination)
+
+    def bfs():
+        for source, destination in routes:
+            map.route_gate(source, destination)
+
+    def highsec():
+        for source, destination in routes:
+            map.route_gate(source, destination, preference='highsec')
+
+    res, seconds = timed(astar)
+    report('route_gate (networkx astar_path)', len(routes), seconds)
+    res, seconds = timed(lambda: map.gate_graph)
+    report('Map.gate_graph (build)', 1, seconds)
+    res, seconds = timed(bfs)
+    report('route_gate (bidirectional BFS)', len(routes), seconds)
+    res, seconds = timed(highsec)
+    report('route_gate (prefer highsec)', len(routes), seconds)
+
+
+def main():
+    data = pkgutil.get_data('dropbot', 'data/map.json')
+    map, seconds = timed(Map.from_json, data)
+    report('Map.from_json ({} bytes)'.format(len(data)), 1, seconds)
+    binary = map.to_binary()
+    res, seconds = timed(Map.from_binary, binary)
+    report('Map.from_binary ({} bytes)'.format(len(binary)), 1, seconds)
+
+    bench_system_lookup(map)
+    bench_neighbors_jump(map)
+    bench_route_gate(map)
+    bench_route_jump(map)
+    bench_jump_cache(map)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+Benchmarks the overhead the dropbot.metrics instrumentation adds to each call
+
+    $ python benchmarks/metrics_benchmark.py
+"""
+from timeit import default_timer
+
+from _common import timed, report
+
+from dropbot.metrics import Metrics
+
+
+def command(args, msg):
+    return ' '.join(args)
+
+
+def main():
+    metrics = Metrics()
+    count = 100000
+    args = ['Jita', 'Amarr']
+
+    def bare():
+        for x in xrange(count):
+            command(args, None)
+
+    def observed():
+        for x in xrange(count):
+            start = default_timer()
+            command(args, None)
+            metrics.observe('command', 'bench', default_timer() - start)
+
+    def with_timer():
+        for x in xrange(count):
+            with metrics.timer('command', 'bench'):
+                command(args, None)
+
+    res, base = timed(bare)
+    report('uninstrumented call', count, base)
+    res, seconds = timed(observed)
+    report('Metrics.observe', count, seconds)
+    print('{:<40} {:>10.2f}us/call'.format('observe overhead', (seconds - base) / count * 1000000))
+    res, seconds = timed(with_timer)
+    report('Metrics.timer', count, seconds)
+    print('{:<40} {:>10.2f}us/call'.format('timer overhead', (seconds - base) / count * 1000000))
+    res, seconds = timed(metrics.render)
+    report('Metrics.render', 1, seconds)
+
+
+if __name__ == '__main__':
+    main()
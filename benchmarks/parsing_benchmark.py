@@ -0,0 +1,111 @@
+"""
+Benchmarks parsing a large EVE API AssetList, comparing building the whole document with
+ElementTree to streaming its rows with EVEAPIRowStream. Without a recorded AssetList file a
+synthetic one of corp hangars full of items is generated. Each parser runs in its own process
+so its peak memory can be reported.
+
+    $ python benchmarks/parsing_benchmark.py [AssetList.xml]
+"""
+import sys
+import os
+import random
+import resource
+import tempfile
+from StringIO import StringIO
+from multiprocessing import Process, Queue
+from timeit import default_timer
+from xml.etree import ElementTree
+
+from _common import report
+
+from dropbot.parsing import EVEAPIRowStream, parse_marketstat
+from tests.http_stub import marketstat_response
+
+
+def synthetic_asset_list(f, offices=200, items=500):
+    """Writes an AssetList of offices, each holding containers of items"""
+    random.seed(1)
+    f.write("<?xml version='1.0' encoding='UTF-8'?>\n<eveapi version=\"2\">\n")
+    f.write('<currentTime>2014-07-01 12:00:00</currentTime>\n<result>\n')
+    f.write('<rowset name="assets" key="itemID" columns="itemID,locationID,typeID,quantity,flag,singleton">\n')
+    item_id = 1
+    for office in xrange(offices):
+        location_id = 66000000 + random.randint(1, 50000)
+        f.write('<row itemID="{}" locationID="{}" typeID="27" quantity="1" flag="0" singleton="1">\n'.format(
+            item_id, location_id))
+        f.write('<rowset name="contents" key="itemID" columns="itemID,typeID,quantity,flag,singleton">\n')
+        for x in xrange(items):
+            item_id += 1
+            f.write('<row itemID="{}" typeID="{}" quantity="{}" flag="{}" singleton="0" />\n'.format(
+                item_id, random.randint(18, 30000), random.randint(1, 100000), random.randint(4, 130)))
+        f.write('</rowset>\n</row>\n')
+        item_id += 1
+    f.write('</rowset>\n</result>\n<cachedUntil>2014-07-01 18:00:00</cachedUntil>\n</eveapi>\n')
+
+
+def tree_offices(path):
+    """The previous approach, building the document then finding the offices"""
+    root = ElementTree.parse(path).getroot()
+    return [x.get('locationID') for x in root.findall('./result/rowset/row') if x.get('typeID') == '27']
+
+
+def stream_offices(path):
+    with open(path) as f:
+        return [x['locationID'] for x in EVEAPIRowStream(f, fields=('locationID', 'typeID')) if x['typeID'] == '27']
+
+
+def run(func, path, queue):
+    start = default_timer()
+    res = func(path)
+    seconds = default_timer() - start
+    queue.put((len(res), seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def measure(func, path):
+    """Run a parser in a new process, returning the offices found, seconds taken and peak RSS in KB"""
+    queue = Queue()
+    process = Process(target=run, args=(func, path, queue))
+    process.start()
+    res = queue.get()
+    process.join()
+    return res
+
+
+def main():
+    if len(sys.argv) > 1:
+        path, generated = sys.argv[1], False
+    else:
+        fd, path = tempfile.mkstemp(suffix='.xml')
+        with os.fdopen(fd, 'w') as f:
+            synthetic_asset_list(f)
+        generated = True
+    try:
+        print('AssetList of {:.1f}MB'.format(os.path.getsize(path) / 1024.0 / 1024.0))
+        baseline = measure(lambda path: [], path)[2]
+        for name, func in (('ElementTree.parse + findall', tree_offices), ('EVEAPIRowStream', stream_offices)):
+            count, seconds, memory = measure(func, path)
+            report(name, count, seconds, unit='rows', extra='{:>8.1f}MB peak'.format((memory - baseline) / 1024.0))
+    finally:
+        if generated:
+            os.unlink(path)
+
+    # A marketstat response for many types, parsed in one pass
+    type_ids = range(1, 101)
+    doc = marketstat_response(type_ids)
+
+    def findall():
+        root = ElementTree.fromstring(doc)
+        for type_id in type_ids:
+            root.findall("./marketstat/type[@id='{}']/sell/min".format(type_id))
+            root.findall("./marketstat/type[@id='{}']/buy/max".format(type_id))
+
+    for name, func in (('marketstat fromstring + findall', findall),
+                       ('parse_marketstat', lambda: parse_marketstat(StringIO(doc)))):
+        start = default_timer()
+        for x in range(10):
+            func()
+        report(name, 10 * len(type_ids), default_timer() - start, unit='types')
+
+
+if __name__ == '__main__':
+    main()
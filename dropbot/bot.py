@@ -1,5 +1,9 @@
 from datetime import datetime
-from xml.etree import ElementTree
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+from time import time
+import os
+import mmap
 import pkgutil
 from json import loads as base_loads
 from random import choice
@@ -7,16 +11,24 @@ import logging
 import re
 import urlparse
 
-from sleekxmpp import ClientXMPP
+from sleekxmpp import ClientXMPP, JID
 from redis import Redis, ConnectionPool
 import requests
 from humanize import intcomma, naturaltime, intword
 from pyzkb import ZKillboard
 from eveapi import EVEAPIConnection
-
-from dropbot.map import Map, base_range, ship_class_to_range
-from dropbot.utils import EVEAPIRedisCache
+import eveapi
+
+from dropbot.map import Map, base_range, ship_class_to_range, ROUTE_SHORTEST, ROUTE_AVOID_LOWSEC, ROUTE_PREFERENCES
+from dropbot.utils import EVEAPIRedisCache, EVEAPISessionHandler, SubstringIndex
+from dropbot.cache import PriceCache, RefreshingCache, TieredCache, CachePolicy, FetchError
+from dropbot.executor import CommandExecutor
+from dropbot.commands import CommandRegistry, command, COST_NETWORK, COST_SLOW
+from dropbot.metrics import Metrics, MetricsServer
+from dropbot.broadcast import BroadcastScheduler
 from dropbot.stomp_listener import ZKillboardStompListener
+from dropbot.killfeed import ReplayKillSource
+from dropbot.parsing import EVEAPIRowStream, parse_marketstat
 
 urlparse.uses_netloc.append("redis")
 
@@ -28,19 +40,88 @@ class UnknownCommandException(Exception):
 
 
 class DropBot(ClientXMPP):
+    __metaclass__ = CommandRegistry
+
+    # Most types to request in one EVE-Central marketstat call
+    marketstat_batch_size = 100
+
+    # Kill feed implementations, by the scheme of the kill source URL
+    kill_sources = {
+        'tcp': ZKillboardStompListener,
+        'file': ReplayKillSource,
+    }
+
+    # Maximum number of concurrent calls of each command, by cost class
+    cost_limits = {
+        COST_NETWORK: 4,
+        COST_SLOW: 1,
+    }
+
+    # Caching of external API calls by endpoint, seconds fresh, served stale and to remember errors
+    http_cache_policies = {
+        'imgur': CachePolicy(60 * 60, 24 * 60 * 60, 5 * 60),
+        'kos': CachePolicy(60 * 60, 24 * 60 * 60, 60),
+        'zkillboard_kill': CachePolicy(24 * 60 * 60, 7 * 24 * 60 * 60, 60),
+        'zkillboard_kills': CachePolicy(5 * 60, 60 * 60, 60),
+    }
+
     def __init__(self, *args, **kwargs):
         self.rooms = kwargs.pop('rooms', [])
         self.nickname = kwargs.pop('nickname', 'Dropbot')
         self.cmd_prefix = kwargs.pop('cmd_prefix', '!')
         self.kos_url = kwargs.pop('kos_url', 'http://kos.cva-eve.org/api/')
-        self.hidden_commands = ['cmd_prefix']
+        self.admins = kwargs.pop('admins', [])
         self.last_killdate = datetime.utcnow()
-        self.kill_corps = [int(x) for x in kwargs.pop('kill_corps', [])]
+        self.kill_corps = frozenset([int(x) for x in kwargs.pop('kill_corps', [])])
+        self.kill_alliances = frozenset([int(x) for x in kwargs.pop('kill_alliances', [])])
+        self.kill_min_value = float(kwargs.pop('kill_min_value', 1000000))
+        self.kill_max_age = int(kwargs.pop('kill_max_age', 60 * 60))
         self.kills_disabled = kwargs.pop('kills_disabled', '0') == '1'
         self.kills_muted = False
+        self.kill_dedupe_window = int(kwargs.pop('kill_dedupe_window', 1000))
+        self.kill_dedupe_shared = kwargs.pop('kill_dedupe_shared', '0') == '1'
+        self.kill_dedupe_ttl = int(kwargs.pop('kill_dedupe_ttl', 3600))
+        self.kill_source_url = kwargs.pop('kill_source', 'tcp://eve-kill.net:61613')
+        if urlparse.urlparse(self.kill_source_url).scheme not in self.kill_sources:
+            logging.error('Unsupported kill source {}, please use a {} URL. Kill monitoring disabled.'.format(
+                self.kill_source_url,
+                ' or '.join('{}://'.format(x) for x in sorted(self.kill_sources)),
+            ))
+            self.kills_disabled = True
+        self.kill_replay_speed = float(kwargs.pop('kill_replay_speed', 1))
+        self.stomp_heartbeat = int(kwargs.pop('stomp_heartbeat', 10000))
+        self.stomp_queue_size = int(kwargs.pop('stomp_queue_size', 1000))
+        self.stomp_reconnect_max = float(kwargs.pop('stomp_reconnect_max', 60))
+        self.broadcaster = BroadcastScheduler(
+            self._send_room_message,
+            window=float(kwargs.pop('broadcast_window', 2)),
+            min_interval=float(kwargs.pop('broadcast_interval', 5)),
+            max_lines=int(kwargs.pop('broadcast_max_lines', 10)),
+            max_backlog=int(kwargs.pop('broadcast_max_backlog', 50)),
+        )
         self.office_api_key_keyid = kwargs.pop('office_api_keyid', None)
         self.office_api_key_vcode = kwargs.pop('office_api_vcode', None)
         self.market_systems = kwargs.pop('market_systems', ['Jita', 'Amarr', 'Rens', 'Dodixie', 'Hek'])
+        self.evecentral_url = kwargs.pop('evecentral_url', 'http://api.eve-central.com/api/')
+        self.http_timeout = float(kwargs.pop('http_timeout', 10))
+        self.market_timeout = float(kwargs.pop('market_timeout', 5))
+        self.market_workers = int(kwargs.pop('market_workers', 5))
+        self.http = requests.Session()
+        self.eveapi_url = kwargs.pop('eveapi_url', 'https://api.eveonline.com')
+        self.metrics = Metrics()
+        self.metrics_server = None
+        metrics_port = kwargs.pop('metrics_port', None)
+        metrics_host = kwargs.pop('metrics_host', '127.0.0.1')
+        if metrics_port:
+            self.metrics_server = MetricsServer(self.metrics, int(metrics_port), metrics_host)
+            self.metrics_server.start()
+            logging.info('Serving metrics on {}'.format(self.metrics_server.url))
+        self.executor = CommandExecutor(
+            workers=int(kwargs.pop('command_workers', 4)),
+            max_queue=int(kwargs.pop('command_queue', 50)),
+            timeout=float(kwargs.pop('command_timeout', 30)),
+            limits=dict((x.name, self.cost_limits[x.cost]) for x in self.commands.values() if x.cost in self.cost_limits),
+        )
 
         if 'redis_url' in kwargs:
             self.redis_pool = ConnectionPool.from_url(kwargs.pop('redis_url', 'redis://localhost:6379/0'))
@@ -48,7 +129,27 @@ class DropBot(ClientXMPP):
         else:
             logging.warning('No DROPBOT_REDIS_URL defined, EVE API calls will not be cached!')
             self.redis = None
-        self.map = Map.from_json(pkgutil.get_data('dropbot', 'data/map.json'))
+        self.eveapi_handler = EVEAPISessionHandler(
+            self.http,
+            scheme=urlparse.urlparse(self.eveapi_url).scheme,
+            cache=EVEAPIRedisCache(
+                self.redis,
+                compression=kwargs.pop('eveapi_cache_compression', 'zlib'),
+                level=int(kwargs.pop('eveapi_cache_level', 1)),
+                threshold=int(kwargs.pop('eveapi_cache_threshold', 1024)),
+                l1_size=int(kwargs.pop('eveapi_cache_local_size', 256)),
+            ) if self.redis else None,
+            timeout=self.http_timeout,
+        )
+        self.eveapi = EVEAPIConnection(self.eveapi_url, cacheHandler=self.eveapi_handler)
+        self.eve_cache = RefreshingCache()
+        self.http_cache = TieredCache(self.redis, self.http_cache_policies,
+                                      max_size=int(kwargs.pop('http_cache_size', 1024)))
+        self.price_cache = PriceCache(self.redis, ttl=int(kwargs.pop('price_cache_ttl', 300)))
+        self.map = self._load_map()
+        self.jump_cache = kwargs.pop('jump_cache', None)
+        if self.jump_cache:
+            self._load_jump_cache(self.jump_cache)
 
         jid = kwargs.pop('jid', None)
         password = kwargs.pop('password', None)
@@ -76,15 +177,62 @@ class DropBot(ClientXMPP):
             self._types = base_loads(data)
         return self._types
 
+    @property
+    def item_index(self):
+        if not hasattr(self, '_item_index'):
+            self._item_index = SubstringIndex(self.types.iteritems())
+        return self._item_index
+
+    @property
+    def market_pool(self):
+        if not hasattr(self, '_market_pool'):
+            self._market_pool = ThreadPool(self.market_workers)
+        return self._market_pool
+
     @property
     def stations(self):
-        if not hasattr(self, '_stations'):
-            data = pkgutil.get_data('dropbot', 'data/stations.json')
-            self._stations = base_loads(data)
-            logging.debug('Getting ConquerableStationList')
-            for x in self.get_eveapi().eve.ConquerableStationList().outposts:
-                self._stations[unicode(x.stationID)] = x.solarSystemID
-        return self._stations
+        return self.eve_cache.get('stations', self._fetch_stations)
+
+    def _fetch_stations(self):
+        """Returns the packaged station to system map updated with the current outposts, and the time to cache it for"""
+        if not hasattr(self, '_packaged_stations'):
+            self._packaged_stations = base_loads(pkgutil.get_data('dropbot', 'data/stations.json'))
+        stations = dict(self._packaged_stations)
+        logging.debug('Getting ConquerableStationList')
+        with self.metrics.timer('eveapi', 'ConquerableStationList'):
+            result = self.get_eveapi().eve.ConquerableStationList()
+        for x in result.outposts:
+            stations[unicode(x.stationID)] = x.solarSystemID
+        return stations, result._meta.cachedUntil - result._meta.currentTime
+
+    def _load_map(self):
+        """Loads the packaged map, using the binary format if available"""
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'map.bin')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    return Map.from_binary(data)
+                except ValueError:
+                    logging.exception('Unable to load the binary map data, falling back to JSON')
+                finally:
+                    data.close()
+        return Map.from_json(pkgutil.get_data('dropbot', 'data/map.json'))
+
+    def _load_jump_cache(self, path):
+        """Loads the jump graph cache from disk, rebuilding it if it's missing or out of date"""
+        path = os.path.expanduser(path)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                if self.map.load_jump_cache(f.read()):
+                    return
+        logging.info('Building jump graph cache at {}'.format(path))
+        data = self.map.dump_jump_cache()
+        try:
+            with open(path, 'wb') as f:
+                f.write(data)
+        except IOError:
+            logging.exception('Unable to write the jump graph cache to {}'.format(path))
 
     # Command / Connection Handling
     def handle_session_start(self, event):
@@ -95,21 +243,43 @@ class DropBot(ClientXMPP):
         for room in self.rooms:
             self.plugin['xep_0045'].joinMUC(room, self.nickname, wait=True)
 
+        self.broadcaster.start()
+
+        if self.office_api_key_keyid and self.office_api_key_vcode:
+            self.executor.submit('nearestoffice', self._warm_office_cache)
+
         # Start the killchecker if we have corps to monitor
-        if len(self.kill_corps) > 0 and not self.kills_disabled:
-            logging.info('Starting ZKB Stomp monitor for corps: {}'.format(', '.join(self.kill_corps)))
-            self.stomp = ZKillboardStompListener(self)
-            self.stomp.connect('tcp://eve-kill.net:61613')
+        if (len(self.kill_corps) > 0 or len(self.kill_alliances) > 0) and not self.kills_disabled:
+            logging.info('Starting kill monitor from {} for corps: {}, alliances: {}'.format(
+                self.kill_source_url,
+                ', '.join(map(str, self.kill_corps)),
+                ', '.join(map(str, self.kill_alliances)),
+            ))
+            self.kill_source = self.kill_sources[urlparse.urlparse(self.kill_source_url).scheme](self)
+            self.kill_source.connect(self.kill_source_url)
         else:
             logging.info('Kill monitoring disabled.')
 
+    def broadcast(self, text):
+        """Queues a message to be sent to all the rooms, batched with any others sent around the same time"""
+        for room in self.rooms:
+            self.broadcaster.queue(room, text)
+
+    def _send_room_message(self, room, body):
+        self.send_message(room, body, mtype='groupchat')
+
     def call_command(self, command, *args, **kwargs):
-        if hasattr(self, 'cmd_%s' % command):
+        cmd = self.commands.get(command)
+        if cmd:
+            start = time()
+            error = False
             try:
-                resp = getattr(self, 'cmd_%s' % command)(*args, **kwargs)
+                resp = getattr(self, cmd.attr)(*args, **kwargs)
             except:
                 resp = 'Oops, something went wrong...'
+                error = True
                 logging.getLogger(__name__).exception('Error handling command')
+            self.metrics.observe('command', cmd.name, time() - start, error)
             if resp:
                 if isinstance(resp, tuple) and len(resp) == 2:
                     return resp
@@ -130,34 +300,53 @@ class DropBot(ClientXMPP):
             if msg['body'][0] != self.cmd_prefix:
                 # If its not a command, check for ZKB urls
                 seen = set([])
-                response_lines = []
+                kills = []
                 for match in zkillboard_regex.finditer(msg['body']):
                     kill_id = match.groupdict()['killID']
                     host = match.groupdict()['host']
                     logging.info('Found Kill ID {}'.format(kill_id))
                     if kill_id in seen:
                         continue
-                    body, html = self.call_command('kill', [kill_id], msg, no_url=True, host=host)
-                    response_lines.append(body)
+                    kills.append((kill_id, host))
                     seen.add(kill_id)
-                response_lines = [x for x in response_lines if x]
-                if len(response_lines):
-                    msg.reply('\n'.join(response_lines)).send()
+                if len(kills):
+                    self._submit_command('kill', self._kill_summaries, (kills, msg), msg,
+                                         timeout=self.commands['kill'].timeout)
                 return
             # Strip the cmd_prefix
             cmd = cmd[1:]
 
-        # Call the command
-        try:
-            body, html = self.call_command(cmd, args, msg)
-        except UnknownCommandException:
+        command = self.commands.get(cmd)
+        if not command:
             if msg['type'] != 'groupchat':
                 msg.reply('Unknown command, use "help" to list all commands available').send()
-            pass
-        else:
+            return
+
+        # Run the command on the worker pool, replying once it completes
+        self._submit_command(command.name, lambda: self.call_command(cmd, args, msg)[0], (), msg,
+                             timeout=command.timeout)
+
+    def _submit_command(self, name, func, args, msg, timeout=None):
+        """Runs a command on the executor, sending the response as a reply to msg, timeout overrides the executor's default"""
+        def reply(body):
             if body:
                 msg.reply(body).send()
 
+        def timed_out():
+            msg.reply('Sorry, {} took too long to respond'.format(name)).send()
+
+        if not self.executor.submit(name, func, args, callback=reply, timeout_callback=timed_out, timeout=timeout):
+            logging.warning('Rejected command {}, executor stats: {}'.format(name, self.executor.stats()))
+            msg.reply('Sorry, I\'m busy right now, try again shortly').send()
+
+    def _kill_summaries(self, kills, msg):
+        """Returns the summaries of a list of (kill ID, host) for pasted zKillboard links"""
+        response_lines = []
+        for kill_id, host in kills:
+            body, html = self.call_command('kill', [kill_id], msg, no_url=True, host=host)
+            response_lines.append(body)
+        return '\n'.join([x for x in response_lines if x])
+
     # Helpers
     def _system_picker(self, name):
         systems = self.map.get_systems(name)
@@ -175,30 +364,79 @@ class DropBot(ClientXMPP):
                 return 'Usage: !price <item>'
             if item.lower() == 'plex':
                 return (u"29668", u"30 Day Pilot's License Extension (PLEX)")
-            types = dict([(i, v) for i, v in self.types.iteritems() if item.lower() in v.lower()])
+            types = dict(self.item_index.search(item))
             if len(types) == 0:
                 return "No items named {} found".format(item)
             elif len(types) > 1:
-                for i, v in types.iteritems():
-                    if item.lower() == v.lower():
-                        return (i, v)
-                else:
-                    if len(types) > 10:
-                        return "More than 10 items found, please narrow down what you want."
-                    return "Did you mean: {}?".format(
-                        ', '.join(types.itervalues())
-                    )
+                exact = self.item_index.get(item)
+                if exact:
+                    return exact
+                if len(types) > 10:
+                    return "More than 10 items found, please narrow down what you want."
+                return "Did you mean: {}?".format(
+                    ', '.join(types.itervalues())
+                )
             return types.popitem()
 
     def _get_evecentral_price(self, type_id, system_id):
+        return self.price_cache.get(type_id, system_id, self._fetch_evecentral_price)
+
+    def _fetch_evecentral_price(self, type_id, system_id):
         try:
-            resp = requests.get('http://api.eve-central.com/api/marketstat?typeid={}&usesystem={}'.format(type_id, system_id))
-            root = ElementTree.fromstring(resp.content)
+            return self._fetch_evecentral_prices([int(type_id)], system_id).get(int(type_id))
         except:
             return None
 
-        return (float(root.findall("./marketstat/type[@id='{}']/sell/min".format(type_id))[0].text),
-                float(root.findall("./marketstat/type[@id='{}']/buy/max".format(type_id))[0].text))
+    def _fetch_evecentral_prices(self, type_ids, system_id):
+        """Fetches the prices of types in a system, in as few marketstat calls as possible, returns a dict of type ID to (sell, buy)"""
+        prices = {}
+        for i in range(0, len(type_ids), self.marketstat_batch_size):
+            with self.metrics.timer('evecentral', 'marketstat'):
+                resp = self.http.get('{}marketstat'.format(self.evecentral_url),
+                                     params={'typeid': type_ids[i:i + self.marketstat_batch_size], 'usesystem': system_id},
+                                     stream=True, timeout=self.http_timeout)
+                resp.raw.decode_content = True
+                prices.update(parse_marketstat(resp.raw))
+        return prices
+
+    def _get_evecentral_system_prices(self, type_ids, system_id):
+        try:
+            return self.price_cache.get_many(type_ids, system_id, self._fetch_evecentral_prices)
+        except Exception:
+            logging.exception('Error getting prices in {}'.format(system_id))
+            return {}
+
+    def get_price_table(self, type_ids, system_ids=None):
+        """
+        Fetches the prices of several types in several systems, the market hubs by default, with at
+        most one marketstat call per system made concurrently. Returns a dict of type ID to a dict
+        of system ID to (sell, buy), leaving out prices that error or don't respond within
+        market_timeout.
+        """
+        if system_ids is None:
+            system_ids = [x for x in (self.map.get_system_id(x) for x in self.market_systems) if x]
+        type_ids = [int(x) for x in type_ids]
+        results = [(x, self.market_pool.apply_async(self._get_evecentral_system_prices, (type_ids, x)))
+                   for x in system_ids]
+        deadline = time() + self.market_timeout
+        table = dict((x, {}) for x in type_ids)
+        for system_id, result in results:
+            try:
+                prices = result.get(max(0, deadline - time()))
+            except TimeoutError:
+                logging.warning('Timed out getting prices in {}'.format(system_id))
+                continue
+            for type_id, price in prices.items():
+                if type_id in table:
+                    table[type_id][system_id] = price
+        return table
+
+    def _get_evecentral_prices(self, type_id, system_ids):
+        """
+        Fetches the price of a type in several systems concurrently, returns a dict of system ID
+        to (sell, buy). Systems that error or don't respond within market_timeout are left out.
+        """
+        return self.get_price_table([type_id], system_ids)[int(type_id)]
 
     def _system_price(self, args, msg, system, system_id):
         item = ' '.join(args)
@@ -207,30 +445,31 @@ class DropBot(ClientXMPP):
             return res
         type_id, type_name = res
 
-        try:
-            resp = requests.get('http://api.eve-central.com/api/marketstat?typeid={}&usesystem={}'.format(type_id, system_id))
-            root = ElementTree.fromstring(resp.content)
-        except:
+        price = self._get_evecentral_price(type_id, system_id)
+        if not price:
             return "An error occurred tying to get the price for {}".format(type_name)
 
         return "{} @ {} | Sell: {} | Buy: {}".format(
             type_name,
             system,
-            intcomma(float(root.findall("./marketstat/type[@id='{}']/sell/min".format(type_id))[0].text)),
-            intcomma(float(root.findall("./marketstat/type[@id='{}']/buy/max".format(type_id))[0].text)),
+            intcomma(price[0]),
+            intcomma(price[1]),
         )
 
     def _get_offices(self, keyid, vcode):
-        """Returns a list of offices from a Corp API key"""
-        logging.debug('Retreving offices for {}/{}'.format(keyid, vcode))
+        """Returns a list of systems with offices from a Corp API key"""
         if not keyid or not vcode:
             return []
         try:
-            assets = self.get_eveapi_auth(keyid, vcode).corp.AssetList()
-        except RuntimeError:
+            return self.eve_cache.get(('offices', keyid, vcode), self._fetch_offices, keyid, vcode)
+        except (eveapi.Error, RuntimeError, SyntaxError, requests.RequestException):
             logging.exception('Unable to retrieve asset listing for {}/{}'.format(keyid, vcode))
             return []
 
+    def _fetch_offices(self, keyid, vcode):
+        """Returns the office systems of a Corp API key and the time to cache them for, streaming the asset list"""
+        logging.debug('Retreving offices for {}/{}'.format(keyid, vcode))
+
         def location_to_station(location_id):
             if location_id >= 67000000:
                 return location_id - 6000000
@@ -238,50 +477,94 @@ class DropBot(ClientXMPP):
                 return location_id - 6000001
             return location_id
 
-        return [self.stations[unicode(location_to_station(x.locationID))] for x in assets.assets if x.typeID == 27]
+        with self.metrics.timer('eveapi', 'AssetList'):
+            # Only the office list is cached, the asset list itself can be too large to keep around
+            source = self.eveapi_handler.stream(urlparse.urlparse(self.eveapi_url).netloc, '/corp/AssetList.xml.aspx',
+                                                {'keyID': keyid, 'vCode': vcode})
+            rows = EVEAPIRowStream(source, fields=('locationID', 'typeID'))
+            locations = [int(x['locationID']) for x in rows if x['typeID'] == '27']
+        stations = self.stations
+        return [stations[unicode(location_to_station(x))] for x in locations], rows.cache_time()
 
     def get_eveapi(self):
-        if self.redis:
-            return EVEAPIConnection(cacheHandler=EVEAPIRedisCache(self.redis))
-        return EVEAPIConnection()
+        return self.eveapi
 
     def get_eveapi_auth(self, keyid, vcode):
         return self.get_eveapi().auth(keyID=keyid, vCode=vcode)
 
+    def _is_admin(self, msg):
+        """Checks if the sender of a message is one of the admin JIDs"""
+        if msg['type'] == 'groupchat':
+            jid = self.plugin['xep_0045'].getJidProperty(msg['from'].bare, msg['mucnick'], 'jid')
+        else:
+            jid = msg['from']
+        return jid is not None and JID(jid).bare in self.admins
+
     def check_eveapi_permission(self, keyid, vcode, bit):
         try:
-            accessmask = int(self.get_eveapi_auth(keyid, vcode).account.APIKeyInfo().key.accessMask)
-            logging.debug('Key ID {} - Access Mask: {}'.format(keyid, accessmask))
-        except RuntimeError:
+            accessmask = self.eve_cache.get(('accessmask', keyid, vcode), self._fetch_accessmask, keyid, vcode)
+        except (eveapi.Error, RuntimeError):
             return False
         mask = 1 << bit
         return (accessmask & mask) > 0
 
+    def _fetch_accessmask(self, keyid, vcode):
+        """Returns the access mask of an API key and the time to cache it for"""
+        with self.metrics.timer('eveapi', 'APIKeyInfo'):
+            result = self.get_eveapi_auth(keyid, vcode).account.APIKeyInfo()
+        accessmask = int(result.key.accessMask)
+        logging.debug('Key ID {} - Access Mask: {}'.format(keyid, accessmask))
+        return accessmask, result._meta.cachedUntil - result._meta.currentTime
+
+    def _warm_office_cache(self):
+        """Fetch the office API key permissions and offices ahead of the first !nearestoffice"""
+        if self.check_eveapi_permission(self.office_api_key_keyid, self.office_api_key_vcode, 1):
+            self._get_offices(self.office_api_key_keyid, self.office_api_key_vcode)
+
     # Commands
 
+    @property
+    def help_text(self):
+        """Help responses, built once as the commands are fixed when the class is created"""
+        if not hasattr(self, '_help_text'):
+            commands = {}
+            for name in self.command_names:
+                cmd = self.commands[name]
+                lines = ['{}{}: {}'.format(self.cmd_prefix, name, cmd.doc or 'No documentation available')]
+                if cmd.args:
+                    lines.append('Usage: {}{} {}'.format(self.cmd_prefix, name, cmd.args))
+                if cmd.aliases:
+                    lines.append('Aliases: {}'.format(', '.join(self.cmd_prefix + x for x in cmd.aliases)))
+                commands[name] = '\n'.join(lines)
+            self._help_text = {
+                'groupchat': "Commands: {}\nAll commands are available in private chat without the {} prefix".format(
+                    ', '.join([self.cmd_prefix + x for x in self.command_names]),
+                    self.cmd_prefix
+                ),
+                'chat': "Available Commands\n\n{}".format('\n'.join(
+                    commands[x].split('\n')[0] for x in self.command_names
+                )),
+                'commands': commands,
+            }
+        return self._help_text
+
+    @command(args='(<command>)')
     def cmd_help(self, args, msg):
+        """Lists the available commands, or shows the help of a command"""
         if len(args) == 0:
             if msg['type'] == 'groupchat':
-                return "Commands: {}\nAll commands are available in private chat without the {} prefix".format(
-                    ', '.join([self.cmd_prefix + x[4:] for x in dir(self) if x[:4] == 'cmd_' and x not in self.hidden_commands]),
-                    self.cmd_prefix
-                )
-            else:
-                command_lines = ['{}{}: {}'.format(self.cmd_prefix, cmd[4:], getattr(self, cmd).__doc__ or 'No documentation available') for cmd in dir(self) if cmd[:4] == 'cmd_' and cmd not in self.hidden_commands]
-                return "Available Commands\n\n{}".format('\n'.join(command_lines))
-        cmd = args[0]
-        if hasattr(self, 'cmd_%s' % cmd):
-            if getattr(self, 'cmd_%s' % cmd).__doc__ is not None:
-                return '{}{}: {}'.format(
-                    self.cmd_prefix,
-                    cmd,
-                    getattr(self, 'cmd_%s' % cmd).__doc__
-                )
+                return self.help_text['groupchat']
+            return self.help_text['chat']
+        cmd = self.commands.get(args[0])
+        if cmd:
+            if cmd.doc is not None:
+                return self.help_text['commands'][cmd.name]
             else:
                 return 'This command has no documentation'
         else:
             return 'Unknown command'
 
+    @command(args='<item>', cost=COST_NETWORK)
     def cmd_bestprice(self, args, msg):
         """Returns the best price for an item out of the current known market hub systems"""
         item = ' '.join(args)
@@ -295,11 +578,16 @@ class DropBot(ClientXMPP):
         sell_sys = None
         buy_sys = None
 
-        for name in self.market_systems:
-            sys_id = self.map.get_system_id(name)
-            if not sys_id:
+        systems = [(x, self.map.get_system_id(x)) for x in self.market_systems]
+        systems = [(x, y) for x, y in systems if y]
+        prices = self._get_evecentral_prices(type_id, [y for x, y in systems])
+        if not prices:
+            return 'Unable to get prices for {}, please try again later'.format(type_name)
+
+        for name, sys_id in systems:
+            if sys_id not in prices:
                 continue
-            sell, buy = self._get_evecentral_price(type_id, sys_id)
+            sell, buy = prices[sys_id]
             if (sell < min_sell or min_sell == 0) and sell > 0:
                 min_sell = sell
                 sell_sys = name
@@ -312,6 +600,7 @@ class DropBot(ClientXMPP):
             buy_sys, intcomma(max_buy)
         )
 
+    @command(args='<system name> <item>', cost=COST_NETWORK)
     def cmd_price(self, args, msg):
         """Returns the price of an item in a particular system"""
         if len(args) < 2:
@@ -332,60 +621,98 @@ class DropBot(ClientXMPP):
             intcomma(buy)
         )
 
+    @command(args='<system name> <item>, <item>, ...', cost=COST_NETWORK)
+    def cmd_prices(self, args, msg):
+        """Returns the prices of several items in a system, with their total"""
+        if len(args) < 2:
+            return '!prices <system name> <item>, <item>, ...'
+        system_id = self._system_picker(args[0])
+        if isinstance(system_id, basestring):
+            return system_id
+        items = []
+        for item in ' '.join(args[1:]).split(','):
+            if not item.strip():
+                continue
+            res = self._item_picker(item.strip())
+            if isinstance(res, basestring):
+                return res
+            items.append(res)
+
+        table = self.get_price_table([x for x, y in items], [system_id])
+        lines = []
+        total_sell = total_buy = 0
+        for type_id, type_name in items:
+            price = table[int(type_id)].get(system_id)
+            if not price:
+                lines.append('{} | No price available'.format(type_name))
+                continue
+            sell, buy = price
+            total_sell += sell
+            total_buy += buy
+            lines.append('{} | Sell {} | Buy: {}'.format(type_name, intcomma(sell), intcomma(buy)))
+        lines.append('Total @ {} | Sell {} | Buy: {}'.format(
+            self.map.get_system_name(system_id), intcomma(total_sell), intcomma(total_buy)))
+        return '\n'.join(lines)
+
+    @command(args='<item>', cost=COST_NETWORK)
     def cmd_jita(self, args, msg):
         """Returns the price of a item in Jita"""
         return self.cmd_price(['Jita'] + args, msg)
 
+    @command(args='<item>', cost=COST_NETWORK)
     def cmd_amarr(self, args, msg):
         """Returns the price of a item in Amarr"""
         return self.cmd_price(['Amarr'] + args, msg)
 
+    @command(args='<item>', cost=COST_NETWORK)
     def cmd_rens(self, args, msg):
         """Returns the price of a item in Rens"""
         return self.cmd_price(['Rens'] + args, msg)
 
+    @command(args='<item>', cost=COST_NETWORK)
     def cmd_dodixie(self, args, msg):
         """Returns the price of a item in Dodixie"""
         return self.cmd_price(['Dodixie'] + args, msg)
         
+    @command(args='<item>', cost=COST_NETWORK)
     def cmd_hek(self, args, msg):
         """Returns the price of a item in Hek"""
         return self.cmd_price(['Hek'] + args, msg)
 
-    def cmd_r(self, args, msg):
-        return self.cmd_redditimg(args, msg)
-
+    @command(aliases=['r'], args='<subreddit>', cost=COST_SLOW, timeout=60)
     def cmd_redditimg(self, args, msg):
         """Shows a random picture from imgur.com reddit section"""
         if len(args) == 0:
             return "Usage: !redditimg <subreddit>"
+        try:
+            imgs = self.http_cache.get('imgur', args[0].lower(), self._fetch_imgur, args[0].lower())
+        except FetchError:
+            return "Unable to get images from imgur, please try again later"
+        if len(imgs):
+            return choice(imgs)
+
+    def _fetch_imgur(self, subreddit):
+        """Returns the top images of a subreddit on imgur"""
         imgs = []
         for page in range(1, 11):
-            for img in requests.get("http://imgur.com/r/%s/top/all/page/%s.json" % (args[0], page)).json()['data']:
+            with self.metrics.timer('imgur', 'gallery'):
+                resp = self.http.get("http://imgur.com/r/%s/top/all/page/%s.json" % (subreddit, page),
+                                     timeout=self.http_timeout)
+            for img in resp.json()['data']:
                 resp = "%s - http://i.imgur.com/%s%s" % (img['title'], img['hash'], img['ext'])
                 if img['nsfw']:
                     resp = resp + " :nsfw:"
                 imgs.append(resp)
-        if len(imgs):
-            return choice(imgs)
+        return imgs
 
+    @command(args='<name>', cost=COST_NETWORK)
     def cmd_kos(self, args, msg):
         """Checks the CVA KOS list for a name"""
         arg = ' '.join(args)
-        resp = requests.get(self.kos_url, params={
-            'c': 'json',
-            'q': arg,
-            'type': 'unit',
-            'details': None
-        })
-        if resp.status_code != requests.codes.ok:
-            return "Something went wrong (Error %s)" % resp.status_code
         try:
-            data = resp.json()
-        except:
-            return "KOS API returned invalid data."
-        if data['message'] != 'OK':
-            return "KOS API returned an error."
+            data = self.http_cache.get('kos', arg.lower(), self._fetch_kos, arg)
+        except FetchError as e:
+            return e.message or "Unable to reach the KOS API, please try again later"
         if data['total'] == 0:
             return "KOS returned no results (Not on KOS)"
 
@@ -399,6 +726,26 @@ class DropBot(ClientXMPP):
             results.append(text)
         return '\n'.join(results)
 
+    def _fetch_kos(self, name):
+        """Looks up a name on the CVA KOS list"""
+        with self.metrics.timer('kos', 'unit'):
+            resp = self.http.get(self.kos_url, params={
+                'c': 'json',
+                'q': name,
+                'type': 'unit',
+                'details': None
+            }, timeout=self.http_timeout)
+        if resp.status_code != requests.codes.ok:
+            raise FetchError("Something went wrong (Error %s)" % resp.status_code)
+        try:
+            data = resp.json()
+        except ValueError:
+            raise FetchError("KOS API returned invalid data.")
+        if data['message'] != 'OK':
+            raise FetchError("KOS API returned an error.")
+        return data
+
+    @command(args='<system> <ship class>')
     def cmd_range(self, args, msg):
         """Returns a count of the number of systems in jump range from a source system"""
         if len(args) == 0 or len(args) > 2:
@@ -430,11 +777,19 @@ class DropBot(ClientXMPP):
 
         return '{} systems in JDC5 {} range of {}:\n'.format(len(systems), ship_class, self.map.get_system_name(system_id)) + '\n'.join(['{} - {}'.format(x, y) for x, y in res.items()])
 
+    @command(args='<source> <destination> (<{}>)'.format('|'.join(ROUTE_PREFERENCES)))
     def cmd_route(self, args, msg):
-        """Shows the shortest route between two sytems"""
-        if len(args) != 2:
-            return '!route <source> <destination>'
-        source, dest = args
+        """Shows the shortest route between two sytems, optionally preferring highsec or avoiding lowsec"""
+        if len(args) not in (2, 3):
+            return '!route <source> <destination> (<{}>)'.format('|'.join(ROUTE_PREFERENCES))
+        source, dest = args[:2]
+        preference = args[2].lower() if len(args) == 3 else ROUTE_SHORTEST
+
+        if preference not in ROUTE_PREFERENCES:
+            return 'Unknown routing preference {}, please use one of: {}'.format(
+                preference,
+                ', '.join(ROUTE_PREFERENCES)
+            )
 
         source = self._system_picker(source)
         if isinstance(source, basestring):
@@ -443,7 +798,11 @@ class DropBot(ClientXMPP):
         if isinstance(dest, basestring):
             return dest
 
-        route = self.map.route_gate(source, dest)
+        route = self.map.route_gate(source, dest, preference=preference)
+        if not route:
+            if preference == ROUTE_AVOID_LOWSEC:
+                return 'No route found without passing through lowsec'
+            return 'No route found'
         route_names = ' -> '.join(['{} ({})'.format(x['name'], round(x['security'], 2)) for x in [self.map.node[y] for y in route]])
 
         return '{} jumps from {} to {}\n{}'.format(
@@ -453,6 +812,7 @@ class DropBot(ClientXMPP):
             route_names
         )
 
+    @command(args='<source> <destination>')
     def cmd_addjb(self, args, msg):
         """Adds a jumpbridge to the internal map for routing purposes"""
         if len(args) != 2:
@@ -490,6 +850,7 @@ class DropBot(ClientXMPP):
             len([u for u, v, d in self.map.edges_iter(data=True) if d['link_type'] == 'bridge'])
         )
 
+    @command(args='<source> <destination>')
     def cmd_hit(self, args, msg):
         """Details what class and JDC level is required to jump between two systems"""
         if len(args) != 2:
@@ -531,6 +892,7 @@ class DropBot(ClientXMPP):
             '\n'.join(res)
         )
 
+    @command(args='<source> <destination> (<ship class> <jdc level> <jfc level>)')
     def cmd_jump(self, args, msg):
         """Calculates the shortest jump route between two systems"""
         if len(args) < 2:
@@ -584,20 +946,25 @@ class DropBot(ClientXMPP):
         else:
             return 'No route found'
 
+    @command(args='<character name>', cost=COST_NETWORK)
     def cmd_id(self, args, msg):
         """Provides an overview of a character's activity in-game"""
         if len(args) == 0:
             return '!id <character name>'
         char_name = ' '.join(args)
 
-        result = self.get_eveapi().eve.CharacterID(names=char_name.strip())
+        with self.metrics.timer('eveapi', 'CharacterID'):
+            result = self.get_eveapi().eve.CharacterID(names=char_name.strip())
         char_name = result.characters[0].name
         char_id = result.characters[0].characterID
 
         if char_id == 0:
             return 'Unknown character {}'.format(char_name)
 
-        headers, res = ZKillboard().characterID(char_id).kills().pastSeconds(60 * 60 * 24 * 7).get()
+        try:
+            res = self.http_cache.get('zkillboard_kills', char_id, self._fetch_zkillboard_kills, char_id)
+        except FetchError:
+            return 'Unable to get kills from zKillboard, please try again later'
 
         from collections import defaultdict, Counter
 
@@ -635,6 +1002,21 @@ class DropBot(ClientXMPP):
             ', '.join([x for x, y in alli_assoc])
         )
 
+    def _fetch_zkillboard_kills(self, char_id):
+        """Returns the kills of a character in the last week"""
+        with self.metrics.timer('zkillboard', 'kills'):
+            headers, res = ZKillboard().characterID(char_id).kills().pastSeconds(60 * 60 * 24 * 7).get()
+        return res
+
+    def _fetch_zkillboard_kill(self, host, kill_id):
+        """Returns a killmail from a zKillboard instance"""
+        with self.metrics.timer('zkillboard', 'killID'):
+            headers, data = ZKillboard(base_url='https://{}/api/'.format(host)).killID(kill_id).get()
+        if not data:
+            raise FetchError('Kill {} not found'.format(kill_id))
+        return data[0]
+
+    @command(args='<Kill ID/zKillboard URL>', cost=COST_NETWORK)
     def cmd_kill(self, args, msg, no_url=False, raw=None, host=None):
         """Returns a summary of a zKillboard killmail"""
         if not raw:
@@ -651,8 +1033,10 @@ class DropBot(ClientXMPP):
                 else:
                     return 'Invalid kill ID'
 
-            headers, data = ZKillboard(base_url='https://{}/api/'.format(host)).killID(kill_id).get()
-            kill = data[0]
+            try:
+                kill = self.http_cache.get('zkillboard_kill', [host, int(kill_id)], self._fetch_zkillboard_kill, host, kill_id)
+            except FetchError as e:
+                return e.message or 'Unable to get the kill from zKillboard, please try again later'
         else:
             kill = raw
             kill_id = raw['killID']
@@ -662,14 +1046,7 @@ class DropBot(ClientXMPP):
         else:
             url = ' - https://{}/kill/{}/'.format(host, kill_id)
 
-        # Ignore kills over an hour old if they're from stomp
         age = (datetime.utcnow() - datetime.strptime(kill['killTime'], '%Y-%m-%d %H:%M:%S'))
-        if age.total_seconds() > 60 * 60 and raw:
-            return
-
-        # Drop kills less than 1mil if they've come from stomp
-        if raw and float(kill['zkb']['totalValue']) < 1000000:
-            return
 
         if 'zkb' in kill and 'totalValue' in kill['zkb']:
             value_lost = intword(float(kill['zkb']['totalValue']))
@@ -686,6 +1063,23 @@ class DropBot(ClientXMPP):
             url,
         )
 
+    @command(hidden=True, args='(<command|eveapi|evecentral|zkillboard|kos|imgur|stomp>)')
+    def cmd_stats(self, args, msg):
+        """Shows call counts, error rates and latencies of commands and external APIs, admins only"""
+        if not self._is_admin(msg):
+            return 'This command is only available to admins'
+        lines = self.metrics.summary(args[0] if len(args) else None) or ['No calls recorded']
+        lines.append('Executor: {queue_depth} queued, {in_flight} in flight, {rejected} rejected, '
+                     '{timed_out} timed out, avg wait {avg_wait:.3f}s'.format(**self.executor.stats()))
+        lines.append('Price cache: {hits} hits, {misses} misses, {coalesced} coalesced'.format(
+            **self.price_cache.stats()))
+        lines.append('HTTP cache: {hits} hits, {stale} stale, {misses} misses, {errors} cached errors'.format(
+            **self.http_cache.stats()))
+        if hasattr(self, 'kill_source'):
+            lines.append('Kill feed: {processed} processed, {failed} failed, {dropped} dropped, {queued} queued'.format(
+                **self.kill_source.stats()))
+        return '\n'.join(lines)
+
     def cmd_mute(self, args, msg):
         """Mutes killmail broadcast for 30 minutes"""
 
@@ -697,7 +1091,9 @@ class DropBot(ClientXMPP):
         self.schedule('unmute', 30 * 60, unmute, [self])
         return 'Killmails muted, posting will resume automatically in 30 minutes'
 
+    @command(args='<system>', cost=COST_NETWORK)
     def cmd_nearestoffice(self, args, msg):
+        """Finds the nearest system with a corporation office to a source system"""
         if len(args) != 1:
             return '!nearestoffice <system>'
         source = args[0]
@@ -711,21 +1107,16 @@ class DropBot(ClientXMPP):
         if isinstance(source, basestring):
             return source
 
-        min_route = None
-        target_office = None
-        for office in self._get_offices(self.office_api_key_keyid, self.office_api_key_vcode):
-            if office == source:
-                return 'An office is in the target system'
-            route_length = len(self.map.route_gate(source, office)) - 1
-            if not min_route or (route_length) < min_route:
-                target_office = office
-                min_route = route_length
+        offices = self._get_offices(self.office_api_key_keyid, self.office_api_key_vcode)
+        if source in offices:
+            return 'An office is in the target system'
 
+        target_office, route = self.map.nearest_of(source, offices)
         if target_office:
             return 'Nearest Office to {} is {}, {} jump(s)'.format(
                 self.map.get_system_name(source),
                 self.map.get_system_name(target_office),
-                min_route,
+                len(route) - 1,
             )
         return 'No known offices.'
 
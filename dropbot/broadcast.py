@@ -0,0 +1,127 @@
+from collections import deque
+from time import time
+import threading
+import logging
+
+
+class _Room(object):
+    """Pending lines and send state of a room"""
+
+    def __init__(self):
+        self.lines = deque()
+        self.first_queued = None
+        self.last_sent = None
+        self.dropped = 0
+
+
+class BroadcastScheduler(object):
+    """
+    Batches lines sent to rooms, so bursts of kills go out as a few multi-line messages.
+
+    Lines queued for a room are held for window seconds and sent together, up to max_lines per
+    message, with at least min_interval seconds between messages to a room. If more than
+    max_backlog lines are waiting for a room the oldest are dropped, and the next message notes
+    how many were left out.
+    """
+
+    def __init__(self, send, window=2.0, min_interval=5.0, max_lines=10, max_backlog=50, clock=time):
+        self.send = send
+        self.window = window
+        self.min_interval = min_interval
+        self.max_lines = max_lines
+        self.max_backlog = max_backlog
+        self.clock = clock
+        self.rooms = {}
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+        self.sent = 0
+        self.dropped = 0
+
+    def queue(self, room, line):
+        """Queue a line to be sent to a room"""
+        with self.condition:
+            state = self.rooms.get(room)
+            if state is None:
+                state = self.rooms[room] = _Room()
+            if not state.lines:
+                state.first_queued = self.clock()
+            state.lines.append(line)
+            while len(state.lines) > self.max_backlog:
+                state.lines.popleft()
+                state.dropped += 1
+                self.dropped += 1
+            self.condition.notify()
+
+    def _due(self, state):
+        """Returns when the pending lines of a room can next be sent"""
+        due = state.first_queued + self.window
+        if state.last_sent is not None:
+            due = max(due, state.last_sent + self.min_interval)
+        return due
+
+    def flush(self):
+        """Send the rooms that are due, returns the seconds until the next room is due or None if nothing is waiting"""
+        messages = []
+        with self.condition:
+            now = self.clock()
+            wait = None
+            for room, state in self.rooms.items():
+                if not state.lines:
+                    continue
+                due = self._due(state)
+                if due <= now:
+                    lines = [state.lines.popleft() for x in range(min(self.max_lines, len(state.lines)))]
+                    if state.dropped:
+                        lines.append('... and {} more not shown'.format(state.dropped))
+                        state.dropped = 0
+                    messages.append((room, '\n'.join(lines)))
+                    state.last_sent = now
+                    state.first_queued = now
+                    if not state.lines:
+                        continue
+                    due = self._due(state)
+                wait = due - now if wait is None else min(wait, due - now)
+
+        for room, body in messages:
+            try:
+                self.send(room, body)
+            except Exception:
+                logging.exception('Error sending a message to {}'.format(room))
+            else:
+                self.sent += 1
+        return wait
+
+    def pending(self):
+        """Returns the number of lines waiting to be sent"""
+        with self.condition:
+            return sum(len(x.lines) for x in self.rooms.values())
+
+    def _run(self):
+        while self.running:
+            wait = self.flush()
+            with self.condition:
+                if not self.running:
+                    break
+                if wait is None:
+                    if not self.pending():
+                        self.condition.wait()
+                elif wait > 0:
+                    self.condition.wait(wait)
+
+    def start(self):
+        """Start sending messages on a background thread"""
+        if self.thread is not None:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='dropbot-broadcast')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
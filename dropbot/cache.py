@@ -0,0 +1,439 @@
+from collections import OrderedDict, deque, namedtuple
+from hashlib import sha1
+from json import loads, dumps
+from time import time
+import threading
+import logging
+
+import redis
+
+
+class LRUCache(object):
+    """
+    A thread safe, size bounded in-process cache with optional expiry of items
+    """
+
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        """Returns the cached value for a key, or the default if it's missing or expired"""
+        with self.lock:
+            item = self.data.pop(key, None)
+            if item is None:
+                return default
+            value, expires = item
+            if expires is not None and expires < time():
+                return default
+            # Re-insert to mark the key as most recently used
+            self.data[key] = item
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Cache a value, ttl overrides the default expiry of the cache"""
+        ttl = self.ttl if ttl is None else ttl
+        expires = time() + ttl if ttl else None
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = (value, expires)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+
+class RecentSet(object):
+    """
+    A thread safe set that only remembers the most recently added items, up to max_size
+    """
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self.order = deque()
+        self.items = set()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        return item in self.items
+
+    def add(self, item):
+        """Adds an item, returning False if it was already in the set"""
+        with self.lock:
+            if item in self.items:
+                return False
+            if len(self.order) >= self.max_size:
+                self.items.discard(self.order.popleft())
+            self.order.append(item)
+            self.items.add(item)
+            return True
+
+
+class SharedRecentSet(object):
+    """
+    A set of recently seen items stored in Redis, so it can be shared between processes.
+    Items are forgotten after ttl seconds.
+    """
+
+    def __init__(self, redis, ttl=3600, prefix='dropbot_seen'):
+        self.redis = redis
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def gen_key(self, item):
+        return '{}_{}'.format(self.prefix, item)
+
+    def add(self, item):
+        """Adds an item, returning False if it was already in the set. If Redis is unavailable the item is treated as new"""
+        try:
+            return bool(self.redis.set(self.gen_key(item), 1, ex=self.ttl, nx=True))
+        except redis.RedisError:
+            logging.exception('Error checking a seen item in Redis')
+            return True
+
+
+class _Call(object):
+    """An in-progress SingleFlight call"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls for the same key, so only one of them does the work and the
+    others wait for and share its result
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.coalesced = 0
+
+    def do(self, key, func, *args, **kwargs):
+        """Call func, or if a call for the key is already in progress wait for its result"""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+        return call.result
+
+
+class RefreshingCache(object):
+    """
+    Caches the results of functions returning a (value, ttl) tuple. Each value is refetched in
+    the background when its ttl runs out, so only the first lookup of a key waits on the fetch.
+    If a background refetch fails the old value is kept and the refetch retried later.
+    """
+
+    def __init__(self, min_ttl=60, retry=60):
+        self.min_ttl = min_ttl
+        self.retry = retry
+        self.values = {}
+        self.timers = {}
+        self.lock = threading.Lock()
+        self.flight = SingleFlight()
+        self.refreshes = 0
+
+    def get(self, key, fetch, *args):
+        """Returns the cached value of a key, calling fetch(*args) if it isn't cached yet"""
+        with self.lock:
+            if key in self.values:
+                return self.values[key]
+        return self.flight.do(key, self._fetch, key, fetch, args)
+
+    def _schedule(self, key, delay, fetch, args):
+        timer = threading.Timer(delay, self._refresh, (key, fetch, args))
+        timer.daemon = True
+        with self.lock:
+            old = self.timers.get(key)
+            if old is not None:
+                old.cancel()
+            self.timers[key] = timer
+        timer.start()
+
+    def _fetch(self, key, fetch, args):
+        value, ttl = fetch(*args)
+        with self.lock:
+            self.values[key] = value
+        self._schedule(key, max(ttl, self.min_ttl), fetch, args)
+        return value
+
+    def _refresh(self, key, fetch, args):
+        try:
+            self._fetch(key, fetch, args)
+        except Exception:
+            logging.exception('Error refreshing {}, retrying in {}s'.format(key, self.retry))
+            self._schedule(key, self.retry, fetch, args)
+        else:
+            self.refreshes += 1
+
+    def delete(self, key):
+        with self.lock:
+            self.values.pop(key, None)
+            timer = self.timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+
+    def clear(self):
+        """Drop all cached values and stop their refreshes"""
+        with self.lock:
+            keys = list(self.timers)
+        for key in keys:
+            self.delete(key)
+
+
+# Seconds a value is fresh for, then served stale while refreshed for, and seconds to remember a failed fetch
+CachePolicy = namedtuple('CachePolicy', ['ttl', 'stale', 'error_ttl'])
+
+
+class FetchError(Exception):
+    """Raised by TieredCache.get when the fetch failed, now or within the error ttl of the endpoint"""
+
+    def __init__(self, message=''):
+        super(FetchError, self).__init__(message)
+        self.message = message
+
+
+class TieredCache(object):
+    """
+    Caches the results of calls to external APIs in process and, when available, in Redis, with a
+    CachePolicy per endpoint. Once a value is older than the ttl it is still returned for another
+    stale seconds while it is refetched in the background. Failed fetches are remembered for
+    error_ttl seconds, so repeated lookups fail fast rather than waiting on the API each time.
+
+    Fetch functions can raise FetchError with a message for the user, other exceptions are logged
+    and raised as a FetchError without a message. Values must be JSON serializable.
+    """
+
+    default_policy = CachePolicy(300, 3600, 60)
+
+    def __init__(self, redis=None, policies=None, max_size=1024, prefix='dropbot_cache'):
+        self.redis = redis
+        self.policies = policies or {}
+        self.prefix = prefix
+        self.local = LRUCache(max_size)
+        self.flight = SingleFlight()
+        self.lock = threading.Lock()
+        self.refreshing = set()
+        self.hits = 0
+        self.stale = 0
+        self.misses = 0
+        self.errors = 0
+
+    def policy(self, endpoint):
+        return self.policies.get(endpoint, self.default_policy)
+
+    def gen_key(self, endpoint, key):
+        return '{}_{}_{}'.format(self.prefix, endpoint, sha1(dumps(key)).hexdigest())
+
+    def _retrieve(self, key, policy):
+        entry = self.local.get(key)
+        if entry is not None or not self.redis:
+            return entry
+        try:
+            val = self.redis.get(key)
+        except redis.RedisError:
+            logging.exception('Error retrieving a cached value from Redis')
+            return None
+        if val:
+            entry = tuple(loads(val))
+            lifetime = policy.error_ttl if entry[2] is not None else policy.ttl + policy.stale
+            self.local.set(key, entry, max(0.001, entry[0] + lifetime - time()))
+            return entry
+
+    def _store(self, key, entry, lifetime):
+        if lifetime <= 0:
+            return
+        self.local.set(key, entry, lifetime)
+        if self.redis:
+            try:
+                self.redis.set(key, dumps(entry), ex=max(1, int(lifetime)))
+            except redis.RedisError:
+                logging.exception('Error storing a cached value to Redis')
+
+    def get(self, endpoint, key, fetch, *args):
+        """Returns the value of a key of an endpoint, calling fetch(*args) if it isn't cached or is stale"""
+        policy = self.policy(endpoint)
+        cache_key = self.gen_key(endpoint, key)
+        entry = self._retrieve(cache_key, policy)
+        if entry is not None:
+            fetched, value, error = entry
+            age = time() - fetched
+            if error is not None:
+                if age < policy.error_ttl:
+                    with self.lock:
+                        self.errors += 1
+                    raise FetchError(error)
+            elif age < policy.ttl:
+                with self.lock:
+                    self.hits += 1
+                return value
+            elif age < policy.ttl + policy.stale:
+                with self.lock:
+                    self.stale += 1
+                self._refresh_async(cache_key, policy, fetch, args)
+                return value
+        with self.lock:
+            self.misses += 1
+        return self.flight.do(cache_key, self._fetch, cache_key, policy, fetch, args)
+
+    def _fetch(self, key, policy, fetch, args):
+        try:
+            value = fetch(*args)
+        except Exception as e:
+            if isinstance(e, FetchError):
+                error = e.message
+            else:
+                logging.exception('Error fetching {}'.format(key))
+                error = ''
+            self._store(key, (time(), None, error), policy.error_ttl)
+            raise FetchError(error)
+        self._store(key, (time(), value, None), policy.ttl + policy.stale)
+        return value
+
+    def _refresh_async(self, key, policy, fetch, args):
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+        thread = threading.Thread(target=self._refresh, args=(key, policy, fetch, args), name='dropbot-cache-refresh')
+        thread.daemon = True
+        thread.start()
+
+    def _refresh(self, key, policy, fetch, args):
+        try:
+            value = fetch(*args)
+        except Exception:
+            logging.exception('Error refreshing {}, keeping the stale value'.format(key))
+        else:
+            self._store(key, (time(), value, None), policy.ttl + policy.stale)
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    def stats(self):
+        """Returns the fresh hit, stale hit, miss and cached error counters"""
+        return {'hits': self.hits, 'stale': self.stale, 'misses': self.misses, 'errors': self.errors}
+
+
+class PriceCache(object):
+    """
+    Caches market prices by type and system ID for a fixed time, stored in Redis when available
+    or in process otherwise. Concurrent lookups of the same uncached price share one fetch.
+    """
+
+    def __init__(self, redis=None, ttl=300, max_size=4096):
+        self.redis = redis
+        self.ttl = ttl
+        self.local = LRUCache(max_size, ttl)
+        self.flight = SingleFlight()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def gen_key(type_id, system_id):
+        return 'dropbot_price_{}_{}'.format(type_id, system_id)
+
+    def _retrieve(self, key):
+        if not self.redis:
+            return self.local.get(key)
+        try:
+            val = self.redis.get(key)
+        except redis.RedisError:
+            logging.exception('Error retrieving a price from Redis')
+            return None
+        if val:
+            return tuple(loads(val))
+
+    def _retrieve_many(self, keys):
+        if not self.redis:
+            return [self.local.get(x) for x in keys]
+        try:
+            values = self.redis.mget(keys)
+        except redis.RedisError:
+            logging.exception('Error retrieving prices from Redis')
+            return [None for x in keys]
+        return [tuple(loads(x)) if x else None for x in values]
+
+    def _store(self, key, value):
+        if not self.redis:
+            return self.local.set(key, value)
+        try:
+            self.redis.set(key, dumps(value), ex=self.ttl)
+        except redis.RedisError:
+            logging.exception('Error storing a price to Redis')
+
+    def _fetch(self, key, fetch, type_id, system_id):
+        value = fetch(type_id, system_id)
+        if value is not None:
+            self._store(key, value)
+        return value
+
+    def get(self, type_id, system_id, fetch):
+        """Returns the price of a type in a system, calling fetch(type_id, system_id) if it isn't cached"""
+        key = self.gen_key(type_id, system_id)
+        value = self._retrieve(key)
+        with self.lock:
+            if value is not None:
+                self.hits += 1
+                return value
+            self.misses += 1
+        return self.flight.do(key, self._fetch, key, fetch, type_id, system_id)
+
+    def _fetch_many(self, type_ids, system_id, fetch):
+        values = fetch(type_ids, system_id)
+        for type_id, value in values.items():
+            self._store(self.gen_key(type_id, system_id), value)
+        return values
+
+    def get_many(self, type_ids, system_id, fetch):
+        """
+        Returns a dict of type ID to price in a system for the types with a known price, calling
+        fetch(type_ids, system_id) once for all the types that aren't cached
+        """
+        values = self._retrieve_many([self.gen_key(x, system_id) for x in type_ids])
+        prices = dict((x, y) for x, y in zip(type_ids, values) if y is not None)
+        missing = [x for x, y in zip(type_ids, values) if y is None]
+        with self.lock:
+            self.hits += len(prices)
+            self.misses += len(missing)
+        if missing:
+            key = 'dropbot_prices_{}_{}'.format(system_id, ','.join(str(x) for x in sorted(missing)))
+            prices.update(self.flight.do(key, self._fetch_many, missing, system_id, fetch))
+        return prices
+
+    def stats(self):
+        """Returns the hit, miss and coalesced fetch counters"""
+        return {'hits': self.hits, 'misses': self.misses, 'coalesced': self.flight.coalesced}
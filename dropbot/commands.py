@@ -0,0 +1,56 @@
+COMMAND_PREFIX = 'cmd_'
+
+# Cost classes, used to schedule and limit commands
+COST_LOCAL = 'local'
+COST_NETWORK = 'network'
+COST_SLOW = 'slow'
+
+
+class Command(object):
+    """Metadata of a bot command"""
+
+    def __init__(self, name, attr, aliases=(), hidden=False, args=None, cost=COST_LOCAL, doc=None, timeout=None):
+        self.name = name
+        self.attr = attr
+        self.aliases = tuple(aliases)
+        self.hidden = hidden
+        self.args = args
+        self.cost = cost
+        self.doc = doc
+        self.timeout = timeout
+
+    def __repr__(self):
+        return '<Command {}>'.format(self.name)
+
+
+def command(aliases=(), hidden=False, args=None, cost=COST_LOCAL, timeout=None):
+    """Decorator to attach metadata to a cmd_ method, timeout overrides the executor's default in seconds"""
+    def decorator(func):
+        func.command = Command(func.__name__[len(COMMAND_PREFIX):], func.__name__, aliases, hidden, args, cost,
+                               func.__doc__, timeout)
+        return func
+    return decorator
+
+
+class CommandRegistry(type):
+    """
+    Metaclass that builds the command table of a class when it is created. Every cmd_ method is
+    registered, using the metadata from the command decorator if present. The table maps each
+    command name and alias to its Command, and command_names lists the visible commands.
+    """
+
+    def __init__(cls, name, bases, attrs):
+        super(CommandRegistry, cls).__init__(name, bases, attrs)
+        commands = {}
+        for attr in dir(cls):
+            if not attr.startswith(COMMAND_PREFIX):
+                continue
+            func = getattr(cls, attr)
+            if not callable(func):
+                continue
+            cmd = getattr(func, 'command', None) or Command(attr[len(COMMAND_PREFIX):], attr, doc=func.__doc__)
+            commands[cmd.name] = cmd
+            for alias in cmd.aliases:
+                commands[alias] = cmd
+        cls.commands = commands
+        cls.command_names = sorted(x for x, cmd in commands.items() if x == cmd.name and not cmd.hidden)
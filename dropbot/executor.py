@@ -0,0 +1,173 @@
+from collections import defaultdict
+from Queue import Queue, Full
+from itertools import count
+import heapq
+from time import time
+import threading
+import logging
+
+
+class _Task(object):
+    """A command queued on a CommandExecutor"""
+
+    def __init__(self, name, func, args, kwargs, callback, timeout_callback):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.callback = callback
+        self.timeout_callback = timeout_callback
+        self.submitted = time()
+        self.done = False
+
+
+class CommandExecutor(object):
+    """
+    A bounded pool of worker threads to run bot commands away from the XMPP event thread.
+
+    Commands are rejected when the queue is full or the command is already running its limit
+    of concurrent calls. A command that doesn't finish within the timeout (measured from when it
+    was submitted) has its timeout callback called instead, and its eventual result is dropped.
+    Timeouts are tracked by a single sweeper thread.
+    """
+
+    def __init__(self, workers=4, max_queue=50, timeout=30, limits=None):
+        self.queue = Queue(max_queue)
+        self.timeout = timeout
+        self.limits = limits or {}
+        self.lock = threading.Lock()
+        self.in_flight = defaultdict(int)
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.errors = 0
+        self.wait_time = 0.0
+        self.run_time = 0.0
+        self.max_wait = 0.0
+        self.deadlines = []
+        self.sequence = count()
+        self.sweeper_condition = threading.Condition()
+        self.running = True
+        self.threads = []
+        for idx in range(workers):
+            thread = threading.Thread(target=self._worker, name='dropbot-worker-{}'.format(idx))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        self.sweeper = threading.Thread(target=self._sweep, name='dropbot-timeouts')
+        self.sweeper.daemon = True
+        self.sweeper.start()
+
+    def submit(self, name, func, args=(), kwargs=None, callback=None, timeout_callback=None, timeout=None):
+        """
+        Queue func(*args, **kwargs) to run on the pool, callback is called with the result.
+        Returns False if the command was rejected.
+        """
+        with self.lock:
+            limit = self.limits.get(name)
+            if limit and self.in_flight[name] >= limit:
+                self.rejected += 1
+                return False
+            self.in_flight[name] += 1
+
+        task = _Task(name, func, args, kwargs or {}, callback, timeout_callback)
+        try:
+            self.queue.put_nowait(task)
+        except Full:
+            with self.lock:
+                self.in_flight[name] -= 1
+                self.rejected += 1
+            return False
+        with self.sweeper_condition:
+            heapq.heappush(self.deadlines, (task.submitted + (timeout or self.timeout), next(self.sequence), task))
+            self.sweeper_condition.notify()
+        with self.lock:
+            self.submitted += 1
+        return True
+
+    def _sweep(self):
+        """Calls _timeout for tasks past their deadline, finished tasks are discarded as they come up"""
+        while True:
+            expired = []
+            with self.sweeper_condition:
+                if not self.running:
+                    break
+                now = time()
+                while self.deadlines and (self.deadlines[0][0] <= now or self.deadlines[0][2].done):
+                    deadline, seq, task = heapq.heappop(self.deadlines)
+                    if not task.done:
+                        expired.append(task)
+                if not expired:
+                    self.sweeper_condition.wait(self.deadlines[0][0] - now if self.deadlines else None)
+            for task in expired:
+                self._timeout(task)
+
+    def _timeout(self, task):
+        with self.lock:
+            if task.done:
+                return
+            task.done = True
+            self.timed_out += 1
+        logging.warning('Command {} timed out'.format(task.name))
+        if task.timeout_callback:
+            self._call(task.timeout_callback)
+
+    @staticmethod
+    def _call(callback, *args):
+        try:
+            callback(*args)
+        except Exception:
+            logging.exception('Error in command callback')
+
+    def _worker(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                break
+            started = time()
+            error = False
+            try:
+                result = task.func(*task.args, **task.kwargs)
+            except Exception:
+                logging.exception('Error running command {}'.format(task.name))
+                result = None
+                error = True
+            finished = time()
+
+            with self.lock:
+                self.in_flight[task.name] -= 1
+                self.completed += 1
+                self.errors += error
+                self.wait_time += started - task.submitted
+                self.run_time += finished - started
+                self.max_wait = max(self.max_wait, started - task.submitted)
+                first = not task.done
+                task.done = True
+            if first and not error and task.callback:
+                self._call(task.callback, result)
+
+    def stats(self):
+        """Returns the queue depth, counters and average latencies of the pool"""
+        with self.lock:
+            completed = self.completed or 1
+            return {
+                'queue_depth': self.queue.qsize(),
+                'in_flight': sum(self.in_flight.values()),
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'errors': self.errors,
+                'avg_wait': self.wait_time / completed,
+                'avg_run': self.run_time / completed,
+                'max_wait': self.max_wait,
+            }
+
+    def shutdown(self):
+        """Stop the worker threads once the queued commands have run"""
+        for thread in self.threads:
+            self.queue.put(None)
+        with self.sweeper_condition:
+            self.running = False
+            self.sweeper_condition.notify()
@@ -0,0 +1,233 @@
+from datetime import datetime, timedelta
+from Queue import Queue, Full
+from time import time, sleep
+import threading
+import urlparse
+import json
+import logging
+
+from dropbot.cache import RecentSet, SharedRecentSet
+
+KILL_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class KillSource(object):
+    """
+    Base class of kill feeds, broadcasting kills involving the tracked corps and alliances.
+
+    Subclasses implement _run, which is called on a background thread by connect and passes each
+    killmail received to on_message. Messages are queued, up to the bot's stomp_queue_size, and
+    processed on a worker thread. If the queue is full the message is dropped.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.url = None
+        self.seen = RecentSet(bot.kill_dedupe_window)
+        if bot.kill_dedupe_shared and bot.redis:
+            self.shared_seen = SharedRecentSet(bot.redis, ttl=bot.kill_dedupe_ttl,
+                                               prefix='dropbot_seen_kill')
+        else:
+            self.shared_seen = None
+        self.queue = Queue(bot.stomp_queue_size)
+        self.running = False
+        self.threads = []
+        self.duplicates = 0
+        self.filtered = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self._cutoff = (None, None)
+
+    def _run(self):
+        raise NotImplementedError
+
+    def _close(self):
+        """Called by stop to close the connection to the feed"""
+        pass
+
+    def receive_context(self):
+        """Returns what ack needs to acknowledge a message received now"""
+        return None
+
+    def ack(self, context, headers):
+        """Acknowledge a message once it has been processed or dropped"""
+        pass
+
+    def on_message(self, headers, message):
+        context = self.receive_context()
+        try:
+            self.queue.put_nowait((context, headers, message))
+        except Full:
+            self.dropped += 1
+            self.ack(context, headers)
+
+    def process(self, headers, message):
+        """Handles a message from the feed"""
+        with self.bot.metrics.timer('stomp', 'message'):
+            self._handle_kill(message)
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            context, headers, message = item
+            try:
+                self.process(headers, message)
+                self.processed += 1
+            except Exception:
+                logging.exception('Error processing a kill')
+                self.failed += 1
+            self.ack(context, headers)
+            self.queue.task_done()
+
+    def _handle_kill(self, message):
+        kill = json.loads(message)
+
+        # Drop cheap, low value and old kills before looking at who was involved
+        if float(kill.get('zkb', {}).get('totalValue', 0)) < self.bot.kill_min_value or \
+           kill.get('killTime', '') < self.cutoff_time():
+            self.filtered += 1
+            return
+
+        kill_type = self.tag_kill(kill)
+        if not kill_type:
+            return
+
+        if not self.is_new(kill['killID']):
+            logging.debug('Duplicate kill {}'.format(kill['killID']))
+            self.duplicates += 1
+            return
+
+        body, html = self.bot.call_command('kill', [], None, no_url=False, raw=kill)
+        if body and not self.bot.kills_muted:
+            self.bot.broadcast('[{}] {}'.format(kill_type, body))
+
+    def cutoff_time(self):
+        """Returns the oldest kill time to report, formatted to compare directly with the killTime of a kill"""
+        now = int(time())
+        if self._cutoff[0] != now:
+            cutoff = datetime.utcfromtimestamp(now) - timedelta(seconds=self.bot.kill_max_age)
+            self._cutoff = (now, cutoff.strftime(KILL_TIME_FORMAT))
+        return self._cutoff[1]
+
+    def tag_kill(self, kill):
+        """Returns LOSS if the victim is in a tracked corp or alliance, KILL if an attacker is, otherwise None"""
+        corps = self.bot.kill_corps
+        alliances = self.bot.kill_alliances
+        victim = kill['victim']
+        if int(victim['corporationID']) in corps or int(victim.get('allianceID', 0)) in alliances:
+            return 'LOSS'
+        for attacker in kill['attackers']:
+            if int(attacker['corporationID']) in corps or int(attacker.get('allianceID', 0)) in alliances:
+                return 'KILL'
+
+    def is_new(self, kill_id):
+        """Checks if a kill hasn't been seen before, by this source or any other sharing the Redis server"""
+        if not self.seen.add(kill_id):
+            return False
+        if self.shared_seen is not None:
+            return self.shared_seen.add(kill_id)
+        return True
+
+    def connect(self, url):
+        """Start consuming the feed at url on background threads"""
+        self.url = url
+        self.running = True
+        for target, name in ((self._run, 'dropbot-killsource'), (self._worker, 'dropbot-kills')):
+            thread = threading.Thread(target=target, name=name)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """Disconnect from the feed and stop the worker once queued messages are processed"""
+        self.running = False
+        self._close()
+        self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def stats(self):
+        """Returns the message counters of the source"""
+        return {
+            'processed': self.processed,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'queued': self.queue.qsize(),
+            'filtered': self.filtered,
+            'duplicates': self.duplicates,
+        }
+
+
+class ReplayKillSource(KillSource):
+    """
+    Replays a recorded kill feed from a JSON lines file (file:///path/to/kills.jsonl), for testing
+    the kill pipeline offline.
+
+    Kills are replayed with the gaps between their kill times divided by the bot's
+    kill_replay_speed, or as fast as they can be processed if it is 0. Kill times are moved to
+    the time of replay so they pass the age filter.
+    """
+
+    def __init__(self, bot):
+        super(ReplayKillSource, self).__init__(bot)
+        self.speed = bot.kill_replay_speed
+        self.read = 0
+        self.started = None
+        self.finished = None
+        self.read_finished = threading.Event()
+
+    @staticmethod
+    def path_from_url(url):
+        url = urlparse.urlparse(url)
+        if url.scheme != 'file':
+            return url.path
+        return url.netloc + url.path
+
+    def _run(self):
+        self.started = time()
+        last_time = None
+        with open(self.path_from_url(self.url)) as f:
+            for line in f:
+                if not self.running:
+                    break
+                if not line.strip():
+                    continue
+                kill = json.loads(line)
+                kill_time = datetime.strptime(kill['killTime'], KILL_TIME_FORMAT)
+                if self.speed and last_time is not None:
+                    delay = (kill_time - last_time).total_seconds() / self.speed
+                    if delay > 0:
+                        sleep(delay)
+                last_time = kill_time
+                kill['killTime'] = datetime.utcnow().strftime(KILL_TIME_FORMAT)
+                message = json.dumps(kill)
+                self.read += 1
+                if self.speed:
+                    self.on_message({}, message)
+                else:
+                    # Apply backpressure rather than dropping when replaying flat out
+                    self.queue.put((None, {}, message))
+        self.read_finished.set()
+
+    def wait(self, timeout=None):
+        """Wait for the whole file to be replayed and processed, returns False on timeout"""
+        if not self.read_finished.wait(timeout):
+            return False
+        self.queue.join()
+        self.finished = time()
+        return True
+
+    def stats(self):
+        stats = super(ReplayKillSource, self).stats()
+        elapsed = (self.finished or time()) - self.started if self.started else 0
+        stats.update({
+            'read': self.read,
+            'elapsed': elapsed,
+            'rate': self.processed / elapsed if elapsed else 0,
+        })
+        return stats
@@ -1,8 +1,22 @@
 import math
+from collections import defaultdict
+from itertools import izip
+from heapq import heappush, heappop
+from hashlib import sha1
+from array import array
+from bisect import bisect_left, bisect_right
+import struct
+import sys
+import logging
 import networkx
 from networkx.readwrite.json_graph import node_link_data, node_link_graph
 from json import loads, dumps
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 hull_classes = {
     'chimera': 'carrier',
     'archon': 'carrier',
@@ -68,12 +82,38 @@ EVE_LY = 9460000000000000  # EVE's definition of a ly in KM
 
 JDC_BONUS = 0.20
 
+SPATIAL_CELL_SIZE = 5.0  # Size of a spatial index grid cell, in ly
+
+GATE_LINK_TYPES = ('gate', 'bridge')
+
+# Gate routing preferences, matching the EVE client's autopilot options
+ROUTE_SHORTEST = 'shortest'
+ROUTE_HIGHSEC = 'highsec'
+ROUTE_AVOID_LOWSEC = 'avoid-lowsec'
+ROUTE_PREFERENCES = (ROUTE_SHORTEST, ROUTE_HIGHSEC, ROUTE_AVOID_LOWSEC)
+
+MAP_MAGIC = 'DBMP'
+MAP_VERSION = 1
+MAP_HEADER = struct.Struct('<4sIIIII')
+
+LOWSEC_PENALTY = 50  # Cost of a jump into low/nullsec when preferring highsec routes
+
 
 def calc_distance(sys1, sys2):
     """Calculate the distance in light years between two sets of 3d coordinates"""
     return math.sqrt(sum((a - b)**2 for a, b in zip(sys1, sys2))) / EVE_LY
 
 
+def _numpy_distances(points, coords):
+    """
+    Vectorized calc_distance between a matrix of points and a set of coordinates (or a matrix of the
+    same shape). numpy.power is used over ** as it goes through the C pow() like calc_distance does,
+    and the axes are summed in the same order, so the results are identical
+    """
+    delta = numpy.power(points - numpy.asarray(coords, dtype=numpy.float64), 2.0)
+    return numpy.sqrt(delta[:, 0] + delta[:, 1] + delta[:, 2]) / EVE_LY
+
+
 def hull_to_range(hull, jdc_skill):
     """Returns the jump range of a provided ship hull and Jump Drive Calibration skill"""
     if hull.lower() not in hull_classes:
@@ -90,11 +130,393 @@ def ship_class_to_range(ship_class, jdc_skill):
     return jump_range
 
 
+# All effective jump ranges of the known ship classes at JDC 0-5
+JUMP_RANGES = frozenset(ship_class_to_range(ship_class, skill) for ship_class in base_range for skill in range(0, 6))
+MAX_JUMP_RANGE = max(JUMP_RANGES)
+
+
+class SpatialIndex(object):
+    """
+    A uniform grid over system coordinates, used to answer "all systems within
+    X ly" queries without scanning the whole universe
+    """
+
+    def __init__(self, cell_size=SPATIAL_CELL_SIZE):
+        self.cell_size = cell_size * EVE_LY
+        self.cells = defaultdict(list)
+        self.coords = {}
+
+    def __len__(self):
+        return len(self.coords)
+
+    def _cell(self, coords):
+        return tuple(int(math.floor(c / self.cell_size)) for c in coords)
+
+    def insert(self, system_id, coords):
+        """Add a system to the index, replacing any existing entry"""
+        if system_id in self.coords:
+            self.remove(system_id)
+        self.coords[system_id] = coords
+        self.cells[self._cell(coords)].append(system_id)
+
+    def remove(self, system_id):
+        """Remove a system from the index"""
+        coords = self.coords.pop(system_id, None)
+        if coords is None:
+            return
+        cell = self._cell(coords)
+        self.cells[cell].remove(system_id)
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    def query(self, coords, range):
+        """Returns a list of (system_id, distance) tuples within range ly of the coordinates"""
+        radius = range * EVE_LY
+        low = self._cell([c - radius for c in coords])
+        high = self._cell([c + radius for c in coords])
+
+        results = []
+        for x in xrange(low[0], high[0] + 1):
+            for y in xrange(low[1], high[1] + 1):
+                for z in xrange(low[2], high[2] + 1):
+                    for system_id in self.cells.get((x, y, z), ()):
+                        distance = calc_distance(coords, self.coords[system_id])
+                        if distance <= range:
+                            results.append((system_id, distance))
+        return results
+
+
+class JumpGraph(object):
+    """
+    Jump adjacency of systems up to a fixed range. Each system's neighbours are held sorted
+    by distance so the neighbours for any shorter range are a prefix of the list.
+    """
+
+    MAGIC = 'DBJG'
+    VERSION = 2
+    HEADER = struct.Struct('<4sI40sdII')
+
+    def __init__(self, range):
+        self.range = range
+        self.adjacency = {}
+
+    def __contains__(self, system_id):
+        return system_id in self.adjacency
+
+    def __len__(self):
+        return len(self.adjacency)
+
+    def add(self, system_id, neighbours):
+        """Store the (system_id, distance) neighbours of a system"""
+        neighbours = sorted(neighbours, key=lambda x: x[1])
+        self.adjacency[system_id] = (array('i', [x for x, y in neighbours]), array('d', [y for x, y in neighbours]))
+
+    def neighbours(self, system_id, range):
+        """Returns a list of (system_id, distance) tuples within range of the system"""
+        ids, distances = self.adjacency[system_id]
+        count = bisect_right(distances, range)
+        return zip(ids[:count], distances[:count])
+
+    def to_binary(self, map_hash):
+        """
+        Pack the graph into a CSR style binary blob. Only the neighbour IDs are stored, in distance order,
+        as the distances can be recalculated from the map data the blob is keyed to
+        """
+        system_ids = array('i', sorted(self.adjacency))
+        offsets = array('I', [0])
+        ids = array('i')
+        for system_id in system_ids:
+            ids.extend(self.adjacency[system_id][0])
+            offsets.append(len(ids))
+        header = self.HEADER.pack(self.MAGIC, self.VERSION, map_hash, self.range, len(system_ids), len(ids))
+        return header + ''.join(_array_to_le(x) for x in (system_ids, offsets, ids))
+
+    @staticmethod
+    def from_binary(data, distances, map_hash=None):
+        """
+        Unpack a graph from a binary blob, raising ValueError if it is invalid or doesn't match the map hash.
+        distances is called with arrays of source and destination system IDs and returns the distances between them
+        """
+        if len(data) < JumpGraph.HEADER.size:
+            raise ValueError('Truncated jump graph data')
+        magic, version, data_hash, range, system_count, neighbour_count = JumpGraph.HEADER.unpack_from(data)
+        if magic != JumpGraph.MAGIC or version != JumpGraph.VERSION:
+            raise ValueError('Not jump graph data, or an unsupported version')
+        if map_hash and data_hash != map_hash:
+            raise ValueError('Jump graph was built from different map data')
+
+        offset = JumpGraph.HEADER.size
+        system_ids, offset = _array_from_le('i', data, offset, system_count)
+        offsets, offset = _array_from_le('I', data, offset, system_count + 1)
+        ids, offset = _array_from_le('i', data, offset, neighbour_count)
+
+        sources = array('i')
+        for idx, system_id in enumerate(system_ids):
+            sources.extend(array('i', [system_id]) * (offsets[idx + 1] - offsets[idx]))
+        all_distances = distances(sources, ids)
+
+        graph = JumpGraph(range)
+        for idx, system_id in enumerate(system_ids):
+            start, end = offsets[idx], offsets[idx + 1]
+            graph.adjacency[system_id] = (ids[start:end], all_distances[start:end])
+        return graph
+
+
+def _pack_strings(strings):
+    """Pack a list of unicode strings into an offset table and a UTF-8 blob"""
+    encoded = [x.encode('utf8') for x in strings]
+    offsets = array('I', [0])
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+    return _array_to_le(offsets) + ''.join(encoded)
+
+
+def _unpack_strings(data, offset, count):
+    """Read a list of unicode strings packed by _pack_strings, returning the list and the new offset"""
+    offsets, offset = _array_from_le('I', data, offset, count + 1)
+    end = offset + offsets[-1]
+    if len(data) < end:
+        raise ValueError('Truncated string data')
+    blob = data[offset:end]
+    return [blob[offsets[idx]:offsets[idx + 1]].decode('utf8') for idx in xrange(count)], end
+
+
+def _array_to_le(arr):
+    """Returns the little-endian bytes of an array"""
+    if sys.byteorder != 'little':
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tostring()
+
+
+def _array_from_le(typecode, data, offset, count):
+    """Read a little-endian array from data at offset, returning the array and the new offset"""
+    arr = array(typecode)
+    end = offset + (arr.itemsize * count)
+    if len(data) < end:
+        raise ValueError('Truncated array data')
+    arr.fromstring(data[offset:end])
+    if sys.byteorder != 'little':
+        arr.byteswap()
+    return arr, end
+
+
 class Map(networkx.Graph):
     """
     A in-memory representation of the EVE Universe map, using NetworkX
     """
 
+    _spatial_index = None
+    _jump_graph = None
+    _map_hash = None
+    _gate_graph = None
+    _name_index = None
+    _coordinate_matrix = None
+
+    def add_node(self, n, attr_dict=None, **attr):
+        super(Map, self).add_node(n, attr_dict, **attr)
+        self._invalidate_nodes()
+
+    def add_nodes_from(self, nodes, **attr):
+        super(Map, self).add_nodes_from(nodes, **attr)
+        self._invalidate_nodes()
+
+    def remove_node(self, n):
+        super(Map, self).remove_node(n)
+        self._invalidate_nodes()
+
+    def remove_nodes_from(self, nodes):
+        super(Map, self).remove_nodes_from(nodes)
+        self._invalidate_nodes()
+
+    def clear(self):
+        super(Map, self).clear()
+        self._invalidate_nodes()
+
+    def _invalidate_nodes(self):
+        """Drop any data derived from the nodes of the map"""
+        self._spatial_index = None
+        self._jump_graph = None
+        self._map_hash = None
+        self._gate_graph = None
+        self._name_index = None
+        self._coordinate_matrix = None
+
+    def add_edge(self, u, v, attr_dict=None, **attr):
+        super(Map, self).add_edge(u, v, attr_dict, **attr)
+        if self._gate_graph is not None:
+            self._update_gate_edge(u, v)
+
+    def add_edges_from(self, ebunch, attr_dict=None, **attr):
+        super(Map, self).add_edges_from(ebunch, attr_dict, **attr)
+        self._gate_graph = None
+
+    def remove_edge(self, u, v):
+        super(Map, self).remove_edge(u, v)
+        if self._gate_graph is not None:
+            self._update_gate_edge(u, v)
+
+    def remove_edges_from(self, ebunch):
+        super(Map, self).remove_edges_from(ebunch)
+        self._gate_graph = None
+
+    @property
+    def gate_graph(self):
+        """Adjacency of systems linked by gates or jump bridges, a dict of system ID to a set of system IDs"""
+        if self._gate_graph is None:
+            graph = {}
+            for u, v, d in self.edges_iter(data=True):
+                if d.get('link_type') in GATE_LINK_TYPES:
+                    graph.setdefault(u, set()).add(v)
+                    graph.setdefault(v, set()).add(u)
+            self._gate_graph = graph
+        return self._gate_graph
+
+    def _update_gate_edge(self, u, v):
+        """Sync a single edge of the map into the gate graph"""
+        if v in self.adj.get(u, {}) and self.adj[u][v].get('link_type') in GATE_LINK_TYPES:
+            self._gate_graph.setdefault(u, set()).add(v)
+            self._gate_graph.setdefault(v, set()).add(u)
+        else:
+            self._gate_graph.get(u, set()).discard(v)
+            self._gate_graph.get(v, set()).discard(u)
+
+    @property
+    def spatial_index(self):
+        """
+        The spatial index of system coordinates, rebuilt after any node is added or removed.
+        Changes to the coordinates of an existing node require a call to reindex()
+        """
+        if self._spatial_index is None:
+            self.reindex()
+        return self._spatial_index
+
+    def reindex(self):
+        """Rebuild the spatial index from the current node data"""
+        self._invalidate_nodes()
+        index = SpatialIndex()
+        for system_id, data in self.nodes_iter(data=True):
+            if 'coords' in data:
+                index.insert(system_id, data['coords'])
+        self._spatial_index = index
+
+    @property
+    def coordinate_matrix(self):
+        """
+        A tuple of a NumPy array of system IDs and a matrix of their coordinates, used for batched
+        distance calculations. None if NumPy isn't available
+        """
+        if numpy is None:
+            return None
+        if self._coordinate_matrix is None:
+            coords = self.spatial_index.coords
+            # Sorted by system ID so rows can be found with searchsorted
+            system_ids = sorted(coords)
+            ids = numpy.array(system_ids, dtype=numpy.int64)
+            points = numpy.array([coords[x] for x in system_ids], dtype=numpy.float64).reshape((len(ids), 3))
+            self._coordinate_matrix = (ids, points)
+        return self._coordinate_matrix
+
+    def systems_in_range(self, coords, range):
+        """Returns a list of (system_id, distance) tuples within range ly of the coordinates"""
+        matrix = self.coordinate_matrix
+        if matrix is None:
+            return self.spatial_index.query(coords, range)
+        ids, points = matrix
+        # Cheaply drop anything clearly out of range before calculating exact distances
+        delta = points - numpy.asarray(coords, dtype=numpy.float64)
+        candidates = (delta * delta).sum(axis=1) <= (range * EVE_LY) ** 2 * (1 + 1e-9)
+        ids = ids[candidates]
+        distances = _numpy_distances(points[candidates], coords)
+        mask = distances <= range
+        return zip(ids[mask].tolist(), distances[mask].tolist())
+
+    def distances_between(self, sources, destinations):
+        """Returns an array of the distances in ly between each pair of an array of source and destination system IDs"""
+        matrix = self.coordinate_matrix
+        if matrix is None or not len(sources):
+            node = self.node
+            return array('d', [calc_distance(node[x]['coords'], node[y]['coords']) for x, y in izip(sources, destinations)])
+        ids, points = matrix
+        source_rows = numpy.searchsorted(ids, numpy.frombuffer(sources, dtype=numpy.intc).astype(numpy.int64))
+        destination_rows = numpy.searchsorted(ids, numpy.frombuffer(destinations, dtype=numpy.intc).astype(numpy.int64))
+        distances = array('d')
+        distances.fromstring(_numpy_distances(points[destination_rows], points[source_rows]).tostring())
+        return distances
+
+    def distances_from(self, system_id):
+        """Returns a dict of system ID to distance in ly for every system in the map"""
+        coords = self.node[system_id]['coords']
+        matrix = self.coordinate_matrix
+        if matrix is None:
+            return dict((x, calc_distance(coords, y)) for x, y in self.spatial_index.coords.items())
+        ids, points = matrix
+        distances = _numpy_distances(points, coords)
+        return dict(zip(ids.tolist(), distances.tolist()))
+
+    @property
+    def name_index(self):
+        """
+        Case folded lookups of system names, a tuple of a dict of name to system ID and a sorted
+        list of (name, system ID) tuples for prefix searches
+        """
+        if self._name_index is None:
+            exact = {}
+            names = []
+            for system_id, data in self.nodes_iter(data=True):
+                if 'name' not in data:
+                    continue
+                name = data['name'].lower()
+                exact[name] = min(system_id, exact.get(name, system_id))
+                names.append((name, system_id))
+            names.sort()
+            self._name_index = (exact, names)
+        return self._name_index
+
+    def map_hash(self):
+        """Returns a hash of the system coordinates, used to validate cached jump graphs"""
+        if self._map_hash is None:
+            key_hash = sha1()
+            for system_id in sorted(self.nodes_iter()):
+                coords = self.node[system_id].get('coords')
+                if coords:
+                    key_hash.update('{}:{!r},{!r},{!r};'.format(system_id, *coords))
+            self._map_hash = key_hash.hexdigest()
+        return self._map_hash
+
+    @property
+    def jump_graph(self):
+        """The memoized jump adjacency of every system at the maximum range of all ship classes"""
+        if self._jump_graph is None:
+            self._jump_graph = JumpGraph(MAX_JUMP_RANGE)
+        return self._jump_graph
+
+    def jump_destinations(self, coords, range):
+        """Returns a list of (system_id, distance) tuples of the systems capitals can jump to within range ly"""
+        return [(x, y) for x, y in self.systems_in_range(coords, range) if self.node[x]['security'] < 0.45]
+
+    def build_jump_graph(self):
+        """Populate the jump adjacency for every system in the map"""
+        graph = self.jump_graph
+        for system_id in self.spatial_index.coords:
+            if system_id not in graph:
+                graph.add(system_id, self.jump_destinations(self.node[system_id]['coords'], graph.range))
+        return graph
+
+    def dump_jump_cache(self):
+        """Dump the jump graph to a binary output, keyed to the current map data"""
+        return self.build_jump_graph().to_binary(self.map_hash())
+
+    def load_jump_cache(self, data):
+        """Load a jump graph from a binary output, ignoring it if it was built from different map data"""
+        try:
+            graph = JumpGraph.from_binary(data, self.distances_between, self.map_hash())
+        except ValueError:
+            logging.warning('Jump graph cache is invalid or was built from different map data, ignoring')
+            return False
+        self._jump_graph = graph
+        return True
+
     def from_sde(self, db_conn):
         """Load map data from a EVE SDE Sqlite DB"""
         for id, name, region_name, x, y, z, security in db_conn.execute("""
@@ -105,6 +527,7 @@ class Map(networkx.Graph):
             self.add_node(id, system_id=id, name=name, region=region_name, coords=(x, y, z), security=security)
         for from_id, to_id in db_conn.execute("SELECT fromSolarSystemID, toSolarSystemID FROM mapSolarSystemJumps"):
             self.add_edge(from_id, to_id, weight=1, link_type='gate')
+        self.reindex()
 
     def build_jumps(self):
         """Constructs the possible jump network"""
@@ -125,7 +548,103 @@ class Map(networkx.Graph):
     @staticmethod
     def from_json(json):
         """Load map data from a Node Link JSON output"""
-        return Map(data=node_link_graph(loads(json)))
+        map = Map(data=node_link_graph(loads(json)))
+        map.reindex()
+        return map
+
+    def to_binary(self):
+        """
+        Dump map data to a compact binary output: packed system coordinates, security and
+        region/name string tables followed by a CSR adjacency of the links between systems
+        """
+        system_ids = array('i', self.nodes_iter())
+        positions = dict((system_id, idx) for idx, system_id in enumerate(system_ids))
+        coords = array('d')
+        security = array('d')
+        names = []
+        regions = []
+        region_ids = array('H')
+        region_positions = {}
+        link_types = []
+        link_type_positions = {}
+
+        for system_id in system_ids:
+            data = self.node[system_id]
+            coords.extend(data['coords'])
+            security.append(data['security'])
+            names.append(data['name'])
+            if data['region'] not in region_positions:
+                region_positions[data['region']] = len(regions)
+                regions.append(data['region'])
+            region_ids.append(region_positions[data['region']])
+
+        offsets = array('I', [0])
+        neighbours = array('i')
+        neighbour_types = array('B')
+        weights = array('d')
+        for system_id in system_ids:
+            for neighbour_id, data in self.adj[system_id].items():
+                link_type = data.get('link_type')
+                if link_type not in link_type_positions:
+                    link_type_positions[link_type] = len(link_types)
+                    link_types.append(link_type)
+                neighbours.append(positions[neighbour_id])
+                neighbour_types.append(link_type_positions[link_type])
+                weights.append(data.get('weight', 1))
+            offsets.append(len(neighbours))
+
+        header = MAP_HEADER.pack(MAP_MAGIC, MAP_VERSION, len(system_ids), len(neighbours), len(regions), len(link_types))
+        return header + ''.join([
+            _array_to_le(system_ids), _array_to_le(coords), _array_to_le(security), _array_to_le(region_ids),
+            _pack_strings(names), _pack_strings(regions), _pack_strings(link_types),
+            _array_to_le(offsets), _array_to_le(neighbours), _array_to_le(neighbour_types), _array_to_le(weights),
+        ])
+
+    @staticmethod
+    def from_binary(data):
+        """Load map data from a binary output, data can be a string or a mmap of the file"""
+        if len(data) < MAP_HEADER.size:
+            raise ValueError('Truncated map data')
+        magic, version, system_count, neighbour_count, region_count, link_type_count = MAP_HEADER.unpack(data[:MAP_HEADER.size])
+        if magic != MAP_MAGIC or version != MAP_VERSION:
+            raise ValueError('Not map data, or an unsupported version')
+
+        offset = MAP_HEADER.size
+        system_ids, offset = _array_from_le('i', data, offset, system_count)
+        coords, offset = _array_from_le('d', data, offset, system_count * 3)
+        security, offset = _array_from_le('d', data, offset, system_count)
+        region_ids, offset = _array_from_le('H', data, offset, system_count)
+        names, offset = _unpack_strings(data, offset, system_count)
+        regions, offset = _unpack_strings(data, offset, region_count)
+        link_types, offset = _unpack_strings(data, offset, link_type_count)
+        offsets, offset = _array_from_le('I', data, offset, system_count + 1)
+        neighbours, offset = _array_from_le('i', data, offset, neighbour_count)
+        neighbour_types, offset = _array_from_le('B', data, offset, neighbour_count)
+        weights, offset = _array_from_le('d', data, offset, neighbour_count)
+
+        map = Map()
+        map.add_nodes_from((system_id, {
+            'system_id': system_id,
+            'name': names[idx],
+            'region': regions[region_ids[idx]],
+            'coords': tuple(coords[idx * 3:(idx + 1) * 3]),
+            'security': security[idx],
+        }) for idx, system_id in enumerate(system_ids))
+
+        def edges():
+            for idx, system_id in enumerate(system_ids):
+                for pos in xrange(offsets[idx], offsets[idx + 1]):
+                    # Each link is stored in both directions, only add it once
+                    if neighbours[pos] > idx:
+                        continue
+                    yield system_id, system_ids[neighbours[pos]], {
+                        'link_type': link_types[neighbour_types[pos]],
+                        'weight': weights[pos],
+                    }
+
+        map.add_edges_from(edges())
+        map.reindex()
+        return map
 
     def get_system_name(self, system_id):
         """Returns the name of the provided system id"""
@@ -136,23 +655,157 @@ class Map(networkx.Graph):
 
     def get_system_id(self, name):
         """Returns the system id of the named system"""
-        for k, v in self.nodes_iter(data=True):
-            if 'name' in v and v['name'].lower() == name.lower():
-                return k
+        return self.name_index[0].get(name.lower())
 
     def get_systems(self, name):
-        """Returns a list of systems by a partial system name"""
-        return [k for k, v in self.nodes_iter(data=True) if v['name'].lower().find(name.lower()) == 0]
+        """Returns a list of systems by a partial system name, ordered by system ID"""
+        name = name.lower()
+        names = self.name_index[1]
+        matches = []
+        for idx in xrange(bisect_left(names, (name,)), len(names)):
+            if not names[idx][0].startswith(name):
+                break
+            matches.append(names[idx][1])
+        return sorted(matches)
 
     def system_distance(self, source, destination):
         """Calculates the distance in ly between two systems"""
         return calc_distance(self.node[source]['coords'], self.node[destination]['coords'])
 
-    def route_gate(self, source, destination, filter=None):
-        """Route between two systems using gates (fastest)"""
-        # TODO: add EVE routing options (highsec/lowsec/fastest)
-        g = networkx.Graph(data=[(u, v) for u, v, d in self.edges_iter(data=True) if d['link_type'] == 'gate' or d['link_type'] == 'bridge'])
-        return networkx.astar_path(self, source, destination)
+    def route_gate(self, source, destination, preference=ROUTE_SHORTEST):
+        """
+        Route between two systems using gates and jump bridges, returns an empty list if there is no route
+
+        Avoiding lowsec only routes through systems with a security of 0.45 or above, the source and destination
+        are always included so lowsec and nullsec systems bordering highsec can still be reached.
+        """
+        if preference == ROUTE_SHORTEST:
+            return self._route_bfs(source, destination)
+        elif preference == ROUTE_AVOID_LOWSEC:
+            return self._route_bfs(source, destination, exclude=lambda x: self.node[x]['security'] < 0.45)
+        elif preference == ROUTE_HIGHSEC:
+            return self._route_weighted(source, destination, cost=lambda x: 1 if self.node[x]['security'] >= 0.45 else LOWSEC_PENALTY)
+        raise ValueError('Unknown routing preference {}'.format(preference))
+
+    def _route_bfs(self, source, destination, exclude=None):
+        """Bidirectional breadth first search over the gate graph, optionally excluding systems from the route"""
+        if source not in self.node or destination not in self.node:
+            raise KeyError('Unknown system')
+        if source == destination:
+            return [source]
+        graph = self.gate_graph
+        pred = {source: None}
+        succ = {destination: None}
+        forward = [source]
+        reverse = [destination]
+
+        while forward and reverse:
+            if len(forward) <= len(reverse):
+                level, forward = forward, []
+                for current in level:
+                    for neighbour in graph.get(current, ()):
+                        if neighbour in pred:
+                            continue
+                        if neighbour in succ:
+                            pred[neighbour] = current
+                            return self._join_path(pred, succ, neighbour)
+                        if exclude and exclude(neighbour):
+                            continue
+                        pred[neighbour] = current
+                        forward.append(neighbour)
+            else:
+                level, reverse = reverse, []
+                for current in level:
+                    for neighbour in graph.get(current, ()):
+                        if neighbour in succ:
+                            continue
+                        if neighbour in pred:
+                            succ[neighbour] = current
+                            return self._join_path(pred, succ, neighbour)
+                        if exclude and exclude(neighbour):
+                            continue
+                        succ[neighbour] = current
+                        reverse.append(neighbour)
+        return []
+
+    def nearest_of(self, source, targets, link_types=GATE_LINK_TYPES):
+        """
+        Finds the closest of a set of target systems to the source by number of jumps over the
+        provided link types, returns a tuple of the target and the route to it, or (None, [])
+        """
+        targets = set(targets)
+        if source not in self.node:
+            raise KeyError('Unknown system')
+        if source in targets:
+            return source, [source]
+
+        if set(link_types) == set(GATE_LINK_TYPES):
+            graph = self.gate_graph
+            neighbours = lambda x: graph.get(x, ())
+        else:
+            neighbours = lambda x: [k for k, v in self.adj[x].items() if v.get('link_type') in link_types]
+
+        pred = {source: None}
+        level = [source]
+        while level:
+            next_level = []
+            for current in level:
+                for neighbour in neighbours(current):
+                    if neighbour in pred:
+                        continue
+                    pred[neighbour] = current
+                    if neighbour in targets:
+                        return neighbour, self._join_path(pred, {neighbour: None}, neighbour)
+                    next_level.append(neighbour)
+            level = next_level
+        return None, []
+
+    @staticmethod
+    def _join_path(pred, succ, meet):
+        """Join the two halves of a bidirectional search at the system they met at"""
+        path = []
+        current = meet
+        while current is not None:
+            path.append(current)
+            current = pred[current]
+        path.reverse()
+        current = succ[meet]
+        while current is not None:
+            path.append(current)
+            current = succ[current]
+        return path
+
+    def _route_weighted(self, source, destination, cost):
+        """Dijkstra search over the gate graph, cost is called with each system entered"""
+        if source not in self.node or destination not in self.node:
+            raise KeyError('Unknown system')
+        graph = self.gate_graph
+        route = {}
+        scores = {source: 0}
+        closed_set = set()
+        open_heap = [(0, source)]
+
+        while open_heap:
+            score, current = heappop(open_heap)
+            if current in closed_set:
+                continue
+            if current == destination:
+                path = [current]
+                while current in route:
+                    current = route[current]
+                    path.append(current)
+                path.reverse()
+                return path
+            closed_set.add(current)
+            for neighbour in graph.get(current, ()):
+                if neighbour in closed_set:
+                    continue
+                new_score = score + cost(neighbour)
+                if neighbour not in scores or new_score < scores[neighbour]:
+                    scores[neighbour] = new_score
+                    route[neighbour] = current
+                    heappush(open_heap, (new_score, neighbour))
+        return []
 
     def _route_jump_fast(self, source, destination, range=None, hull=None, ship_class=None, station_only=False, avoid_systems=[]):
         """A fast but error prone route calculation between two systems using jumps"""
@@ -183,24 +836,23 @@ class Map(networkx.Graph):
     def route_jump(self, source, destination, range=None, hull=None, ship_class=None, station_only=False, avoid_systems=[]):
         """Calculate a jump route between two systems"""
         closed_set = set()
-        open_set = set([source])
         route = {}
         g_score = {source: 0}
         f_score = {source: g_score[source] + self.system_distance(source, destination)}
+        open_heap = [(f_score[source], source)]
 
-        while len(open_set):
-            current = min([x for x in f_score.items() if x[0] in open_set], key=lambda x: x[1])[0]
+        while open_heap:
+            score, current = heappop(open_heap)
+            # Skip entries superseded by a better score or already expanded
+            if current in closed_set or score != f_score[current]:
+                continue
             if current == destination:
-
-                def build_path(route, current):
-                    if current in route:
-                        p = build_path(route, route[current])
-                        p.append(current)
-                        return p
-                    return [current]
-
-                return build_path(route, destination)
-            open_set.remove(current)
+                path = [current]
+                while current in route:
+                    current = route[current]
+                    path.append(current)
+                path.reverse()
+                return path
             closed_set.add(current)
             for neighbor, distance in self.neighbors_jump(current, range, hull, ship_class):
                 neighbor_id = neighbor['system_id']
@@ -210,23 +862,33 @@ class Map(networkx.Graph):
                    neighbor_id in avoid_systems:
                     continue
 
-                score = g_score[current] + self.system_distance(current, neighbor_id)
-                if neighbor_id not in open_set or score < g_score[neighbor_id]:
+                score = g_score[current] + distance
+                if neighbor_id not in g_score or score < g_score[neighbor_id]:
                     route[neighbor_id] = current
                     g_score[neighbor_id] = score
                     f_score[neighbor_id] = score + self.system_distance(neighbor_id, destination)
-                    if neighbor_id not in open_set:
-                        open_set.add(neighbor_id)
+                    heappush(open_heap, (f_score[neighbor_id], neighbor_id))
+        return []
+
+    def route_leg_distances(self, route):
+        """Returns a list of the ly distance of each jump in a route"""
+        if len(route) < 2:
+            return []
+        if numpy is None:
+            return [self.system_distance(x, y) for x, y in zip(route[:-1], route[1:])]
+        points = numpy.array([self.node[x]['coords'] for x in route], dtype=numpy.float64)
+        return _numpy_distances(points[1:], points[:-1]).tolist()
 
     def route_jump_distance(self, route):
         """Calculate the total ly distance of a route"""
-        source = route[0]
+        # The route ends at the first repeated system
+        for idx in xrange(1, len(route)):
+            if route[idx] == route[idx - 1]:
+                route = route[:idx]
+                break
         ly = 0.0
-        for destination in route[1:]:
-            if destination == source:
-                return ly
-            ly += self.system_distance(source, destination)
-            source = destination
+        for distance in self.route_leg_distances(route):
+            ly += distance
         return ly
 
     def route_jump_isotopes(self, route, jfc_skill, jf_skill=None, hull=None, ship_class=None):
@@ -245,8 +907,9 @@ class Map(networkx.Graph):
         ly = self.route_jump_distance(route)
         return round(ly * base, 0)
 
-    def jump_fatigue(self, fatigue, source, destination, bonus=0, ship_class=None, jump_type='standard'):
-        """Calculate the jump fatigue gained by jumping between two systems"""
+    @staticmethod
+    def _fatigue_bonus(bonus, ship_class, jump_type):
+        """Returns the fatigue bonus of a ship class for a jump type, unless a bonus is provided"""
         if bonus == 0 and ship_class:
             standard = covert = 0
             if ship_class and ship_class in fatiuge_bonus:
@@ -255,17 +918,28 @@ class Map(networkx.Graph):
                 bonus = standard
             else:
                 bonus = covert
-        distance = self.system_distance(source, destination)
+        return bonus
+
+    @staticmethod
+    def _jump_fatigue(fatigue, distance, bonus):
+        """Calculate the cooldown and new fatigue for a jump of a distance"""
         cooldown = max(fatigue / 10, 1 + (distance * (1-bonus)))
         new_fatigue = min(60 * 24 * 30, max(fatigue, 10) * (1 + (distance * (1 - bonus))))
         return round(cooldown, 2), round(new_fatigue, 2)
 
+    def jump_fatigue(self, fatigue, source, destination, bonus=0, ship_class=None, jump_type='standard'):
+        """Calculate the jump fatigue gained by jumping between two systems"""
+        bonus = self._fatigue_bonus(bonus, ship_class, jump_type)
+        return self._jump_fatigue(fatigue, self.system_distance(source, destination), bonus)
+
     def route_jump_fatigue(self, route, fatigue, bonus=0, ship_class=None, jump_type='standard'):
         """Calculate the jump fatigue for the specified route"""
         results = []
+        bonus = self._fatigue_bonus(bonus, ship_class, jump_type)
+        distances = self.route_leg_distances(route)
         source = route.pop(0)
-        for target in route:
-            cooldown, new_fatigue = self.jump_fatigue(fatigue, source, target, bonus, ship_class, jump_type)
+        for target, distance in zip(route, distances):
+            cooldown, new_fatigue = self._jump_fatigue(fatigue, distance, bonus)
             results.append({
                 'source': source, 'target': target, 'cooldown': cooldown, 'fatigue': new_fatigue,
             })
@@ -278,9 +952,7 @@ class Map(networkx.Graph):
         return self.neighbors(system_id)
 
     def neighbors_jump(self, system_id, range=None, hull=None, ship_class=None):
-        """List all systems within a jump radius"""
-        source = self.node[system_id]
-
+        """List all systems within a jump radius which can be jumped to, excluding highsec"""
         if not range:
             if hull:
                 range = hull_to_range(hull, 5)
@@ -289,18 +961,12 @@ class Map(networkx.Graph):
             else:
                 raise ValueError('No range, hull, or ship class provided')
 
-        # Calculate the max coords for the jump radius, avoiding costly calc_distance calls
-        range_x = (source['coords'][0] + (range * EVE_LY), source['coords'][0] - (range * EVE_LY))
-        range_y = (source['coords'][1] + (range * EVE_LY), source['coords'][1] - (range * EVE_LY))
-        range_z = (source['coords'][2] + (range * EVE_LY), source['coords'][2] - (range * EVE_LY))
-
-        destinations = []
-        for destination_id, destination_data in self.nodes_iter(data=True):
-            if destination_data['coords'][0] > range_x[0] or destination_data['coords'][0] < range_x[1] or \
-               destination_data['coords'][1] > range_y[0] or destination_data['coords'][1] < range_y[1] or \
-               destination_data['coords'][2] > range_z[0] or destination_data['coords'][2] < range_z[1]:
-                continue
-            distance = calc_distance(source['coords'], destination_data['coords'])
-            if distance <= range and destination_id != system_id:
-                destinations.append((destination_data, distance))
-        return destinations
+        coords = self.node[system_id]['coords']
+        if range <= MAX_JUMP_RANGE:
+            graph = self.jump_graph
+            if system_id not in graph:
+                graph.add(system_id, self.jump_destinations(coords, graph.range))
+            neighbours = graph.neighbours(system_id, range)
+        else:
+            neighbours = self.jump_destinations(coords, range)
+        return [(self.node[x], y) for x, y in neighbours if x != system_id]
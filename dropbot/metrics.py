@@ -0,0 +1,171 @@
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from bisect import bisect_left
+from time import time
+import threading
+import logging
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(object):
+    """A thread safe count, error count and latency histogram of a single operation"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.errors = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds, error=False):
+        idx = bisect_left(self.buckets, seconds)
+        with self.lock:
+            self.counts[idx] += 1
+            self.count += 1
+            self.sum += seconds
+            if error:
+                self.errors += 1
+
+    def quantile(self, q):
+        """Returns the upper bound of the bucket the q quantile falls in, or None if it's over the largest bucket"""
+        with self.lock:
+            target = q * self.count
+            total = 0
+            for idx, count in enumerate(self.counts):
+                total += count
+                if total >= target and total:
+                    return self.buckets[idx] if idx < len(self.buckets) else None
+            return None
+
+
+class _Timer(object):
+    """Context manager that records the time taken and whether an exception was raised"""
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.histogram.observe(time() - self.start, exc_type is not None)
+        return False
+
+
+class Metrics(object):
+    """
+    Collects latency histograms of operations, grouped by the kind of operation (command, eveapi, etc)
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, group, name):
+        """Returns the histogram for an operation, creating it if needed"""
+        key = (group, name)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(self.buckets)
+        return histogram
+
+    def observe(self, group, name, seconds, error=False):
+        self.histogram(group, name).observe(seconds, error)
+
+    def timer(self, group, name):
+        """Returns a context manager that times the block it wraps"""
+        return _Timer(self.histogram(group, name))
+
+    def summary(self, group=None):
+        """Returns a line for each operation with its count, error rate, mean and 95th percentile latency"""
+        lines = []
+        for (key_group, name), histogram in sorted(self.histograms.items()):
+            if group is not None and key_group != group:
+                continue
+            if not histogram.count:
+                continue
+            p95 = histogram.quantile(0.95)
+            lines.append('{} {}: {} calls, {:.1%} errors, avg {:.0f}ms, p95 {}'.format(
+                key_group,
+                name,
+                histogram.count,
+                float(histogram.errors) / histogram.count,
+                histogram.sum / histogram.count * 1000,
+                '<= {:.0f}ms'.format(p95 * 1000) if p95 is not None else '> {:.0f}s'.format(self.buckets[-1]),
+            ))
+        return lines
+
+    def render(self):
+        """Returns the metrics in the Prometheus text exposition format"""
+        lines = [
+            '# HELP dropbot_requests_total Number of operations handled',
+            '# TYPE dropbot_requests_total counter',
+        ]
+        histograms = sorted(self.histograms.items())
+        for (group, name), histogram in histograms:
+            lines.append('dropbot_requests_total{{group="{}",name="{}"}} {}'.format(group, name, histogram.count))
+        lines.extend([
+            '# HELP dropbot_errors_total Number of operations that failed',
+            '# TYPE dropbot_errors_total counter',
+        ])
+        for (group, name), histogram in histograms:
+            lines.append('dropbot_errors_total{{group="{}",name="{}"}} {}'.format(group, name, histogram.errors))
+        lines.extend([
+            '# HELP dropbot_latency_seconds Time taken by operations',
+            '# TYPE dropbot_latency_seconds histogram',
+        ])
+        for (group, name), histogram in histograms:
+            with histogram.lock:
+                counts = list(histogram.counts)
+                count, total = histogram.count, histogram.sum
+            cumulative = 0
+            for bound, bucket in zip(list(self.buckets) + ['+Inf'], counts):
+                cumulative += bucket
+                lines.append('dropbot_latency_seconds_bucket{{group="{}",name="{}",le="{}"}} {}'.format(
+                    group, name, bound, cumulative))
+            lines.append('dropbot_latency_seconds_sum{{group="{}",name="{}"}} {}'.format(group, name, total))
+            lines.append('dropbot_latency_seconds_count{{group="{}",name="{}"}} {}'.format(group, name, count))
+        return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.metrics.render()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug('Metrics request: ' + format % args)
+
+
+class MetricsServer(HTTPServer):
+    """HTTP server exposing the metrics on /metrics for Prometheus to scrape"""
+
+    def __init__(self, metrics, port, host='127.0.0.1'):
+        HTTPServer.__init__(self, (host, port), _MetricsHandler)
+        self.metrics = metrics
+
+    @property
+    def url(self):
+        return 'http://{}:{}/metrics'.format(*self.server_address)
+
+    def start(self):
+        """Serve requests on a background thread"""
+        thread = threading.Thread(target=self.serve_forever, name='dropbot-metrics')
+        thread.daemon = True
+        thread.start()
+        return thread
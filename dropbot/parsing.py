@@ -0,0 +1,104 @@
+from xml.etree.cElementTree import iterparse
+from datetime import datetime
+import calendar
+
+import eveapi
+
+
+def eveapi_timestamp(value):
+    """Converts an EVE API time to a Unix timestamp"""
+    return calendar.timegm(datetime.strptime(value.strip(), '%Y-%m-%d %H:%M:%S').timetuple())
+
+
+def eveapi_error(code, message):
+    """Returns the eveapi exception for an API error code, as eveapi raises when parsing a response"""
+    code = int(code)
+    if code >= 500:
+        return eveapi.ServerError(code, message)
+    elif code >= 200:
+        return eveapi.AuthenticationError(code, message)
+    elif code >= 100:
+        return eveapi.RequestError(code, message)
+    return eveapi.Error(code, message)
+
+
+class EVEAPIRowStream(object):
+    """
+    Incrementally parses an EVE API response from a file-like object, iterating over the attributes
+    of the top level rows of its rowsets, or only the named fields if provided. Nested rows are
+    skipped and parsed rows are discarded, so memory use stays flat however large the document is.
+
+    The currentTime and cachedUntil of the response are available once it has been iterated.
+    """
+
+    def __init__(self, source, fields=None):
+        self.source = source
+        self.fields = fields
+        self.current_time = None
+        self.cached_until = None
+
+    def __iter__(self):
+        stack = []
+        depth = 0
+        for event, elem in iterparse(self.source, events=('start', 'end')):
+            if event == 'start':
+                stack.append(elem)
+                if elem.tag == 'row':
+                    depth += 1
+                continue
+
+            stack.pop()
+            if elem.tag == 'row':
+                depth -= 1
+                if depth == 0:
+                    if self.fields:
+                        yield dict((x, elem.get(x)) for x in self.fields)
+                    else:
+                        yield elem.attrib
+                    # Drop the parsed row from its rowset
+                    stack[-1].remove(elem)
+            elif elem.tag == 'currentTime':
+                self.current_time = eveapi_timestamp(elem.text)
+            elif elem.tag == 'cachedUntil':
+                self.cached_until = eveapi_timestamp(elem.text)
+            elif elem.tag == 'error':
+                raise eveapi_error(elem.get('code', 0), elem.text)
+
+    def cache_time(self):
+        """Returns the seconds the response can be cached for"""
+        if self.current_time is None or self.cached_until is None:
+            return 0
+        return self.cached_until - self.current_time
+
+
+def parse_marketstat(source):
+    """
+    Incrementally parses an EVE-Central marketstat response from a file-like object, returning a
+    dict of type ID to (sell min, buy max) for every type in it
+    """
+    prices = {}
+    type_id = None
+    section = None
+    sell = buy = None
+    for event, elem in iterparse(source, events=('start', 'end')):
+        tag = elem.tag
+        if event == 'start':
+            if tag == 'type':
+                type_id = int(elem.get('id'))
+                sell = buy = None
+            elif tag in ('buy', 'sell', 'all'):
+                section = tag
+            continue
+
+        if tag == 'min' and section == 'sell':
+            sell = float(elem.text)
+        elif tag == 'max' and section == 'buy':
+            buy = float(elem.text)
+        elif tag in ('buy', 'sell', 'all'):
+            section = None
+        elif tag == 'type':
+            if sell is not None and buy is not None:
+                prices[type_id] = (sell, buy)
+            type_id = None
+            elem.clear()
+    return prices
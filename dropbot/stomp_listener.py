@@ -1,57 +1,100 @@
+from random import uniform
+from time import sleep
+import threading
 import stomp
 import urlparse
-import json
 import logging
 
+from dropbot.killfeed import KillSource
+
 urlparse.uses_netloc.append('tcp')
 
 
-class ZKillboardStompListener(stomp.listener.ConnectionListener):
+class ZKillboardStompListener(KillSource, stomp.listener.ConnectionListener):
+    """
+    Consumes the zKillboard stomp feed.
+
+    Messages are acked once processed, or when dropped because the queue is full. The connection
+    uses heartbeats and is re-established with exponential backoff when lost.
+    """
+
+    # Initial seconds to wait before reconnecting, doubled on each failed attempt
+    reconnect_initial = 1.0
 
     def __init__(self, bot):
-        self.bot = bot
+        super(ZKillboardStompListener, self).__init__(bot)
         self.conn = None
-        self.ids = [None for x in range(50)]
+        self.disconnected = threading.Event()
+        self.errors = 0
+        self.reconnects = 0
+
+    def on_connected(self, headers, body):
+        logging.info('Connected to {}'.format(self.url))
 
     def on_error(self, headers, message):
-        pass
+        self.errors += 1
+        logging.error('Stomp error: {}'.format(headers.get('message', message)))
 
-    def on_message(self, headers, message):
-        kill = json.loads(message)
-        kill_type = None
+    def on_heartbeat_timeout(self):
+        logging.warning('Stomp heartbeat timed out')
+        self.disconnected.set()
 
-        if kill['killID'] in self.ids:
-            logging.error('Duplicate message')
+    def on_disconnected(self):
+        logging.warning('Disconnected from {}'.format(self.url))
+        self.disconnected.set()
+
+    def receive_context(self):
+        return self.conn
+
+    def ack(self, conn, headers):
+        """Acknowledge a message on the connection it was received from"""
+        if conn is None or 'message-id' not in headers:
             return
+        try:
+            conn.ack(headers['message-id'], headers.get('subscription'))
+        except Exception:
+            logging.exception('Unable to ack message {}'.format(headers['message-id']))
 
-        self.ids.pop(0)
-        self.ids.append(kill['killID'])
+    def _connect(self):
+        url = urlparse.urlparse(self.url)
+        conn = stomp.Connection([(url.hostname, url.port)], heartbeats=(self.bot.stomp_heartbeat, self.bot.stomp_heartbeat),
+                                reconnect_attempts_max=1)
+        conn.set_listener('', self)
+        self.disconnected.clear()
+        self.conn = conn
+        conn.start()
+        conn.connect('guest', 'guest', wait=True)
+        conn.subscribe('/topic/kills', id='dropbot', ack='client-individual')
 
-        # Tag kills
-        for attacker in kill['attackers']:
-            if int(attacker['corporationID']) in self.bot.kill_corps:
-                kill_type = 'KILL'
+    def _run(self):
+        delay = self.reconnect_initial
+        while self.running:
+            try:
+                self._connect()
+            except Exception:
+                logging.exception('Unable to connect to {}'.format(self.url))
+            else:
+                delay = self.reconnect_initial
+                self.disconnected.wait()
+            if not self.running:
                 break
+            self.reconnects += 1
+            logging.info('Reconnecting to {} in {:.1f}s'.format(self.url, delay))
+            sleep(delay * uniform(0.9, 1.1))
+            delay = min(delay * 2, self.bot.stomp_reconnect_max)
 
-        # Tag losses
-        if int(kill['victim']['corporationID']) in self.bot.kill_corps:
-            kill_type = 'LOSS'
-
-        if not kill_type:
-            return
+    def _close(self):
+        if self.conn is not None:
+            try:
+                self.conn.disconnect()
+            except Exception:
+                logging.exception('Error disconnecting from {}'.format(self.url))
+        self.disconnected.set()
 
-        body, html = self.bot.call_command('kill', [], None, no_url=False, raw=kill)
-        if body:
-            text = '[{}] {}'.format(kill_type, body)
-            if not self.bot.kills_muted:
-                for room in self.bot.rooms:
-                    self.bot.send_message(room, text, mtype='groupchat')
-
-    def connect(self, url):
-        self.url = url
-        url = urlparse.urlparse(url)
-        self.conn = stomp.Connection([(url.hostname, url.port)])
-        self.conn.set_listener('', self)
-        self.conn.start()
-        self.conn.connect('guest', 'guest')
-        self.conn.subscribe('/topic/kills', id='dropbot')
+    def stats(self):
+        stats = super(ZKillboardStompListener, self).stats()
+        stats.update({
+            'errors': self.errors,
+            'reconnects': self.reconnects,
+        })
+        return stats
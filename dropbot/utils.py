@@ -1,9 +1,19 @@
+from collections import namedtuple
+from cStringIO import StringIO
 from hashlib import sha1
+from array import array
+import re
+import bz2
 import zlib
 import redis
 import logging
 import math
 
+import eveapi
+
+from dropbot.cache import LRUCache
+from dropbot.parsing import eveapi_timestamp
+
 
 def decimal_minutes_to_hms(minutes):
     """Converts a value of decimal minutes into a hms format"""
@@ -34,36 +44,194 @@ def decimal_minutes_to_hms(minutes):
     return output.strip()
 
 
+class SubstringIndex(object):
+    """
+    A trigram index over a set of names for case insensitive substring searches, results are
+    returned in the order the items were provided
+    """
+
+    gram_size = 3
+
+    def __init__(self, items):
+        self.keys = []
+        self.names = []
+        self.lower_names = []
+        self.exact = {}
+        self.grams = {}
+        for key, name in items:
+            idx = len(self.keys)
+            lower_name = name.lower()
+            self.keys.append(key)
+            self.names.append(name)
+            self.lower_names.append(lower_name)
+            self.exact.setdefault(lower_name, idx)
+            for gram in set(self._grams(lower_name)):
+                if gram not in self.grams:
+                    self.grams[gram] = array('i')
+                self.grams[gram].append(idx)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _grams(self, text):
+        return [text[i:i + self.gram_size] for i in xrange(len(text) - self.gram_size + 1)]
+
+    def get(self, name):
+        """Returns the (key, name) tuple of an exact case insensitive match, or None"""
+        idx = self.exact.get(name.lower())
+        if idx is not None:
+            return self.keys[idx], self.names[idx]
+
+    def search(self, text):
+        """Returns a list of (key, name) tuples with names containing the text"""
+        text = text.lower()
+        if len(text) < self.gram_size:
+            candidates = xrange(len(self.keys))
+        else:
+            postings = [self.grams.get(gram) for gram in set(self._grams(text))]
+            if None in postings:
+                return []
+            # Any match must be in the shortest posting list, verify each candidate from it
+            candidates = min(postings, key=len)
+        return [(self.keys[idx], self.names[idx]) for idx in candidates if text in self.lower_names[idx]]
+
+
+# Compress functions taking (data, level) by name, documents are stored raw with None
+EVEAPI_CACHE_COMPRESSORS = {
+    'zlib': zlib.compress,
+    'bz2': bz2.compress,
+    'none': None,
+}
+
+
 class EVEAPIRedisCache(object):
+    """
+    Caches EVE API documents in Redis until their cachedUntil time, with the most recently used
+    also kept in process. Documents of at least threshold bytes are compressed, the algorithm
+    used is detected when reading so the settings can be changed without flushing the cache.
+    """
 
-    def __init__(self, redis):
+    def __init__(self, redis, compression='zlib', level=1, threshold=1024, l1_size=256):
+        if compression not in EVEAPI_CACHE_COMPRESSORS:
+            raise ValueError('Unknown compression {}, use one of {}'.format(
+                compression, ', '.join(sorted(EVEAPI_CACHE_COMPRESSORS))))
         self.redis = redis
+        self.compress = EVEAPI_CACHE_COMPRESSORS[compression]
+        self.level = level
+        self.threshold = threshold
+        self.local = LRUCache(l1_size) if l1_size else None
 
     @staticmethod
     def gen_key(host, path, params):
-        params = ''.join(['{}={}'.format(x, y) for x, y in params.items()])
-        key_hash = ''.join((host, path, params))
+        params = '&'.join(['{}={}'.format(x, y) for x, y in sorted(params.items())])
+        key_hash = '{}{}?{}'.format(host, path, params)
         return 'eveapi_cache_{}'.format(sha1(key_hash).hexdigest())
 
+    def encode(self, doc):
+        if self.compress is None or len(doc) < self.threshold:
+            return doc
+        return self.compress(doc, self.level)
+
+    @staticmethod
+    def decode(val):
+        if val.startswith('BZh'):
+            return bz2.decompress(val)
+        # zlib streams start with 0x78, XML with < or whitespace
+        if val.startswith('x'):
+            return zlib.decompress(val)
+        return val
+
     def retrieve(self, host, path, params):
         key = self.gen_key(host, path, params)
+        if self.local is not None:
+            doc = self.local.get(key)
+            if doc is not None:
+                return doc
         try:
-            val = self.redis.get(key)
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.get(key)
+            pipe.ttl(key)
+            val, ttl = pipe.execute()
         except redis.RedisError:
             logging.exception('Error retrieving an EVE API call to Redis')
-            val = None
-            pass
-        if val:
-            return zlib.decompress(val)
+            return None
+        if not val:
+            return None
+        doc = self.decode(val)
+        if self.local is not None and ttl > 0:
+            self.local.set(key, doc, ttl)
+        return doc
 
     def store(self, host, path, params, doc, obj):
         key = self.gen_key(host, path, params)
         cache_time = obj.cachedUntil - obj.currentTime
         if cache_time > 0:
-            val = zlib.compress(doc, 9)
+            if self.local is not None:
+                self.local.set(key, doc, cache_time)
             try:
-                self.redis.set(key, val)
-                self.redis.expire(key, cache_time)
+                self.redis.set(key, self.encode(doc), ex=int(cache_time))
             except redis.RedisError:
                 logging.exception('Error storing an EVE API call to Redis')
-                pass
+
+
+_EVEAPICacheTimes = namedtuple('_EVEAPICacheTimes', ['currentTime', 'cachedUntil'])
+_eveapi_time_regex = re.compile(r'<(currentTime|cachedUntil)>([^<]+)</')
+
+
+class EVEAPISessionHandler(object):
+    """
+    An eveapi cache handler that fetches uncached calls itself over a shared requests session,
+    so HTTP connections to the API are pooled and kept alive between calls. Responses are cached
+    in the optional cache handler until their cachedUntil time.
+    """
+
+    def __init__(self, session, scheme='https', cache=None, timeout=None):
+        self.session = session
+        self.scheme = scheme
+        self.cache = cache
+        self.timeout = timeout
+
+    def retrieve(self, host, path, params):
+        if self.cache:
+            doc = self.cache.retrieve(host, path, params)
+            if doc is not None:
+                return doc
+
+        doc = self._request(host, path, params).content
+
+        # eveapi only stores documents it fetched itself, so cache successful responses here
+        if self.cache and '<error' not in doc:
+            times = dict(_eveapi_time_regex.findall(doc))
+            if 'currentTime' in times and 'cachedUntil' in times:
+                self.cache.store(host, path, params, doc, _EVEAPICacheTimes(
+                    eveapi_timestamp(times['currentTime']),
+                    eveapi_timestamp(times['cachedUntil']),
+                ))
+        return doc
+
+    def stream(self, host, path, params):
+        """
+        Requests an API call without caching it, returning a file-like object of the response so large
+        documents can be parsed incrementally
+        """
+        resp = self._request(host, path, params, stream=True)
+        if resp.status_code != 200:
+            return StringIO(resp.content)
+        resp.raw.decode_content = True
+        return resp.raw
+
+    def _request(self, host, path, params, stream=False):
+        url = '{}://{}{}'.format(self.scheme, host, path)
+        if params:
+            resp = self.session.post(url, data=params, timeout=self.timeout, stream=stream)
+        else:
+            resp = self.session.get(url, timeout=self.timeout, stream=stream)
+        if resp.status_code == 404:
+            raise AttributeError("'%s' not available on API server (404 Not Found)" % path)
+        # API errors are returned as an error document with a non 200 status
+        if resp.status_code != 200 and '<error' not in resp.content:
+            raise eveapi.ServerError(resp.status_code, "'%s' request failed (%s)" % (path, resp.reason))
+        return resp
+
+    def store(self, host, path, params, doc, obj):
+        pass
@@ -45,5 +45,8 @@ def main():
     with open('map.json', 'wb') as f:
         f.write(map.to_json())
 
+    with open('map.bin', 'wb') as f:
+        f.write(map.to_binary())
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
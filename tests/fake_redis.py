@@ -0,0 +1,90 @@
+import threading
+from time import time
+
+
+class FakePipeline(object):
+    """Queues commands to run on a FakeRedis in one round trip"""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.queued = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.queued.append((getattr(self.redis, name), args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        self.redis.pipelines += 1
+        queued, self.queued = self.queued, []
+        return [func(*args, **kwargs) for func, args, kwargs in queued]
+
+
+class FakeRedis(object):
+    """
+    A minimal in-memory stand in for the parts of the redis.Redis client used by dropbot,
+    counting the commands issued and pipelines executed
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.expiry = {}
+        self.commands = []
+        self.pipelines = 0
+        self.lock = threading.Lock()
+
+    def _expired(self, key):
+        return key in self.expiry and self.expiry[key] < time()
+
+    def get(self, key):
+        with self.lock:
+            self.commands.append('GET')
+            if self._expired(key):
+                self.data.pop(key, None)
+            return self.data.get(key)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def ttl(self, key):
+        with self.lock:
+            self.commands.append('TTL')
+            if self._expired(key) or key not in self.expiry:
+                return None
+            return int(self.expiry[key] - time())
+
+    def mget(self, keys):
+        with self.lock:
+            self.commands.append('MGET')
+            for key in keys:
+                if self._expired(key):
+                    self.data.pop(key, None)
+            return [self.data.get(x) for x in keys]
+
+    def set(self, key, value, ex=None, nx=False):
+        with self.lock:
+            self.commands.append('SET')
+            if self._expired(key):
+                self.data.pop(key, None)
+            if nx and key in self.data:
+                return None
+            self.data[key] = value
+            if ex:
+                self.expiry[key] = time() + ex
+            else:
+                self.expiry.pop(key, None)
+        return True
+
+    def expire(self, key, time_):
+        with self.lock:
+            self.commands.append('EXPIRE')
+            if key in self.data:
+                self.expiry[key] = time() + time_
+        return True
+
+    def delete(self, key):
+        with self.lock:
+            self.commands.append('DEL')
+            self.expiry.pop(key, None)
+            return self.data.pop(key, None) is not None
@@ -0,0 +1,78 @@
+import threading
+import time
+import urlparse
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+MARKETSTAT_TYPE = """<type id="{type_id}">
+<buy><volume>1</volume><avg>1</avg><max>{buy}</max><min>1</min><stddev>0</stddev><median>1</median><percentile>1</percentile></buy>
+<sell><volume>1</volume><avg>1</avg><max>1</max><min>{sell}</min><stddev>0</stddev><median>1</median><percentile>1</percentile></sell>
+<all><volume>1</volume><avg>1</avg><max>1</max><min>1</min><stddev>0</stddev><median>1</median><percentile>1</percentile></all>
+</type>"""
+
+MARKETSTAT = """<?xml version='1.0' encoding='utf-8'?>
+<evec_api version="2.0" method="marketstat_xml"><marketstat>{types}</marketstat></evec_api>"""
+
+
+def marketstat_response(type_ids, sell=100.0, buy=90.0):
+    """Builds an EVE-Central marketstat XML document for the provided type IDs"""
+    return MARKETSTAT.format(types=''.join(MARKETSTAT_TYPE.format(type_id=x, sell=sell, buy=buy) for x in type_ids))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers.getheader('Content-Length', 0))
+        self.do_GET(urlparse.parse_qs(self.rfile.read(length)))
+
+    def do_GET(self, params=None):
+        server = self.server
+        url = urlparse.urlparse(self.path)
+        params = params or urlparse.parse_qs(url.query)
+        with server.lock:
+            server.requests.append((url.path, params))
+            server.connections.add(self.client_address)
+        delay = server.delays.get(params.get('usesystem', [None])[0], server.delay)
+        if delay:
+            time.sleep(delay)
+        status, body = server.handler(url.path, params)
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubHTTPServer(ThreadingMixIn, HTTPServer):
+    """
+    A local HTTP server for tests, serving responses from a handler function with an optional
+    delay (per usesystem parameter), recording requests and client connections
+    """
+    daemon_threads = True
+
+    def __init__(self, handler=None, delay=0, delays=None):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.handler = handler or (lambda path, params: (200, marketstat_response(params.get('typeid', []))))
+        self.delay = delay
+        self.delays = delays or {}
+        self.requests = []
+        self.connections = set()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/'.format(self.server_address[1])
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
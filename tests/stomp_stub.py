@@ -0,0 +1,135 @@
+import socket
+import threading
+from SocketServer import ThreadingMixIn, TCPServer, BaseRequestHandler
+
+
+def build_frame(command, headers, body=''):
+    lines = [command] + ['{}:{}'.format(k, v) for k, v in headers.items()]
+    return '\n'.join(lines) + '\n\n' + body + '\x00'
+
+
+def parse_frame(data):
+    """Parses a frame without its NULL terminator into (command, headers, body)"""
+    head, _, body = data.partition('\n\n')
+    lines = head.split('\n')
+    headers = dict(x.split(':', 1) for x in lines[1:] if ':' in x)
+    return lines[0], headers, body
+
+
+class StompHandler(BaseRequestHandler):
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.clients.append(self)
+        self.subscription = None
+        buf = ''
+        try:
+            while True:
+                data = self.request.recv(4096)
+                if not data:
+                    break
+                buf += data
+                while '\x00' in buf:
+                    frame, buf = buf.split('\x00', 1)
+                    frame = frame.lstrip('\r\n')
+                    if frame:
+                        self.handle_frame(*parse_frame(frame))
+        except socket.error:
+            pass
+        finally:
+            with server.lock:
+                if self in server.clients:
+                    server.clients.remove(self)
+
+    def send(self, data):
+        with self.server.lock:
+            self.request.sendall(data)
+
+    def handle_frame(self, command, headers, body):
+        server = self.server
+        with server.lock:
+            server.frames.append((command, headers))
+        if command in ('CONNECT', 'STOMP'):
+            with server.lock:
+                server.connects += 1
+            self.send(build_frame('CONNECTED', {'version': '1.1', 'heart-beat': server.heartbeat}))
+        elif command == 'SUBSCRIBE':
+            self.subscription = headers.get('id')
+            with server.lock:
+                pending, server.pending = server.pending, []
+            for message in pending:
+                server.send_message(message, self)
+            server.subscribed.set()
+        elif command == 'ACK':
+            with server.lock:
+                server.acks.append(headers.get('message-id'))
+            server.acked.set()
+        elif command == 'DISCONNECT':
+            if 'receipt' in headers:
+                self.send(build_frame('RECEIPT', {'receipt-id': headers['receipt']}))
+
+
+class StubStompServer(ThreadingMixIn, TCPServer):
+    """
+    A local STOMP 1.1 server for tests, delivering messages to subscribers and recording frames
+    and acks. Messages sent while there are no subscribers are delivered on the next subscribe.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, heartbeat='0,0'):
+        TCPServer.__init__(self, ('127.0.0.1', 0), StompHandler)
+        self.heartbeat = heartbeat
+        self.lock = threading.RLock()
+        self.clients = []
+        self.frames = []
+        self.acks = []
+        self.pending = []
+        self.connects = 0
+        self.message_id = 0
+        self.subscribed = threading.Event()
+        self.acked = threading.Event()
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def url(self):
+        return 'tcp://127.0.0.1:{}'.format(self.server_address[1])
+
+    def send_message(self, body, client=None):
+        """Sends a MESSAGE to a subscribed client"""
+        with self.lock:
+            clients = [client] if client else [x for x in self.clients if x.subscription]
+            if not clients:
+                self.pending.append(body)
+                return
+            self.message_id += 1
+            message_id = self.message_id
+        for client in clients:
+            client.send(build_frame('MESSAGE', {
+                'destination': '/topic/kills',
+                'subscription': client.subscription,
+                'message-id': str(message_id),
+                'content-length': str(len(body)),
+            }, body))
+
+    def drop_connections(self):
+        """Closes the connections of all clients"""
+        self.subscribed.clear()
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            try:
+                client.request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.drop_connections()
+        self.shutdown()
+        self.server_close()
@@ -1,8 +1,15 @@
+import contextlib
 import os
+import json
+import threading
+import urlparse
 import unittest
 import mock
+import eveapi
+from time import time
 from unittest import TestCase
 from dropbot.bot import DropBot
+from tests.http_stub import StubHTTPServer
 
 
 class DropBotTestCase(TestCase):
@@ -15,9 +22,59 @@ class DropBotTestCase(TestCase):
         msg = {'type': 'groupchat'}
         return self.bot.call_command(command, args, msg)
 
+    def fake_message(self, body, type='chat'):
+        """Returns a fake message, with an event set when a reply is sent"""
+        msg = mock.MagicMock()
+        msg.__getitem__.side_effect = {'type': type, 'body': body, 'mucnick': 'test'}.get
+        msg.replied = threading.Event()
+        msg.reply.return_value.send.side_effect = msg.replied.set
+        return msg
+
     def test_simple_bot(self):
         self.assertIsNotNone(self.bot)
 
+    def test_unsupported_kill_source(self):
+        """Check kill monitoring is disabled when the kill source URL isn't supported"""
+        self.assertFalse(self.bot.kills_disabled)
+        for url in ['stomp://eve-kill.net:61613', 'http://example.com/kills', '/tmp/kills.json']:
+            with mock.patch('logging.error') as error:
+                bot = DropBot('test@test.com', 'testpassword', kill_source=url, kill_corps=['1000001'])
+            self.assertTrue(bot.kills_disabled)
+            self.assertIn('file:// or tcp://', error.call_args[0][0])
+            with mock.patch.object(bot, 'get_roster'), mock.patch.object(bot, 'send_presence'):
+                bot.handle_session_start(None)
+            self.assertFalse(hasattr(bot, 'kill_source'))
+            bot.broadcaster.stop()
+
+    def test_handle_message(self):
+        """Check commands run on the executor and reply when complete"""
+        msg = self.fake_message('mapstats')
+        self.bot.handle_message(msg)
+        self.assertTrue(msg.replied.wait(5))
+        self.assertEqual(msg.reply.call_args[0][0], self.call_command('mapstats')[0])
+        self.assertEqual(self.bot.executor.stats()['completed'], 1)
+
+    def test_handle_message_unknown(self):
+        msg = self.fake_message('asdasd')
+        self.bot.handle_message(msg)
+        msg.reply.assert_called_once_with('Unknown command, use "help" to list all commands available')
+
+    def test_handle_message_timeout(self):
+        msg = self.fake_message('!mapstats', type='groupchat')
+        self.bot.executor.timeout = 0.1
+        with mock.patch.object(self.bot, 'cmd_mapstats', side_effect=lambda *args: threading.Event().wait(1)):
+            self.bot.handle_message(msg)
+            self.assertTrue(msg.replied.wait(1))
+        msg.reply.assert_called_once_with('Sorry, mapstats took too long to respond')
+
+    def test_handle_message_command_timeout(self):
+        """Check a command's own timeout is passed to the executor"""
+        with mock.patch.object(self.bot.executor, 'submit', return_value=True) as submit:
+            self.bot.handle_message(self.fake_message('redditimg test'))
+            self.bot.handle_message(self.fake_message('mapstats'))
+        self.assertEqual(submit.call_args_list[0][1]['timeout'], 60)
+        self.assertIsNone(submit.call_args_list[1][1]['timeout'])
+
     def test_system_picker(self):
         self.assertEquals(self.bot._system_picker('Jita'), 30000142)
         self.assertEquals(self.bot._system_picker('Jit'), 30000142)
@@ -31,11 +88,72 @@ class DropBotTestCase(TestCase):
         self.assertIs(self.bot._get_evecentral_price(1,1), None)
         self.assertIs(type(self.bot._get_evecentral_price(22430, 30000142)), tuple)
 
+    def test_get_evecentral_prices_concurrent(self):
+        """Check market hub prices are fetched concurrently over a shared session"""
+        systems = [30000142, 30002187, 30002510, 30002659, 30002053]
+        with StubHTTPServer(delay=0.5) as server:
+            self.bot.evecentral_url = server.url
+            start = time()
+            prices = self.bot._get_evecentral_prices(22430, systems)
+            self.assertLess(time() - start, 0.5 * len(systems))
+        self.assertEqual(len(server.requests), len(systems))
+        self.assertDictEqual(prices, dict((x, (100.0, 90.0)) for x in systems))
+
+    def test_get_evecentral_prices_partial(self):
+        """Check a slow market hub is left out rather than blocking the results"""
+        with StubHTTPServer(delays={'30002187': 2}) as server:
+            self.bot.evecentral_url = server.url
+            self.bot.market_timeout = 0.5
+            prices = self.bot._get_evecentral_prices(22430, [30000142, 30002187])
+        self.assertDictEqual(prices, {30000142: (100.0, 90.0)})
+
+    def test_get_price_table(self):
+        """Check all the types in a system are fetched in one request"""
+        systems = [30000142, 30002187]
+        with StubHTTPServer() as server:
+            self.bot.evecentral_url = server.url
+            table = self.bot.get_price_table([587, '34', 35], systems)
+        self.assertEqual(len(server.requests), len(systems))
+        self.assertEqual(sorted(server.requests[0][1]['typeid']), ['34', '35', '587'])
+        self.assertDictEqual(table, dict((x, dict((y, (100.0, 90.0)) for y in systems)) for x in (587, 34, 35)))
+
+    def test_cmd_prices(self):
+        with StubHTTPServer() as server:
+            self.bot.evecentral_url = server.url
+            res = self.call_command('prices', ['jita', 'rifter,', 'tritanium'])
+        self.assertEqual(len(server.requests), 1)
+        self.assertEqual(res[0], 'Rifter | Sell 100.0 | Buy: 90.0\nTritanium | Sell 100.0 | Buy: 90.0\n'
+                                 'Total @ Jita | Sell 200.0 | Buy: 180.0')
+        self.assertEqual(self.call_command('prices', ['jita'])[0], '!prices <system name> <item>, <item>, ...')
+
+    def test_cmd_bestprice_stub(self):
+        with StubHTTPServer() as server:
+            self.bot.evecentral_url = server.url
+            res = self.call_command('bestprice', ['rifter'])
+        self.assertEqual(res[0], 'Rifter\nBest Sell: Jita @ 100.0 ISK\nBest Buy: Jita @ 90.0 ISK')
+
+    def test_cmd_jita_stub(self):
+        with StubHTTPServer() as server:
+            self.bot.evecentral_url = server.url
+            res = self.call_command('jita', ['rifter'])
+        self.assertEqual(res[0], 'Rifter @ Jita | Sell 100.0 | Buy: 90.0')
+
     def test_cmd_help(self):
         res = self.call_command('help')
         self.assertIsInstance(res, tuple)
         self.assertIsInstance(res[0], basestring)
 
+    def test_cmd_help_command(self):
+        self.assertEqual(self.call_command('help', ['r'])[0], self.call_command('help', ['redditimg'])[0])
+        self.assertIn('Usage: !redditimg <subreddit>', self.call_command('help', ['redditimg'])[0])
+        self.assertEqual(self.call_command('help', ['asdasd'])[0], 'Unknown command')
+
+    def test_commands(self):
+        self.assertIs(self.bot.commands['r'], self.bot.commands['redditimg'])
+        self.assertNotIn('r', self.bot.command_names)
+        self.assertNotIn('prefix', self.bot.commands)
+        self.assertEqual(self.bot.executor.limits['redditimg'], 1)
+
     @unittest.skipIf(os.environ.get('NO_NETWORK', '0') == '1', 'No networking, skipping test')
     def test_cmd_bestprice(self):
         res = self.call_command('bestprice', ['rifter'])
@@ -106,6 +224,13 @@ class DropBotTestCase(TestCase):
         self.assertIsInstance(res, tuple)
         self.assertIsInstance(res[0], basestring)
 
+    def test_cmd_route_preference(self):
+        res = self.call_command('route', ['Jita', 'Dodixie', 'highsec'])
+        self.assertIsInstance(res[0], basestring)
+        self.assertTrue(res[0].startswith('15 jumps from Jita to Dodixie'))
+        res = self.call_command('route', ['Jita', 'Dodixie', 'fastest'])
+        self.assertTrue(res[0].startswith('Unknown routing preference fastest'))
+
     def test_cmd_addjb(self):
         res = self.call_command('addjb', ['Jita', 'Amarr'])
         self.assertIsInstance(res, tuple)
@@ -141,6 +266,89 @@ class DropBotTestCase(TestCase):
     def test_cmd_kill(self):
         pass
 
+    def test_broadcast(self):
+        self.bot.rooms = ['a@conference.test.com', 'b@conference.test.com']
+        self.bot.broadcast('[KILL] Test')
+        self.bot.broadcast('[LOSS] Test')
+        self.assertEqual(self.bot.broadcaster.pending(), 4)
+        with mock.patch.object(self.bot, 'send_message') as send_message:
+            self.bot.broadcaster.clock = lambda: time() + 60
+            self.bot.broadcaster.flush()
+        send_message.assert_any_call('a@conference.test.com', '[KILL] Test\n[LOSS] Test', mtype='groupchat')
+        self.assertEqual(send_message.call_count, 2)
+
+    def test_get_eveapi(self):
+        """Check the EVE API client and its HTTP session are shared"""
+        self.assertIs(self.bot.get_eveapi(), self.bot.get_eveapi())
+        self.assertIs(self.bot.get_eveapi()._handler, self.bot.eveapi_handler)
+        self.assertIs(self.bot.eveapi_handler.session, self.bot.http)
+
+    def test_get_offices(self):
+        """Check offices are streamed from the asset list and only the office list is cached"""
+        assets = """<?xml version='1.0' encoding='UTF-8'?>
+<eveapi version="2"><currentTime>2014-07-01 12:00:00</currentTime><result>
+<rowset name="assets" key="itemID" columns="itemID,locationID,typeID">
+<row itemID="1" locationID="66000002" typeID="27" /><row itemID="2" locationID="60000004" typeID="34" />
+</rowset></result><cachedUntil>2014-07-01 18:00:00</cachedUntil></eveapi>"""
+        self.bot._packaged_stations = {u'60000001': 30000001}
+        self.bot.eve_cache.values['stations'] = {u'60000001': 30000001}
+        with StubHTTPServer(lambda path, params: (200, assets)) as server:
+            with self.stub_eveapi(server) as (url, scheme, cache):
+                self.assertEqual(self.bot._get_offices(1, 'abc'), [30000001])
+                self.assertEqual(self.bot._get_offices(1, 'abc'), [30000001])
+            self.assertEqual(len(server.requests), 1)
+            self.assertFalse(cache.retrieve.called)
+            self.assertFalse(cache.store.called)
+            self.assertEqual(server.requests[0][0], '/corp/AssetList.xml.aspx')
+        self.bot.eve_cache.clear()
+
+    def test_get_offices_server_error(self):
+        """Check failed asset list requests are treated as API errors"""
+        with StubHTTPServer(lambda path, params: (503, 'Service Unavailable')) as server:
+            with self.stub_eveapi(server):
+                self.assertRaises(eveapi.ServerError, self.bot._fetch_offices, 1, 'abc')
+                self.assertEqual(self.bot._get_offices(1, 'abc'), [])
+        self.bot.eve_cache.clear()
+
+    def stub_eveapi(self, server):
+        """Points the EVE API session handler at a stub server, with a mock cache"""
+        return contextlib.nested(
+            mock.patch.object(self.bot, 'eveapi_url', server.url.rstrip('/')),
+            mock.patch.object(self.bot.eveapi_handler, 'scheme', urlparse.urlparse(server.url).scheme),
+            mock.patch.object(self.bot.eveapi_handler, 'cache', mock.Mock()),
+        )
+
+    def test_cmd_kos_stub(self):
+        """Check repeated KOS lookups are answered from the cache"""
+        kos = {'message': 'OK', 'total': 1, 'results': [{'label': 'Test', 'type': 'pilot', 'kos': True}]}
+        with StubHTTPServer(lambda path, params: (200, json.dumps(kos))) as server:
+            self.bot.kos_url = server.url
+            self.assertEqual(self.call_command('kos', ['Test'])[0], 'Test (pilot) - KOS')
+            self.assertEqual(self.call_command('kos', ['test'])[0], 'Test (pilot) - KOS')
+        self.assertEqual(len(server.requests), 1)
+
+        with StubHTTPServer(lambda path, params: (500, '')) as server:
+            self.bot.kos_url = server.url
+            self.assertEqual(self.call_command('kos', ['Other'])[0], 'Something went wrong (Error 500)')
+            self.assertEqual(self.call_command('kos', ['Other'])[0], 'Something went wrong (Error 500)')
+        self.assertEqual(len(server.requests), 1)
+
+    def test_cmd_stats(self):
+        with mock.patch.object(self.bot, '_is_admin', return_value=False):
+            self.assertEqual(self.call_command('stats')[0], 'This command is only available to admins')
+        self.call_command('mapstats')
+        with mock.patch.object(self.bot, '_is_admin', return_value=True):
+            res = self.call_command('stats', ['command'])[0]
+        self.assertTrue(res.startswith('command mapstats: 1 calls, 0.0% errors'))
+        self.assertNotIn('stats', self.bot.command_names)
+
+    def test_command_metrics(self):
+        with mock.patch.object(self.bot, 'cmd_mapstats', side_effect=ValueError):
+            self.call_command('mapstats')
+        histogram = self.bot.metrics.histogram('command', 'mapstats')
+        self.assertEqual(histogram.count, 1)
+        self.assertEqual(histogram.errors, 1)
+
     def test_cmd_mute(self):
         self.assertEqual(self.bot.kills_muted, False)
         res = self.call_command('mute')
@@ -0,0 +1,81 @@
+import threading
+from unittest import TestCase
+from dropbot.broadcast import BroadcastScheduler
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class BroadcastSchedulerTest(TestCase):
+    """
+    Tests the BroadcastScheduler class
+    """
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.sent = []
+        self.scheduler = BroadcastScheduler(self.send, window=2, min_interval=5, max_lines=3, max_backlog=5,
+                                            clock=self.clock)
+
+    def send(self, room, body):
+        self.sent.append((room, body))
+
+    def test_window(self):
+        """Check lines queued within the window are sent as one message"""
+        self.scheduler.queue('a', '1')
+        self.clock.now += 1
+        self.scheduler.queue('a', '2')
+        self.assertEqual(self.scheduler.flush(), 1)
+        self.assertEqual(self.sent, [])
+        self.clock.now += 1
+        self.assertIsNone(self.scheduler.flush())
+        self.assertEqual(self.sent, [('a', '1\n2')])
+
+    def test_rooms(self):
+        self.scheduler.queue('a', '1')
+        self.scheduler.queue('b', '1')
+        self.clock.now += 2
+        self.scheduler.flush()
+        self.assertItemsEqual(self.sent, [('a', '1'), ('b', '1')])
+
+    def test_rate_limit(self):
+        """Check messages to a room are spaced by the minimum interval"""
+        for x in range(5):
+            self.scheduler.queue('a', str(x))
+        self.clock.now += 2
+        self.assertEqual(self.scheduler.flush(), 5)
+        self.assertEqual(self.sent, [('a', '0\n1\n2')])
+        self.scheduler.queue('a', '5')
+        self.clock.now += 4
+        self.scheduler.flush()
+        self.assertEqual(len(self.sent), 1)
+        self.clock.now += 1
+        self.scheduler.flush()
+        self.assertEqual(self.sent[1], ('a', '3\n4\n5'))
+
+    def test_backlog(self):
+        """Check the oldest lines are dropped and summarised when the backlog is full"""
+        for x in range(8):
+            self.scheduler.queue('a', str(x))
+        self.assertEqual(self.scheduler.pending(), 5)
+        self.clock.now += 2
+        self.scheduler.flush()
+        self.assertEqual(self.sent, [('a', '3\n4\n5\n... and 3 more not shown')])
+        self.assertEqual(self.scheduler.dropped, 3)
+
+    def test_thread(self):
+        sent = threading.Event()
+        scheduler = BroadcastScheduler(lambda room, body: sent.set(), window=0.05, min_interval=0.05)
+        scheduler.start()
+        try:
+            scheduler.queue('a', '1')
+            self.assertTrue(sent.wait(1))
+        finally:
+            scheduler.stop()
+        self.assertEqual(scheduler.sent, 1)
@@ -0,0 +1,300 @@
+import threading
+import time
+from unittest import TestCase
+from dropbot.cache import LRUCache, SingleFlight, PriceCache, RecentSet, SharedRecentSet, RefreshingCache, \
+    TieredCache, CachePolicy, FetchError
+from tests.fake_redis import FakeRedis
+
+
+class LRUCacheTest(TestCase):
+    """
+    Tests the LRUCache class
+    """
+
+    def test_get_set(self):
+        cache = LRUCache()
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('a', 1), 1)
+        cache.set('a', 2)
+        self.assertEqual(cache.get('a'), 2)
+        cache.delete('a')
+        self.assertIsNone(cache.get('a'))
+
+    def test_eviction(self):
+        """Check the least recently used key is evicted first"""
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_expiry(self):
+        cache = LRUCache(ttl=0.05)
+        cache.set('a', 1)
+        cache.set('b', 2, ttl=10)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), 2)
+
+
+class SingleFlightTest(TestCase):
+    """
+    Tests the SingleFlight class
+    """
+
+    def test_coalesce(self):
+        """Check concurrent calls for the same key share a single call"""
+        flight = SingleFlight()
+        calls = []
+
+        def slow(value):
+            calls.append(value)
+            time.sleep(0.2)
+            return value
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('key', slow, 1))) for x in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertListEqual(calls, [1])
+        self.assertListEqual(results, [1] * 5)
+        self.assertEqual(flight.coalesced, 4)
+        self.assertEqual(flight.do('key', slow, 2), 2)
+
+    def test_error(self):
+        flight = SingleFlight()
+
+        def error():
+            raise ValueError('error')
+
+        self.assertRaises(ValueError, flight.do, 'key', error)
+        self.assertDictEqual(flight.calls, {})
+
+
+class PriceCacheTest(TestCase):
+    """
+    Tests the PriceCache class
+    """
+
+    def setUp(self):
+        self.calls = []
+
+    def fetch(self, type_id, system_id):
+        self.calls.append((type_id, system_id))
+        if type_id == 1:
+            return None
+        return (100.0, 90.0)
+
+    def check_cache(self, cache):
+        self.assertEqual(cache.get(587, 30000142, self.fetch), (100.0, 90.0))
+        self.assertEqual(cache.get(587, 30000142, self.fetch), (100.0, 90.0))
+        self.assertEqual(cache.get(587, 30002187, self.fetch), (100.0, 90.0))
+        self.assertListEqual(self.calls, [(587, 30000142), (587, 30002187)])
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 2, 'coalesced': 0})
+
+    def test_local(self):
+        self.check_cache(PriceCache())
+
+    def test_redis(self):
+        redis = FakeRedis()
+        cache = PriceCache(redis, ttl=60)
+        self.check_cache(cache)
+        self.assertIn(cache.gen_key(587, 30000142), redis.data)
+        self.assertEqual(len(cache.local), 0)
+
+    def fetch_many(self, type_ids, system_id):
+        self.calls.append((tuple(type_ids), system_id))
+        return dict((x, (100.0, 90.0)) for x in type_ids if x != 1)
+
+    def check_get_many(self, cache):
+        cache.get(587, 30000142, self.fetch)
+        self.assertEqual(cache.get_many([587, 588, 1], 30000142, self.fetch_many), {587: (100.0, 90.0), 588: (100.0, 90.0)})
+        self.assertEqual(cache.get_many([587, 588], 30000142, self.fetch_many), {587: (100.0, 90.0), 588: (100.0, 90.0)})
+        self.assertListEqual(self.calls, [(587, 30000142), ((588, 1), 30000142)])
+
+    def test_get_many_local(self):
+        """Check only the uncached types are fetched, in one call"""
+        self.check_get_many(PriceCache())
+
+    def test_get_many_redis(self):
+        redis = FakeRedis()
+        self.check_get_many(PriceCache(redis, ttl=60))
+        self.assertEqual(redis.commands.count('MGET'), 2)
+
+    def test_errors_not_cached(self):
+        cache = PriceCache()
+        self.assertIsNone(cache.get(1, 30000142, self.fetch))
+        self.assertIsNone(cache.get(1, 30000142, self.fetch))
+        self.assertEqual(len(self.calls), 2)
+
+    def test_expiry(self):
+        cache = PriceCache(ttl=0.05)
+        cache.get(587, 30000142, self.fetch)
+        time.sleep(0.1)
+        cache.get(587, 30000142, self.fetch)
+        self.assertEqual(len(self.calls), 2)
+
+
+class RecentSetTest(TestCase):
+    """
+    Tests the RecentSet and SharedRecentSet classes
+    """
+
+    def test_add(self):
+        seen = RecentSet(max_size=2)
+        self.assertTrue(seen.add(1))
+        self.assertFalse(seen.add(1))
+        self.assertTrue(seen.add(2))
+        self.assertTrue(seen.add(3))
+        self.assertEqual(len(seen), 2)
+        self.assertNotIn(1, seen)
+        self.assertIn(3, seen)
+        self.assertTrue(seen.add(1))
+
+    def test_shared(self):
+        redis = FakeRedis()
+        first = SharedRecentSet(redis, ttl=60)
+        second = SharedRecentSet(redis, ttl=60)
+        self.assertTrue(first.add(1))
+        self.assertFalse(second.add(1))
+        self.assertTrue(second.add(2))
+        self.assertIn(first.gen_key(1), redis.expiry)
+
+    def test_shared_expiry(self):
+        seen = SharedRecentSet(FakeRedis(), ttl=0.05)
+        self.assertTrue(seen.add(1))
+        time.sleep(0.1)
+        self.assertTrue(seen.add(1))
+
+
+class RefreshingCacheTest(TestCase):
+    """
+    Tests the RefreshingCache class
+    """
+
+    def setUp(self):
+        self.cache = RefreshingCache(min_ttl=0, retry=0.05)
+        self.calls = []
+        self.refreshed = threading.Event()
+
+    def tearDown(self):
+        self.cache.clear()
+
+    def fetch(self, value, ttl=60, fail=False):
+        self.calls.append(value)
+        if len(self.calls) > 1:
+            self.refreshed.set()
+            if fail and len(self.calls) == 2:
+                raise RuntimeError('fetch failed')
+        return '{}{}'.format(value, len(self.calls)), ttl
+
+    def test_cached(self):
+        self.assertEqual(self.cache.get('a', self.fetch, 'a'), 'a1')
+        self.assertEqual(self.cache.get('a', self.fetch, 'a'), 'a1')
+        self.assertEqual(self.calls, ['a'])
+
+    def test_refresh(self):
+        """Check values are refetched in the background when their ttl runs out"""
+        self.assertEqual(self.cache.get('a', self.fetch, 'a', 0.05), 'a1')
+        self.assertTrue(self.refreshed.wait(5))
+        time.sleep(0.05)
+        self.assertNotEqual(self.cache.get('a', self.fetch, 'a', 0.05), 'a1')
+        self.assertGreaterEqual(self.cache.refreshes, 1)
+
+    def test_refresh_error(self):
+        """Check the old value is kept if a refresh fails"""
+        self.assertEqual(self.cache.get('a', self.fetch, 'a', 0.05, True), 'a1')
+        self.assertTrue(self.refreshed.wait(5))
+        self.assertEqual(self.cache.get('a', self.fetch, 'a', 0.05, True), 'a1')
+        for x in range(100):
+            if len(self.calls) > 2:
+                break
+            time.sleep(0.01)
+        self.assertGreater(len(self.calls), 2)
+
+    def test_delete(self):
+        self.cache.get('a', self.fetch, 'a')
+        self.cache.delete('a')
+        self.assertEqual(self.cache.get('a', self.fetch, 'a'), 'a2')
+
+
+class TieredCacheTest(TestCase):
+    """
+    Tests the TieredCache class
+    """
+
+    def setUp(self):
+        self.calls = []
+        self.refreshed = threading.Event()
+        self.cache = TieredCache(policies={
+            'fresh': CachePolicy(60, 60, 60),
+            'stale': CachePolicy(0.05, 60, 60),
+            'expired': CachePolicy(0.05, 0, 0),
+        })
+
+    def fetch(self, value):
+        self.calls.append(value)
+        if value == 'error':
+            raise FetchError('Not found')
+        if value == 'broken':
+            raise ValueError('Unexpected')
+        if len(self.calls) > 1:
+            self.refreshed.set()
+        return '{}{}'.format(value, len(self.calls))
+
+    def test_fresh(self):
+        self.assertEqual(self.cache.get('fresh', 'a', self.fetch, 'a'), 'a1')
+        self.assertEqual(self.cache.get('fresh', 'a', self.fetch, 'a'), 'a1')
+        self.assertEqual(self.calls, ['a'])
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'stale': 0, 'misses': 1, 'errors': 0})
+
+    def test_stale(self):
+        """Check stale values are returned immediately and refreshed in the background"""
+        self.assertEqual(self.cache.get('stale', 'a', self.fetch, 'a'), 'a1')
+        time.sleep(0.1)
+        self.assertEqual(self.cache.get('stale', 'a', self.fetch, 'a'), 'a1')
+        self.assertTrue(self.refreshed.wait(5))
+        for x in range(100):
+            if self.cache.get('stale', 'a', self.fetch, 'a') == 'a2':
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.cache.get('stale', 'a', self.fetch, 'a'), 'a2')
+        self.assertEqual(self.cache.stats()['stale'], 1)
+
+    def test_expired(self):
+        self.cache.get('expired', 'a', self.fetch, 'a')
+        time.sleep(0.1)
+        self.assertEqual(self.cache.get('expired', 'a', self.fetch, 'a'), 'a2')
+
+    def test_errors(self):
+        """Check failed fetches are cached for the error ttl"""
+        for x in range(2):
+            with self.assertRaises(FetchError) as cm:
+                self.cache.get('fresh', 'error', self.fetch, 'error')
+            self.assertEqual(cm.exception.message, 'Not found')
+        with self.assertRaises(FetchError) as cm:
+            self.cache.get('fresh', 'broken', self.fetch, 'broken')
+        self.assertEqual(cm.exception.message, '')
+        self.assertRaises(FetchError, self.cache.get, 'fresh', 'broken', self.fetch, 'broken')
+        self.assertEqual(self.calls, ['error', 'broken'])
+        self.assertEqual(self.cache.stats()['errors'], 2)
+
+        self.assertRaises(FetchError, self.cache.get, 'expired', 'error', self.fetch, 'error')
+        self.assertRaises(FetchError, self.cache.get, 'expired', 'error', self.fetch, 'error')
+        self.assertEqual(self.calls.count('error'), 3)
+
+    def test_redis(self):
+        """Check values are shared through Redis"""
+        redis = FakeRedis()
+        self.cache = TieredCache(redis, self.cache.policies)
+        self.assertEqual(self.cache.get('fresh', ['a', 1], self.fetch, 'a'), 'a1')
+        other = TieredCache(redis, self.cache.policies)
+        self.assertEqual(other.get('fresh', ['a', 1], self.fetch, 'a'), 'a1')
+        self.assertEqual(self.calls, ['a'])
+        self.assertAlmostEqual(redis.expiry.values()[0] - time.time(), 120, delta=5)
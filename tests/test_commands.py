@@ -0,0 +1,60 @@
+from unittest import TestCase
+from dropbot.commands import CommandRegistry, command, COST_LOCAL, COST_NETWORK
+
+
+class Bot(object):
+    __metaclass__ = CommandRegistry
+
+    cmd_prefix = '!'
+
+    def cmd_plain(self, args, msg):
+        """A command without metadata"""
+        return 'plain'
+
+    @command(aliases=['n'], args='<name>', cost=COST_NETWORK)
+    def cmd_network(self, args, msg):
+        """A network command"""
+        return 'network'
+
+    @command(hidden=True, timeout=5)
+    def cmd_secret(self, args, msg):
+        return 'secret'
+
+
+class SubBot(Bot):
+
+    def cmd_extra(self, args, msg):
+        return 'extra'
+
+
+class CommandRegistryTest(TestCase):
+    """
+    Tests the CommandRegistry metaclass and command decorator
+    """
+
+    def test_registry(self):
+        self.assertItemsEqual(Bot.commands.keys(), ['plain', 'network', 'n', 'secret'])
+        self.assertEqual(Bot.command_names, ['network', 'plain'])
+
+    def test_metadata(self):
+        cmd = Bot.commands['plain']
+        self.assertEqual(cmd.attr, 'cmd_plain')
+        self.assertEqual(cmd.cost, COST_LOCAL)
+        self.assertEqual(cmd.doc, 'A command without metadata')
+        cmd = Bot.commands['network']
+        self.assertEqual(cmd.aliases, ('n',))
+        self.assertEqual(cmd.args, '<name>')
+        self.assertEqual(cmd.cost, COST_NETWORK)
+        self.assertTrue(Bot.commands['secret'].hidden)
+        self.assertEqual(Bot.commands['secret'].timeout, 5)
+        self.assertIsNone(cmd.timeout)
+
+    def test_alias(self):
+        self.assertIs(Bot.commands['n'], Bot.commands['network'])
+        bot = Bot()
+        self.assertEqual(getattr(bot, Bot.commands['n'].attr)([], None), 'network')
+
+    def test_subclass(self):
+        self.assertIn('extra', SubBot.commands)
+        self.assertIn('network', SubBot.commands)
+        self.assertNotIn('extra', Bot.commands)
@@ -0,0 +1,94 @@
+import threading
+import time
+from unittest import TestCase
+from dropbot.executor import CommandExecutor
+
+
+class CommandExecutorTest(TestCase):
+    """
+    Tests the CommandExecutor class
+    """
+
+    def setUp(self):
+        self.executor = CommandExecutor(workers=2, max_queue=4, timeout=5)
+        self.results = []
+        self.done = threading.Event()
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def callback(self, result):
+        self.results.append(result)
+        self.done.set()
+
+    def test_submit(self):
+        self.assertTrue(self.executor.submit('add', lambda x, y: x + y, (1, 2), callback=self.callback))
+        self.assertTrue(self.done.wait(2))
+        self.assertEqual(self.results, [3])
+        stats = self.executor.stats()
+        self.assertEqual(stats['submitted'], 1)
+        self.assertEqual(stats['completed'], 1)
+        self.assertEqual(stats['in_flight'], 0)
+
+    def test_non_blocking(self):
+        """Check a slow command doesn't hold up the caller or other commands"""
+        release = threading.Event()
+        start = time.time()
+        self.executor.submit('slow', release.wait, (2,))
+        self.executor.submit('fast', lambda: 'fast', callback=self.callback)
+        self.assertLess(time.time() - start, 0.5)
+        self.assertTrue(self.done.wait(1))
+        self.assertEqual(self.results, ['fast'])
+        release.set()
+
+    def test_limits(self):
+        release = threading.Event()
+        self.executor.limits = {'slow': 1}
+        self.assertTrue(self.executor.submit('slow', release.wait, (2,)))
+        self.assertFalse(self.executor.submit('slow', release.wait, (2,)))
+        self.assertEqual(self.executor.stats()['rejected'], 1)
+        release.set()
+
+    def test_queue_full(self):
+        release = threading.Event()
+        results = [self.executor.submit('slow', release.wait, (2,)) for x in range(8)]
+        self.assertFalse(all(results))
+        self.assertGreater(self.executor.stats()['queue_depth'], 0)
+        release.set()
+
+    def test_timeout(self):
+        release = threading.Event()
+        timed_out = threading.Event()
+        self.executor.submit('slow', lambda: release.wait(2) and 'late', callback=self.callback,
+                             timeout_callback=timed_out.set, timeout=0.1)
+        self.assertTrue(timed_out.wait(1))
+        release.set()
+        time.sleep(0.1)
+        self.assertEqual(self.results, [])
+        self.assertEqual(self.executor.stats()['timed_out'], 1)
+
+    def test_single_sweeper(self):
+        """Check timeouts don't start a thread per command"""
+        threads = threading.active_count()
+        for x in range(4):
+            self.executor.submit('fast', lambda: 'fast', timeout=10)
+        self.assertLessEqual(threading.active_count(), threads)
+
+    def test_timeout_order(self):
+        """Check a short timeout fires before an earlier, longer one"""
+        release = threading.Event()
+        timed_out = []
+        self.executor.submit('long', release.wait, (2,), timeout_callback=lambda: timed_out.append('long'), timeout=1)
+        self.executor.submit('short', release.wait, (2,), timeout_callback=lambda: timed_out.append('short'),
+                             timeout=0.1)
+        time.sleep(0.3)
+        self.assertEqual(timed_out, ['short'])
+        release.set()
+
+    def test_error(self):
+        self.executor.submit('error', lambda: 1 / 0, callback=self.callback)
+        self.executor.submit('ok', lambda: 'ok', callback=self.callback)
+        self.assertTrue(self.done.wait(1))
+        time.sleep(0.1)
+        self.assertEqual(self.results, ['ok'])
+        self.assertEqual(self.executor.stats()['errors'], 1)
@@ -0,0 +1,63 @@
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from unittest import TestCase
+from dropbot.killfeed import KillSource, ReplayKillSource
+from tests.test_stomp_listener import fake_bot, killmail
+
+
+class ReplayKillSourceTest(TestCase):
+    """
+    Tests the ReplayKillSource class
+    """
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.jsonl')
+        start = datetime.utcnow() - timedelta(days=1)
+        with os.fdopen(fd, 'w') as f:
+            for kill_id in range(10):
+                kill = json.loads(killmail(kill_id))
+                kill['killTime'] = (start + timedelta(seconds=kill_id)).strftime('%Y-%m-%d %H:%M:%S')
+                f.write(json.dumps(kill) + '\n')
+            f.write('\n')
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def replay(self, speed):
+        bot = fake_bot(kill_replay_speed=speed)
+        source = ReplayKillSource(bot)
+        source.connect('file://' + self.path)
+        self.assertTrue(source.wait(10))
+        source.stop()
+        return bot, source
+
+    def test_replay(self):
+        """Check a file is replayed flat out, with the kill times moved to now so they aren't filtered"""
+        bot, source = self.replay(0)
+        self.assertEqual(bot.broadcast.call_count, 10)
+        stats = source.stats()
+        self.assertEqual(stats['read'], 10)
+        self.assertEqual(stats['processed'], 10)
+        self.assertEqual(stats['dropped'], 0)
+        self.assertGreater(stats['rate'], 0)
+
+    def test_speed(self):
+        """Check the gaps between kills are scaled by the speed multiplier"""
+        start = time.time()
+        bot, source = self.replay(50)
+        self.assertGreaterEqual(time.time() - start, 9 / 50.0)
+        self.assertEqual(bot.broadcast.call_count, 10)
+
+    def test_path_from_url(self):
+        self.assertEqual(ReplayKillSource.path_from_url('file:///tmp/kills.jsonl'), '/tmp/kills.jsonl')
+        self.assertEqual(ReplayKillSource.path_from_url('file://kills.jsonl'), 'kills.jsonl')
+        self.assertEqual(ReplayKillSource.path_from_url('/tmp/kills.jsonl'), '/tmp/kills.jsonl')
+
+
+class KillSourceTest(TestCase):
+
+    def test_run(self):
+        self.assertRaises(NotImplementedError, KillSource(fake_bot())._run)
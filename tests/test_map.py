@@ -1,5 +1,7 @@
 from unittest import TestCase
-from dropbot.map import Map, ship_class_to_range
+import mock
+from array import array
+from dropbot.map import Map, SpatialIndex, ship_class_to_range, calc_distance, EVE_LY
 import pkgutil
 
 class MapTestCase(TestCase):
@@ -12,6 +14,23 @@ class MapTestCase(TestCase):
         m = Map.from_json(pkgutil.get_data('dropbot', 'data/map.json'))
         self.assertIsNotNone(m)
 
+    def test_binary_round_trip(self):
+        """Check the map survives a round trip through the binary format"""
+        m = Map.from_binary(self.map.to_binary())
+        self.assertEqual(m.number_of_nodes(), self.map.number_of_nodes())
+        self.assertSetEqual(set(frozenset(x) for x in m.edges()), set(frozenset(x) for x in self.map.edges()))
+        self.assertEqual(m.map_hash(), self.map.map_hash())
+        self.assertEqual(m.node[30000142]['name'], 'Jita')
+        self.assertEqual(m.node[30000142]['region'], 'The Forge')
+        self.assertEqual(m.route_gate(30001161, 30001198), self.map.route_gate(30001161, 30001198))
+        self.assertRaises(ValueError, Map.from_binary, 'garbage')
+
+    def test_load_from_binary_package_data(self):
+        """Check the packaged binary map matches the packaged JSON map"""
+        m = Map.from_binary(pkgutil.get_data('dropbot', 'data/map.bin'))
+        self.assertEqual(m.map_hash(), self.map.map_hash())
+        self.assertEqual(m.number_of_edges(), self.map.number_of_edges())
+
     def test_get_system_name(self):
         """Test looking up system names from IDs"""
         self.assertEquals(self.map.get_system_name(123), None)
@@ -32,6 +51,15 @@ class MapTestCase(TestCase):
         self.assertEquals(len(self.map.get_systems('JITA')), 1)
         self.assertEquals(len(self.map.get_systems('JiTa')), 1)
 
+    def test_get_systems_node_changes(self):
+        """Check system name lookups follow node additions and removals"""
+        self.map.add_node(1, system_id=1, name='Jitb', region='Test', security=-1.0, coords=(0, 0, 0))
+        self.assertEqual(self.map.get_system_id('JITB'), 1)
+        self.assertEquals(len(self.map.get_systems('Jit')), 2)
+        self.map.remove_node(1)
+        self.assertEqual(self.map.get_system_id('Jitb'), None)
+        self.assertListEqual(self.map.get_systems('Jit'), [30000142])
+
     def test_system_distance(self):
         """Test the distance calculator"""
         self.assertEqual(self.map.system_distance(30000142, 30000144), 2.10268108033618)
@@ -39,17 +67,130 @@ class MapTestCase(TestCase):
         self.assertEqual(self.map.system_distance(30000142, 30000536), 39.15289747780095)
         self.assertRaises(Exception, self.map.system_distance, (1, 2))
 
+    def check_batched_distances(self):
+        source_id = self.map.get_system_id('U-HVIX')
+        route = [source_id, 30000019, 30000142, 30002187, 30001161]
+        self.map.reindex()
+        distances = self.map.distances_from(source_id)
+        self.assertEqual(len(distances), self.map.number_of_nodes())
+        for system_id in route:
+            self.assertEqual(distances[system_id], self.map.system_distance(source_id, system_id))
+        pairs = self.map.distances_between(array('i', route[:-1]), array('i', route[1:]))
+        self.assertListEqual(list(pairs), [self.map.system_distance(x, y) for x, y in zip(route[:-1], route[1:])])
+        self.assertListEqual(self.map.route_leg_distances(route),
+                             [self.map.system_distance(x, y) for x, y in zip(route[:-1], route[1:])])
+        self.assertListEqual(sorted(self.map.systems_in_range(self.map.node[source_id]['coords'], 5)),
+                             sorted(self.map.spatial_index.query(self.map.node[source_id]['coords'], 5)))
+
+    def test_batched_distances(self):
+        """Check the batched distance calculations match system_distance"""
+        self.check_batched_distances()
+
+    def test_batched_distances_no_numpy(self):
+        """Check the batched distance calculations fall back to pure Python without NumPy"""
+        with mock.patch('dropbot.map.numpy', None):
+            self.assertIsNone(self.map.coordinate_matrix)
+            self.check_batched_distances()
+
+    def test_route_jump_distance(self):
+        """Test route distances, stopping at the first repeated system"""
+        sys1 = self.map.get_system_id('U-HVIX')
+        sys2 = self.map.get_system_id('RMOC-W')
+        sys3 = self.map.get_system_id('Podion')
+        distance = self.map.system_distance(sys1, sys2) + self.map.system_distance(sys2, sys3)
+        self.assertEqual(self.map.route_jump_distance([sys1, sys2, sys3]), distance)
+        self.assertEqual(self.map.route_jump_distance([sys1, sys2, sys3, sys3, sys1]), distance)
+        self.assertEqual(self.map.route_jump_distance([sys1]), 0.0)
+
     def test_route_gate(self):
         """Test the gate routing system"""
         r = self.map.route_gate(30001161, 30001198)
         self.assertEqual(len(r), 9)
         self.assertListEqual(r, [30001161, 30001158, 30001160, 30001154, 30001157, 30001155, 30001156, 30001162, 30001198])
 
-    def test_route_jump(self):
-        pass
+    def test_route_gate_preferences(self):
+        """Test the highsec and avoid lowsec routing preferences"""
+        jita = self.map.get_system_id('Jita')
+        dodixie = self.map.get_system_id('Dodixie')
+        r = self.map.route_gate(jita, dodixie)
+        self.assertEqual(len(r), 13)
+        self.assertLess(min(self.map.node[x]['security'] for x in r), 0.45)
+        for preference in ['highsec', 'avoid-lowsec']:
+            r = self.map.route_gate(jita, dodixie, preference=preference)
+            self.assertEqual(len(r), 16)
+            self.assertEqual(r[0], jita)
+            self.assertEqual(r[-1], dodixie)
+            self.assertGreaterEqual(min(self.map.node[x]['security'] for x in r), 0.45)
+        self.assertRaises(ValueError, self.map.route_gate, jita, dodixie, preference='fastest')
+
+    def test_route_gate_ignores_jumps(self):
+        """Check jump edges aren't used for gate routing"""
+        self.map.add_edge(30001161, 30001198, weight=1, link_type='jump')
+        self.assertEqual(len(self.map.route_gate(30001161, 30001198)), 9)
+        self.assertListEqual(self.map.route_gate(30001161, 30001161), [30001161])
+
+    def test_route_gate_no_route(self):
+        """Check an empty route is returned for unconnected systems"""
+        self.assertListEqual(self.map.route_gate(30000142, 31000005), [])
+
+    def test_route_gate_avoid_lowsec(self):
+        """Check avoiding lowsec keeps routes in highsec, apart from the endpoints"""
+        jita = self.map.get_system_id('Jita')
+        lowsec = lambda x: self.map.node[x]['security'] < 0.45
+
+        # The shortest route crosses the nullsec border gates, avoiding lowsec stays in highsec
+        source, destination = self.map.get_system_id('Uhodoh'), self.map.get_system_id('Naeel')
+        self.assertTrue([x for x in self.map.route_gate(source, destination) if lowsec(x)])
+        route = self.map.route_gate(source, destination, preference='avoid-lowsec')
+        self.assertEqual(len(route), 16)
+        self.assertFalse([x for x in route if lowsec(x)])
+
+        route = self.map.route_gate(jita, self.map.get_system_id('Tama'), preference='avoid-lowsec')
+        self.assertEqual(len(route), 5)
+        self.assertListEqual([x for x in route if lowsec(x)], route[-1:])
+
+        self.assertEqual(len(self.map.route_gate(jita, 30000721)), 35)
+        self.assertListEqual(self.map.route_gate(jita, 30000721, preference='avoid-lowsec'), [])
+
+    def test_nearest_of(self):
+        """Test finding the nearest of a set of systems"""
+        jita = self.map.get_system_id('Jita')
+        targets = [self.map.get_system_id(x) for x in ['Amarr', 'Dodixie', 'Perimeter', 'Rens']]
+        target, route = self.map.nearest_of(jita, targets)
+        self.assertEqual(target, self.map.get_system_id('Perimeter'))
+        self.assertListEqual(route, [jita, target])
+        target, route = self.map.nearest_of(jita, targets[:2])
+        self.assertEqual(target, targets[0])
+        self.assertEqual(len(route), len(self.map.route_gate(jita, targets[0])))
+        self.assertEqual(self.map.nearest_of(jita, [jita]), (jita, [jita]))
+        self.assertEqual(self.map.nearest_of(jita, [31000005]), (None, []))
+
+    def test_nearest_of_link_types(self):
+        """Check nearest_of only follows the requested link types"""
+        self.map.add_jumpbridge(30001161, 30001198)
+        self.assertEqual(len(self.map.nearest_of(30001161, [30001198])[1]), 2)
+        self.assertEqual(len(self.map.nearest_of(30001161, [30001198], link_types=['gate'])[1]), 9)
 
-    def test_route_jump_distance(self):
-        pass
+    def test_route_jump(self):
+        """Check jump routes for a fixed set of capital routes"""
+        routes = [
+            ('U-HVIX', 'Podion', 'blackops', [30000575, 30001028, 30000019]),
+            ('U-HVIX', 'Podion', 'jumpfreighter', [30000575, 30001044, 30000019]),
+            ('1DQ1-A', 'VFK-IV', 'jumpfreighter', [30004759, 30004743, 30004307, 30004629, 30003342, 30004045, 30002036, 30002904]),
+            ('HED-GP', 'Amamake', 'blackops', [30001161, 30003751, 30003732, 30003063, 30002537]),
+            ('HED-GP', 'Amamake', 'carrier', [30001161, 30003709, 30003751, 30003750, 30003734, 30003499, 30002975, 30003067, 30002537]),
+            ('6VDT-H', 'Y-2ANO', 'carrier', [30004608, 30004610, 30004637, 30004665]),
+            ('Tama', 'EC-P8R', 'carrier', [30002813, 30045337, 30045315, 30001984]),
+            ('VFK-IV', 'Rancer', 'blackops', [30002904, 30002008, 30001437, 30002760, 30002718]),
+            ('J5A-IX', 'MJXW-P', 'jumpfreighter', [30004589, 30004593, 30004308, 30004743]),
+        ]
+        for source, destination, ship_class, expected in routes:
+            r = self.map.route_jump(self.map.get_system_id(source), self.map.get_system_id(destination), ship_class=ship_class)
+            self.assertListEqual(r, expected)
+
+    def test_route_jump_no_route(self):
+        """Check an empty route is returned when the destination can't be reached"""
+        self.assertListEqual(self.map.route_jump(30000575, 30000142, ship_class='blackops'), [])
 
     def test_route_jump_isotopes(self):
         pass
@@ -115,7 +256,87 @@ class MapTestCase(TestCase):
         pass
 
     def test_neighbors_jump(self):
-        pass
+        """Check the indexed jump neighbours match a full scan of the map"""
+        source_id = self.map.get_system_id('U-HVIX')
+        source = self.map.node[source_id]['coords']
+        expected = sorted(k for k, v in self.map.nodes_iter(data=True)
+                          if k != source_id and v['security'] < 0.45 and calc_distance(source, v['coords']) <= 8)
+        res = self.map.neighbors_jump(source_id, 8)
+        self.assertListEqual(sorted(x['system_id'] for x, y in res), expected)
+        for data, distance in res:
+            self.assertEqual(distance, self.map.system_distance(source_id, data['system_id']))
+
+    def test_neighbors_jump_ship_class(self):
+        """Check a ship class can be used in place of a range"""
+        source_id = self.map.get_system_id('U-HVIX')
+        self.assertEqual(len(self.map.neighbors_jump(source_id, ship_class='blackops')),
+                         len(self.map.neighbors_jump(source_id, 8)))
+        self.assertRaises(ValueError, self.map.neighbors_jump, source_id)
+
+    def test_spatial_index_node_changes(self):
+        """Check the spatial index follows node additions and removals"""
+        source_id = self.map.get_system_id('U-HVIX')
+        coords = self.map.node[source_id]['coords']
+        count = len(self.map.neighbors_jump(source_id, 1))
+        self.map.add_node(1, system_id=1, name='Test', region='Test', security=-1.0,
+                          coords=(coords[0] + EVE_LY / 2, coords[1], coords[2]))
+        self.assertEqual(len(self.map.neighbors_jump(source_id, 1)), count + 1)
+        self.map.remove_node(1)
+        self.assertEqual(len(self.map.neighbors_jump(source_id, 1)), count)
+
+    def test_jump_graph_ranges(self):
+        """Check the memoized jump graph gives the same neighbours as a direct query for each range"""
+        source_id = self.map.get_system_id('U-HVIX')
+        coords = self.map.node[source_id]['coords']
+        for range in [2.5, 5.0, 8.0, 10.0]:
+            expected = sorted((x, y) for x, y in self.map.spatial_index.query(coords, range)
+                              if x != source_id and self.map.node[x]['security'] < 0.45)
+            res = sorted((x['system_id'], y) for x, y in self.map.neighbors_jump(source_id, range))
+            self.assertListEqual(res, expected)
+        self.assertIn(source_id, self.map.jump_graph)
+
+    def test_neighbors_jump_highsec(self):
+        """Check highsec systems in range aren't jump destinations"""
+        source_id = self.map.get_system_id('Tama')
+        coords = self.map.node[source_id]['coords']
+        highsec = [x for x, y in self.map.systems_in_range(coords, 5) if self.map.node[x]['security'] >= 0.45]
+        self.assertTrue(highsec)
+        res = [x['system_id'] for x, y in self.map.neighbors_jump(source_id, 5)]
+        self.assertTrue(res)
+        self.assertFalse(set(res) & set(highsec))
+        self.assertListEqual([x['system_id'] for x, y in self.map.neighbors_jump(source_id, 20)
+                              if x['security'] >= 0.45], [])
+
+    def test_jump_cache(self):
+        """Check the jump graph survives a dump and load, and is rejected for different map data"""
+        source_id = self.map.get_system_id('U-HVIX')
+        expected = self.map.neighbors_jump(source_id, 5)
+        data = self.map.dump_jump_cache()
+
+        m = Map.from_json(pkgutil.get_data('dropbot', 'data/map.json'))
+        self.assertTrue(m.load_jump_cache(data))
+        self.assertEqual(len(m.jump_graph), len(self.map.jump_graph))
+        self.assertListEqual(m.neighbors_jump(source_id, 5), expected)
+        for system_id in [source_id, self.map.get_system_id('Tama'), self.map.get_system_id('Jita')]:
+            self.assertEqual(m.jump_graph.adjacency[system_id], self.map.jump_graph.adjacency[system_id])
+        self.assertLess(len(data), 8 * 1024 * 1024)
+
+        m.node[source_id]['coords'][0] += EVE_LY
+        m.reindex()
+        self.assertFalse(m.load_jump_cache(data))
+        self.assertFalse(m.load_jump_cache('garbage'))
+
+    def test_spatial_index_query(self):
+        """Check the spatial index returns systems across grid cell boundaries"""
+        index = SpatialIndex(cell_size=1.0)
+        index.insert(1, (0, 0, 0))
+        index.insert(2, (EVE_LY * 1.5, 0, 0))
+        index.insert(3, (-EVE_LY * 2.5, 0, 0))
+        self.assertEqual(len(index), 3)
+        self.assertListEqual(sorted(x for x, y in index.query((0, 0, 0), 2)), [1, 2])
+        self.assertListEqual(sorted(x for x, y in index.query((0, 0, 0), 3)), [1, 2, 3])
+        index.remove(2)
+        self.assertListEqual(sorted(x for x, y in index.query((0, 0, 0), 3)), [1, 3])
 
     def test_jump_bridge_addition(self):
         """Test addition of a jump bridge"""
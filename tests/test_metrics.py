@@ -0,0 +1,84 @@
+import requests
+from unittest import TestCase
+from dropbot.metrics import Histogram, Metrics, MetricsServer
+
+
+class HistogramTest(TestCase):
+    """
+    Tests the Histogram class
+    """
+
+    def test_observe(self):
+        histogram = Histogram(buckets=(0.1, 1.0))
+        histogram.observe(0.05)
+        histogram.observe(0.1)
+        histogram.observe(0.5, error=True)
+        histogram.observe(5)
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(histogram.count, 4)
+        self.assertEqual(histogram.errors, 1)
+        self.assertAlmostEqual(histogram.sum, 5.65)
+
+    def test_quantile(self):
+        histogram = Histogram(buckets=(0.1, 1.0))
+        self.assertIsNone(histogram.quantile(0.5))
+        for x in range(9):
+            histogram.observe(0.01)
+        histogram.observe(0.5)
+        self.assertEqual(histogram.quantile(0.5), 0.1)
+        self.assertEqual(histogram.quantile(0.95), 1.0)
+        histogram.observe(20)
+        self.assertIsNone(histogram.quantile(1.0))
+
+
+class MetricsTest(TestCase):
+    """
+    Tests the Metrics class
+    """
+
+    def setUp(self):
+        self.metrics = Metrics(buckets=(0.1, 1.0))
+
+    def test_timer(self):
+        with self.metrics.timer('command', 'route'):
+            pass
+        with self.assertRaises(ValueError):
+            with self.metrics.timer('command', 'route'):
+                raise ValueError
+        histogram = self.metrics.histogram('command', 'route')
+        self.assertEqual(histogram.count, 2)
+        self.assertEqual(histogram.errors, 1)
+
+    def test_summary(self):
+        self.metrics.observe('command', 'route', 0.05)
+        self.metrics.observe('command', 'route', 0.05, error=True)
+        self.metrics.observe('eveapi', 'CharacterID', 2)
+        self.assertEqual(self.metrics.summary(), [
+            'command route: 2 calls, 50.0% errors, avg 50ms, p95 <= 100ms',
+            'eveapi CharacterID: 1 calls, 0.0% errors, avg 2000ms, p95 > 1s',
+        ])
+        self.assertEqual(len(self.metrics.summary('eveapi')), 1)
+
+    def test_render(self):
+        self.metrics.observe('command', 'route', 0.05)
+        self.metrics.observe('command', 'route', 0.5, error=True)
+        text = self.metrics.render()
+        self.assertIn('dropbot_requests_total{group="command",name="route"} 2\n', text)
+        self.assertIn('dropbot_errors_total{group="command",name="route"} 1\n', text)
+        self.assertIn('dropbot_latency_seconds_bucket{group="command",name="route",le="0.1"} 1\n', text)
+        self.assertIn('dropbot_latency_seconds_bucket{group="command",name="route",le="1.0"} 2\n', text)
+        self.assertIn('dropbot_latency_seconds_bucket{group="command",name="route",le="+Inf"} 2\n', text)
+        self.assertIn('dropbot_latency_seconds_count{group="command",name="route"} 2\n', text)
+
+    def test_server(self):
+        self.metrics.observe('command', 'route', 0.05)
+        server = MetricsServer(self.metrics, 0)
+        server.start()
+        try:
+            resp = requests.get(server.url)
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.text, self.metrics.render())
+            self.assertEqual(requests.get(server.url.replace('/metrics', '/')).status_code, 404)
+        finally:
+            server.shutdown()
+            server.server_close()
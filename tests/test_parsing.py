@@ -0,0 +1,72 @@
+from StringIO import StringIO
+from unittest import TestCase
+
+import eveapi
+
+from dropbot.parsing import EVEAPIRowStream, eveapi_timestamp, parse_marketstat
+from tests.http_stub import marketstat_response
+
+ASSET_LIST = """<?xml version='1.0' encoding='UTF-8'?>
+<eveapi version="2">
+  <currentTime>2014-07-01 12:00:00</currentTime>
+  <result>
+    <rowset name="assets" key="itemID" columns="itemID,locationID,typeID,quantity,flag,singleton">
+      <row itemID="1" locationID="66000001" typeID="27" quantity="1" flag="0" singleton="1">
+        <rowset name="contents" key="itemID" columns="itemID,typeID,quantity,flag,singleton">
+          <row itemID="2" typeID="27" quantity="1" flag="4" singleton="0" />
+        </rowset>
+      </row>
+      <row itemID="3" locationID="60000001" typeID="34" quantity="100" flag="4" singleton="0" />
+    </rowset>
+  </result>
+  <cachedUntil>2014-07-01 18:00:00</cachedUntil>
+</eveapi>
+"""
+
+ERROR = """<?xml version='1.0' encoding='UTF-8'?>
+<eveapi version="2">
+  <currentTime>2014-07-01 12:00:00</currentTime>
+  <error code="203">Authentication failure.</error>
+  <cachedUntil>2014-07-02 12:00:00</cachedUntil>
+</eveapi>
+"""
+
+
+class EVEAPIRowStreamTest(TestCase):
+    """
+    Tests the EVEAPIRowStream class
+    """
+
+    def test_rows(self):
+        """Check only the top level rows are returned"""
+        rows = EVEAPIRowStream(StringIO(ASSET_LIST))
+        self.assertEqual([x['itemID'] for x in rows], ['1', '3'])
+
+    def test_fields(self):
+        rows = EVEAPIRowStream(StringIO(ASSET_LIST), fields=('itemID', 'typeID'))
+        self.assertEqual(list(rows), [{'itemID': '1', 'typeID': '27'}, {'itemID': '3', 'typeID': '34'}])
+
+    def test_cache_time(self):
+        rows = EVEAPIRowStream(StringIO(ASSET_LIST))
+        self.assertEqual(rows.cache_time(), 0)
+        list(rows)
+        self.assertEqual(rows.current_time, eveapi_timestamp('2014-07-01 12:00:00'))
+        self.assertEqual(rows.cache_time(), 6 * 60 * 60)
+
+    def test_error(self):
+        rows = EVEAPIRowStream(StringIO(ERROR))
+        self.assertRaises(eveapi.AuthenticationError, list, rows)
+
+
+class ParseMarketstatTest(TestCase):
+    """
+    Tests the parse_marketstat function
+    """
+
+    def test_types(self):
+        """Check every type is parsed from a multi type response"""
+        prices = parse_marketstat(StringIO(marketstat_response([34, 35, 587], sell=5.5, buy=4.25)))
+        self.assertEqual(prices, {34: (5.5, 4.25), 35: (5.5, 4.25), 587: (5.5, 4.25)})
+
+    def test_empty(self):
+        self.assertEqual(parse_marketstat(StringIO(marketstat_response([]))), {})
@@ -0,0 +1,190 @@
+import json
+import mock
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest import TestCase
+from dropbot.metrics import Metrics
+from dropbot.stomp_listener import ZKillboardStompListener
+from tests.fake_redis import FakeRedis
+from tests.stomp_stub import StubStompServer
+
+
+def fake_bot(**kwargs):
+    """Returns a stand in for DropBot with the attributes used by the listener"""
+    bot = mock.Mock()
+    bot.kill_corps = frozenset([1000001])
+    bot.kill_alliances = frozenset([99000001])
+    bot.kill_min_value = 1000000
+    bot.kill_max_age = 3600
+    bot.kills_muted = False
+    bot.redis = None
+    bot.kill_dedupe_window = 1000
+    bot.kill_dedupe_shared = False
+    bot.kill_dedupe_ttl = 3600
+    bot.stomp_heartbeat = 0
+    bot.stomp_queue_size = 100
+    bot.stomp_reconnect_max = 0.5
+    bot.kill_replay_speed = 0
+    bot.metrics = Metrics()
+    bot.call_command.return_value = ('Test Pilot (Rifter) in Jita', None)
+    for key, value in kwargs.items():
+        setattr(bot, key, value)
+    return bot
+
+
+def killmail(kill_id, victim_corp=1000002, attacker_corp=1000001, value=10000000.0, age=60, attacker_alliance=0):
+    return json.dumps({
+        'killID': kill_id,
+        'killTime': (datetime.utcnow() - timedelta(seconds=age)).strftime('%Y-%m-%d %H:%M:%S'),
+        'victim': {'corporationID': victim_corp, 'allianceID': 0},
+        'attackers': [
+            {'corporationID': 1000003, 'allianceID': 0},
+            {'corporationID': attacker_corp, 'allianceID': attacker_alliance},
+        ],
+        'zkb': {'totalValue': value},
+    })
+
+
+class ZKillboardStompListenerTest(TestCase):
+    """
+    Tests the ZKillboardStompListener class
+    """
+
+    def test_on_message(self):
+        bot = fake_bot()
+        listener = ZKillboardStompListener(bot)
+        listener.process({}, killmail(1))
+        bot.broadcast.assert_called_once_with('[KILL] Test Pilot (Rifter) in Jita')
+        self.assertEqual(bot.metrics.histogram('stomp', 'message').count, 1)
+
+    def test_loss(self):
+        bot = fake_bot()
+        ZKillboardStompListener(bot).process({}, killmail(1, victim_corp=1000001, attacker_corp=1000002))
+        self.assertTrue(bot.broadcast.call_args[0][0].startswith('[LOSS]'))
+
+    def test_untracked(self):
+        bot = fake_bot()
+        ZKillboardStompListener(bot).process({}, killmail(1, attacker_corp=1000003))
+        self.assertFalse(bot.call_command.called)
+
+    def test_muted(self):
+        bot = fake_bot(kills_muted=True)
+        ZKillboardStompListener(bot).process({}, killmail(1))
+        self.assertFalse(bot.broadcast.called)
+
+    def test_alliance(self):
+        bot = fake_bot()
+        ZKillboardStompListener(bot).process({}, killmail(1, attacker_corp=1000004, attacker_alliance=99000001))
+        self.assertTrue(bot.broadcast.call_args[0][0].startswith('[KILL]'))
+
+    def test_filters(self):
+        """Check cheap and old kills are dropped without being summarised"""
+        bot = fake_bot()
+        listener = ZKillboardStompListener(bot)
+        listener.process({}, killmail(1, value=999999.0))
+        listener.process({}, killmail(2, age=3700))
+        self.assertFalse(bot.call_command.called)
+        self.assertEqual(listener.filtered, 2)
+        listener.process({}, killmail(3, age=3500))
+        self.assertTrue(bot.call_command.called)
+
+    def test_duplicates(self):
+        bot = fake_bot(kill_dedupe_window=2)
+        listener = ZKillboardStompListener(bot)
+        for kill_id in [1, 2, 1, 2, 3, 3]:
+            listener.process({}, killmail(kill_id))
+        self.assertEqual(bot.broadcast.call_count, 3)
+        self.assertEqual(listener.duplicates, 3)
+
+    def test_shared_duplicates(self):
+        """Check listeners sharing a Redis server only post a kill once"""
+        redis = FakeRedis()
+        bots = [fake_bot(redis=redis, kill_dedupe_shared=True) for x in range(2)]
+        listeners = [ZKillboardStompListener(x) for x in bots]
+        for kill_id in [1, 2, 3]:
+            for listener in listeners:
+                listener.process({}, killmail(kill_id))
+        self.assertEqual(sum(x.broadcast.call_count for x in bots), 3)
+
+    def test_queue_full(self):
+        """Check messages are dropped and acked when the queue is full"""
+        bot = fake_bot(stomp_queue_size=2)
+        listener = ZKillboardStompListener(bot)
+        listener.conn = mock.Mock()
+        for kill_id in range(3):
+            listener.on_message({'message-id': str(kill_id), 'subscription': 'dropbot'}, killmail(kill_id))
+        self.assertEqual(listener.dropped, 1)
+        listener.conn.ack.assert_called_once_with('2', 'dropbot')
+
+
+class ZKillboardStompListenerServerTest(TestCase):
+    """
+    Tests the ZKillboardStompListener against a local stomp server
+    """
+
+    def setUp(self):
+        ZKillboardStompListener.reconnect_initial = 0.05
+        self.bot = fake_bot()
+        self.broadcasts = []
+        self.broadcasted = threading.Event()
+        self.bot.broadcast.side_effect = self.broadcast
+        self.listener = ZKillboardStompListener(self.bot)
+
+    def tearDown(self):
+        ZKillboardStompListener.reconnect_initial = 1.0
+        self.listener.stop()
+
+    def broadcast(self, text):
+        self.broadcasts.append(text)
+        self.broadcasted.set()
+
+    def wait_for(self, func, timeout=5):
+        end = time.time() + timeout
+        while time.time() < end:
+            if func():
+                return True
+            time.sleep(0.01)
+        return False
+
+    def test_consume(self):
+        with StubStompServer() as server:
+            self.listener.connect(server.url)
+            self.assertTrue(server.subscribed.wait(5))
+            server.send_message(killmail(1))
+            self.assertTrue(self.broadcasted.wait(5))
+            self.assertTrue(self.wait_for(lambda: server.acks == ['1']))
+        subscribe = [x for x in server.frames if x[0] == 'SUBSCRIBE'][0][1]
+        self.assertEqual(subscribe['ack'], 'client-individual')
+        self.assertEqual(self.listener.processed, 1)
+
+    def test_consume_error(self):
+        """Check messages which fail to process are acked and counted separately"""
+        with StubStompServer() as server:
+            self.listener.connect(server.url)
+            self.assertTrue(server.subscribed.wait(5))
+            server.send_message('not a killmail')
+            server.send_message(killmail(1))
+            self.assertTrue(self.broadcasted.wait(5))
+            self.assertTrue(self.wait_for(lambda: server.acks == ['1', '2']))
+        self.assertEqual(self.listener.stats()['processed'], 1)
+        self.assertEqual(self.listener.stats()['failed'], 1)
+
+    def test_reconnect(self):
+        """Check the listener reconnects and resumes when the connection is lost"""
+        with StubStompServer() as server:
+            self.listener.connect(server.url)
+            self.assertTrue(server.subscribed.wait(5))
+            server.drop_connections()
+            self.assertTrue(self.wait_for(lambda: server.connects == 2 and server.subscribed.is_set()))
+            server.send_message(killmail(1))
+            self.assertTrue(self.broadcasted.wait(5))
+        self.assertGreaterEqual(self.listener.reconnects, 1)
+
+    def test_heartbeat_timeout(self):
+        """Check a connection that stops sending heartbeats is replaced"""
+        self.bot.stomp_heartbeat = 1000
+        with StubStompServer(heartbeat='1000,1000') as server:
+            self.listener.connect(server.url)
+            self.assertTrue(self.wait_for(lambda: server.connects >= 2))
+        self.assertGreaterEqual(self.listener.reconnects, 1)
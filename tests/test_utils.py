@@ -1,6 +1,12 @@
 import mock
+import time
 from unittest import TestCase
-from dropbot.utils import decimal_minutes_to_hms
+import eveapi
+import requests
+from eveapi import EVEAPIConnection
+from dropbot.utils import decimal_minutes_to_hms, SubstringIndex, EVEAPIRedisCache, EVEAPISessionHandler
+from tests.fake_redis import FakeRedis
+from tests.http_stub import StubHTTPServer
 
 
 class DecimalToHMSTest(TestCase):
@@ -57,4 +63,166 @@ class DecimalToHMSTest(TestCase):
         with self.assertRaises(ValueError):
             decimal_minutes_to_hms('dsd')
         with self.assertRaises(ValueError):
-            decimal_minutes_to_hms(mock.Mock())
\ No newline at end of file
+            decimal_minutes_to_hms(mock.Mock())
+
+
+class SubstringIndexTest(TestCase):
+    """
+    Tests the SubstringIndex class
+    """
+
+    def setUp(self):
+        self.index = SubstringIndex([
+            ('1', 'Rifter'),
+            ('2', 'Rifter Blueprint'),
+            ('3', 'Jackdaw'),
+            ('4', 'Small Armor Repairer I'),
+            ('5', 'RIFTER'),
+        ])
+
+    def test_search(self):
+        """Check substring searches are case insensitive and keep the original order"""
+        self.assertListEqual(self.index.search('rift'), [('1', 'Rifter'), ('2', 'Rifter Blueprint'), ('5', 'RIFTER')])
+        self.assertListEqual(self.index.search('ARMOR rep'), [('4', 'Small Armor Repairer I')])
+        self.assertListEqual(self.index.search('daw'), [('3', 'Jackdaw')])
+        self.assertListEqual(self.index.search('zzz'), [])
+
+    def test_short_search(self):
+        """Check searches shorter than a trigram still match"""
+        self.assertListEqual(self.index.search('ja'), [('3', 'Jackdaw')])
+        self.assertEqual(len(self.index.search('r')), 4)
+
+    def test_get(self):
+        """Check exact matches return the first item with the name"""
+        self.assertEqual(self.index.get('rifter'), ('1', 'Rifter'))
+        self.assertEqual(self.index.get('jackdaw'), ('3', 'Jackdaw'))
+        self.assertIsNone(self.index.get('jack'))
+
+
+class EVEAPIRedisCacheTest(TestCase):
+    """
+    Tests the EVEAPIRedisCache class
+    """
+
+    times = mock.Mock(currentTime=1000, cachedUntil=4600)
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.doc = '<?xml version="1.0"?><eveapi>{}</eveapi>'.format('<row />' * 500)
+
+    def test_gen_key(self):
+        """Check keys don't depend on the order of the parameters"""
+        params = dict(('param{}'.format(x), x) for x in range(20))
+        self.assertEqual(EVEAPIRedisCache.gen_key('api', '/a', params),
+                         EVEAPIRedisCache.gen_key('api', '/a', dict(reversed(params.items()))))
+        self.assertNotEqual(EVEAPIRedisCache.gen_key('api', '/a', {'a': 1}),
+                            EVEAPIRedisCache.gen_key('api', '/a', {'a': 2}))
+
+    def check_roundtrip(self, cache, doc):
+        cache.store('api', '/a', {'a': 1}, doc, self.times)
+        self.assertEqual(self.redis.commands, ['SET'])
+        self.assertAlmostEqual(self.redis.expiry.values()[0] - time.time(), 3600, delta=5)
+        if cache.local is not None:
+            cache.local.delete(cache.gen_key('api', '/a', {'a': 1}))
+        self.assertEqual(cache.retrieve('api', '/a', {'a': 1}), doc)
+        return self.redis.data.values()[0]
+
+    def test_compression(self):
+        self.assertEqual(self.check_roundtrip(EVEAPIRedisCache(self.redis), self.doc)[0], 'x')
+
+    def test_bz2(self):
+        self.assertEqual(self.check_roundtrip(EVEAPIRedisCache(self.redis, compression='bz2'), self.doc)[:3], 'BZh')
+
+    def test_threshold(self):
+        """Check small documents are stored uncompressed"""
+        self.assertEqual(self.check_roundtrip(EVEAPIRedisCache(self.redis, threshold=10000), self.doc), self.doc)
+        self.assertRaises(ValueError, EVEAPIRedisCache, self.redis, compression='lzma')
+
+    def test_local(self):
+        """Check documents are served from memory, and loaded into it from Redis"""
+        cache = EVEAPIRedisCache(self.redis)
+        cache.store('api', '/a', {'a': 1}, self.doc, self.times)
+        self.assertEqual(cache.retrieve('api', '/a', {'a': 1}), self.doc)
+        self.assertEqual(self.redis.pipelines, 0)
+
+        other = EVEAPIRedisCache(self.redis)
+        self.assertEqual(other.retrieve('api', '/a', {'a': 1}), self.doc)
+        self.assertEqual(other.retrieve('api', '/a', {'a': 1}), self.doc)
+        self.assertEqual(self.redis.pipelines, 1)
+        self.assertIsNone(other.retrieve('api', '/b', {}))
+
+
+EVEAPI_CHARACTERID = """<?xml version='1.0' encoding='UTF-8'?>
+<eveapi version="2">
+  <currentTime>2014-01-01 00:00:00</currentTime>
+  <result>
+    <rowset name="characters" key="characterID" columns="name,characterID">
+      <row name="{name}" characterID="90000001" />
+    </rowset>
+  </result>
+  <cachedUntil>2014-01-01 01:00:00</cachedUntil>
+</eveapi>"""
+
+EVEAPI_ERROR = """<?xml version='1.0' encoding='UTF-8'?>
+<eveapi version="2">
+  <currentTime>2014-01-01 00:00:00</currentTime>
+  <error code="203">Authentication failure.</error>
+  <cachedUntil>2014-01-01 01:00:00</cachedUntil>
+</eveapi>"""
+
+
+class EVEAPISessionHandlerTest(TestCase):
+    """
+    Tests the EVEAPISessionHandler class against a local stub server
+    """
+
+    @staticmethod
+    def handler(path, params):
+        if path == '/eve/CharacterID.xml.aspx':
+            return 200, EVEAPI_CHARACTERID.format(name=params['names'][0])
+        return 403, EVEAPI_ERROR
+
+    def connect(self, server, cache=None):
+        handler = EVEAPISessionHandler(requests.Session(), scheme='http', cache=cache)
+        return EVEAPIConnection(server.url.rstrip('/'), cacheHandler=handler)
+
+    def test_connection_reuse(self):
+        """Check calls share a single kept alive HTTP connection"""
+        with StubHTTPServer(handler=self.handler) as server:
+            api = self.connect(server)
+            for name in ['Test A', 'Test B', 'Test C']:
+                self.assertEqual(api.eve.CharacterID(names=name).characters[0].name, name)
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual(len(server.connections), 1)
+
+    def test_cache(self):
+        redis = FakeRedis()
+        with StubHTTPServer(handler=self.handler) as server:
+            api = self.connect(server, cache=EVEAPIRedisCache(redis))
+            api.eve.CharacterID(names='Test A')
+            self.assertEqual(api.eve.CharacterID(names='Test A').characters[0].characterID, 90000001)
+        self.assertEqual(len(server.requests), 1)
+        self.assertEqual(len(redis.data), 1)
+        self.assertAlmostEqual(redis.expiry.values()[0] - time.time(), 3600, delta=5)
+
+    def test_error(self):
+        redis = FakeRedis()
+        with StubHTTPServer(handler=self.handler) as server:
+            api = self.connect(server, cache=EVEAPIRedisCache(redis))
+            self.assertRaises(eveapi.AuthenticationError, api.auth(keyID=1, vCode='x').account.APIKeyInfo)
+        self.assertEqual(len(redis.data), 0)
+
+    def test_stream(self):
+        """Check streamed calls are status checked and not cached"""
+        redis = FakeRedis()
+        with StubHTTPServer(handler=self.handler) as server:
+            handler = EVEAPISessionHandler(requests.Session(), scheme='http', cache=EVEAPIRedisCache(redis))
+            host = server.url.split('/')[2]
+            doc = handler.stream(host, '/eve/CharacterID.xml.aspx', {'names': 'Test A'}).read()
+            self.assertIn('name="Test A"', doc)
+            self.assertIn('<error', handler.stream(host, '/account/APIKeyInfo.xml.aspx', {'keyID': 1}).read())
+        self.assertEqual(len(redis.data), 0)
+
+        with StubHTTPServer(lambda path, params: (500, 'Internal Server Error')) as server:
+            handler = EVEAPISessionHandler(requests.Session(), scheme='http')
+            self.assertRaises(eveapi.ServerError, handler.stream, server.url.split('/')[2], '/corp/AssetList.xml.aspx', {})